@@ -0,0 +1,215 @@
+from paths import *
+from csv_builder import iter_papers
+
+from os.path import getsize
+import pandas as pd
+import numpy as np
+import metrics
+import profiling
+
+# the works x authors incidence matrix built by build_author_graph(), stored (like concept_scores.npz) as CSR
+# arrays: row i (openalex_ids[i]) has an entry for each author column in columns[indptr[i]:indptr[i + 1]]
+author_graph_path = f"{csvs_path}/author_graph.npz"
+
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def build_author_graph(papers_path: str = f"{csvs_path}/papers.csv", out_path: str = author_graph_path,
+                       chunksize: int = 200000):
+    """Build the sparse works x authors incidence matrix from a papers file's author_ids (one row per OpenAlex
+    work, however many CorpusIDs it's listed under), along with every author's number of ACL and non-ACL
+    works, so that author-based features of works (see aggregate()) never
+    need another pass over OpenAlex files.
+
+    Parameters
+    ----------
+        papers_path (str): path to a papers .csv or .parquet file built by csv_builder()/merge_csvs()
+        out_path (str): where to save the .npz file
+        chunksize (int): the number of papers to read at a time
+
+    Returns
+    ----------
+        None
+    """
+    openalex_ids, is_acl, counts, entries = [], [], [], []
+
+    for chunk in metrics.progress(iter_papers(papers_path, chunksize, ["openalex_id", "author_ids", "is_acl"]),
+                                  desc="Reading papers"):
+        author_ids = chunk["author_ids"]
+        if author_ids.map(lambda x: isinstance(x, str)).any():  # CSVs store a list's string repr
+            author_ids = author_ids.str.findall(r"A\d+")
+
+        flat = author_ids.explode().dropna()  # empty lists explode to a single NaN
+        openalex_ids.append(chunk["openalex_id"].to_numpy(dtype=str))
+        is_acl.append(chunk["is_acl"].astype(str).str.lower().eq("true").to_numpy())  # bool in Parquet, "True" in CSV
+        counts.append(flat.groupby(level=0).size().reindex(chunk.index, fill_value=0).to_numpy(dtype=np.int64))
+        entries.append(flat.str[1:].to_numpy(dtype=np.int64))  # A{digits}
+        metrics.inc("records", len(chunk))
+
+    # one row per work: a work listed under several CorpusIDs (see dedup.py) keeps its first row's authors,
+    # and is ACL if any of its rows is, so that no author's works are counted twice
+    codes, openalex_ids = pd.factorize(np.concatenate(openalex_ids))
+    openalex_ids = np.asarray(openalex_ids, dtype=str)
+    is_acl = pd.Series(np.concatenate(is_acl)).groupby(codes).max().to_numpy()
+    first = np.zeros(len(codes), dtype=bool)
+    first[np.unique(codes, return_index=True)[1]] = True
+    rows = np.repeat(np.arange(len(codes)), np.concatenate(counts))
+    kept = first[rows]
+    rows = codes[rows[kept]]
+    authors, columns = np.unique(np.concatenate(entries)[kept], return_inverse=True)
+
+    # an author listed twice on a work counts once; unique keys keep entries in row order
+    keys = np.unique(rows * len(authors) + columns)
+    rows, columns = keys // len(authors), keys % len(authors)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(openalex_ids)))])
+
+    acl_works = np.bincount(columns, weights=is_acl[rows], minlength=len(authors)).astype(np.int64)
+    non_acl_works = np.bincount(columns, minlength=len(authors)) - acl_works
+
+    np.savez_compressed(out_path, openalex_ids=openalex_ids, is_acl=is_acl, indptr=indptr,
+                        columns=columns.astype(np.int32), authors=authors, acl_works=acl_works,
+                        non_acl_works=non_acl_works)
+    metrics.inc("files_created")
+    metrics.inc("bytes_written", getsize(out_path))
+    print(f"{len(openalex_ids)} works x {len(authors)} authors ({len(columns)} authorships) saved to {out_path}")
+
+
+def load_author_graph(path: str = author_graph_path):
+    """Load a graph saved by build_author_graph().
+
+    Parameters
+    ----------
+        path (str): the .npz file
+
+    Returns
+    ----------
+        dict: "openalex_ids", "is_acl", "indptr", "columns", "authors" (int OpenAlex author IDs, by column),
+              "acl_works", and "non_acl_works" (by column) arrays, plus "rows" (the row of every entry)
+    """
+    with np.load(path) as f:
+        graph = {k: f[k] for k in f.files}
+    graph["rows"] = np.repeat(np.arange(len(graph["openalex_ids"])), np.diff(graph["indptr"]))
+    return graph
+
+
+def works_matvec(graph: dict, author_values):
+    """Multiply the works x authors matrix by a vector of per-author values, i.e. sum each work's authors' values.
+
+    Parameters
+    ----------
+        graph (dict): see load_author_graph()
+        author_values (np.ndarray): a value for every author column
+
+    Returns
+    ----------
+        np.ndarray: a value for every work (row)
+    """
+    return np.bincount(graph["rows"], weights=np.asarray(author_values, dtype=float)[graph["columns"]],
+                       minlength=len(graph["openalex_ids"]))
+
+
+def authors_matvec(graph: dict, work_values):
+    """Multiply the transposed (authors x works) matrix by a vector of per-work values, i.e. sum each author's
+    works' values.
+
+    Parameters
+    ----------
+        graph (dict): see load_author_graph()
+        work_values (np.ndarray): a value for every work (row)
+
+    Returns
+    ----------
+        np.ndarray: a value for every author column
+    """
+    return np.bincount(graph["columns"], weights=np.asarray(work_values, dtype=float)[graph["rows"]],
+                       minlength=len(graph["authors"]))
+
+
+def aggregate(graph: dict, author_values, how: str = "sum", empty: float = np.nan):
+    """Aggregate per-author values over each work's authors.
+
+    Parameters
+    ----------
+        graph (dict): see load_author_graph()
+        author_values (np.ndarray): a value for every author column, e.g. graph["acl_works"]
+        how (str): "sum", "mean", "max", or "min"
+        empty (float): the value for works without authors (sum gives 0 regardless)
+
+    Returns
+    ----------
+        pd.Series: the aggregate, indexed by openalex_id; e.g. df["openalex_id"].map(...)
+    """
+    if how not in ["sum", "mean", "max", "min"]: raise ValueError(f"how (= {how}) must be 'sum', 'mean', 'max', or 'min'")
+
+    n_authors = np.diff(graph["indptr"])
+    if how in ["sum", "mean"]:
+        values = works_matvec(graph, author_values)
+        if how == "mean":
+            values = np.divide(values, n_authors, out=np.full(len(values), empty), where=n_authors > 0)
+    else:
+        # reduceat over the starts of works with authors; each segment then runs to the next such work's start
+        has_authors = n_authors > 0
+        ufunc = np.maximum if how == "max" else np.minimum
+        values = np.full(len(n_authors), empty)
+        if has_authors.any():
+            values[has_authors] = ufunc.reduceat(np.asarray(author_values, dtype=float)[graph["columns"]],
+                                                 graph["indptr"][:-1][has_authors])
+
+    return pd.Series(values, index=graph["openalex_ids"], name=how)
+
+
+def author_features(graph: dict):
+    """Per-work author features, each a single matrix-vector pass over the graph.
+
+    Parameters
+    ----------
+        graph (dict): see load_author_graph()
+
+    Returns
+    ----------
+        pd.DataFrame: indexed by openalex_id, with
+            n_authors: the number of authors
+            max_acl_contribs: the most ACL works of any author (as in csv_builder(), but 0 for no authors)
+            mean_acl_contribs: the mean number of ACL works of the authors
+            acl_author_share: the fraction of authors with any ACL work
+            acl_coauthor_share: the fraction of authors who have (on any work) coauthored with an author with
+                                any ACL work, besides themselves
+    """
+    has_acl = (graph["acl_works"] > 0).astype(float)
+
+    # for each author, the ACL authors on all of their works (counting themselves once per work), minus themselves
+    acl_authors_per_work = works_matvec(graph, has_acl)
+    works_per_author = graph["acl_works"] + graph["non_acl_works"]
+    acl_coauthors = authors_matvec(graph, acl_authors_per_work) - has_acl * works_per_author
+
+    return pd.DataFrame({"n_authors": np.diff(graph["indptr"]),
+                         "max_acl_contribs": aggregate(graph, graph["acl_works"], "max", empty=0).astype(np.int64).to_numpy(),
+                         "mean_acl_contribs": aggregate(graph, graph["acl_works"], "mean").to_numpy(),
+                         "acl_author_share": aggregate(graph, has_acl, "mean").to_numpy(),
+                         "acl_coauthor_share": aggregate(graph, acl_coauthors > 0, "mean").to_numpy()},
+                        index=pd.Index(graph["openalex_ids"], name="openalex_id"))
+
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def write_author_features(graph_path: str = author_graph_path, out_path: str = f"{csvs_path}/author_features.csv"):
+    """Save author_features() as a CSV with an openalex_id column, to be joined to the papers file.
+
+    Parameters
+    ----------
+        graph_path (str): a graph saved by build_author_graph()
+        out_path (str): where to save the CSV
+
+    Returns
+    ----------
+        None
+    """
+    features = author_features(load_author_graph(graph_path))
+    features.to_csv(out_path, float_format="%.6g")
+    metrics.inc("records", len(features))
+    metrics.inc("files_created")
+    metrics.inc("bytes_written", getsize(out_path))
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,198 @@
+from synthetic import make_synthetic_corpus, serve_openalex
+
+from os import environ
+from os.path import abspath, dirname
+from tempfile import mkdtemp
+from shutil import rmtree
+from datetime import datetime
+import multiprocessing
+import importlib
+import platform
+import subprocess
+import statistics
+import argparse
+import json
+import time
+import sys
+
+try:
+    import resource  # peak RSS, where available (i.e. not on Windows)
+except ImportError:
+    resource = None
+
+# (name, module, function, kwargs) for each benchmarked stage, in pipeline order; every stage works from the
+# outputs of the stages before it. kwargs may use n_files, the number of S2ORC/Papers JSONL files
+benchmark_stages = [
+    ("extract_from_s2orc", "create_subcorpora", "extract_from_s2orc", lambda n_files: {"start": 0, "end": n_files}),
+    ("extract_from_papers", "create_subcorpora", "extract_from_papers", lambda n_files: {"start": 0, "end": n_files}),
+    ("get_openalex_info", "create_subcorpora", "get_openalex_info", lambda n_files: {}),
+    ("write_openalex_filepaths", "create_subcorpora", "write_openalex_filepaths", lambda n_files: {}),
+    ("extract_authors", "create_subcorpora", "extract_authors", lambda n_files: {}),
+    ("extract_authors_2", "create_subcorpora", "extract_authors_2", lambda n_files: {}),
+    ("make_author_csv", "csv_builder", "make_author_csv", lambda n_files: {}),
+    ("csv_builder", "csv_builder", "csv_builder", lambda n_files: {}),
+    ("csv_builder_0-5000", "csv_builder", "csv_builder", lambda n_files: {"start": 0, "end": 5000}),
+    ("csv_builder_5000-10000", "csv_builder", "csv_builder", lambda n_files: {"start": 5000, "end": 10000}),
+    ("merge_csvs", "csv_builder", "merge_csvs", lambda n_files: {}),
+]
+
+# (name, python arguments) of each command whose cold start (a fresh interpreter, run from this directory) is
+# measured by benchmark_startup(): the CLI, then each module a cli.py subcommand would import
+startup_commands = [
+    ("cli.py --help", ["cli.py", "--help"]),
+    ("import create_subcorpora", ["-c", "import create_subcorpora"]),
+    ("import csv_builder", ["-c", "import csv_builder"]),
+    ("import venue_matcher", ["-c", "import venue_matcher"]),
+    ("import pipeline", ["-c", "import pipeline"]),
+    ("nlp4sg_task1.py --help", ["../2. NLP4SG classification/nlp4sg_task1.py", "--help"]),
+    ("nlp4sg_task2.py --help", ["../2. NLP4SG classification/nlp4sg_task2.py", "--help"]),
+]
+
+
+def peak_rss_mb():
+    """Get the current process's peak resident set size, in MB (or None, where unavailable)."""
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if platform.system() != "Darwin" else peak / 1024 ** 2  # KB on Linux, bytes on macOS
+
+
+def run_stage(stage: int, endpoint: str, n_files: int, queue):
+    """Run a single benchmarked stage; called in a fresh process, so that its peak RSS is the stage's own.
+
+    Parameters
+    ----------
+        stage (int): index into benchmark_stages
+        endpoint (str): the stand-in OpenAlex works endpoint
+        n_files (int): see make_synthetic_corpus()
+        queue (multiprocessing.Queue): where to put (seconds, peak RSS in MB)
+
+    Returns
+    ----------
+        None
+    """
+    _, module_name, function_name, kwargs = benchmark_stages[stage]
+
+    import create_subcorpora  # NLP4SG_CORPORA_PATH is already set, so paths point at the synthetic corpus
+    create_subcorpora.openalex_endpoint = endpoint
+    function = getattr(importlib.import_module(module_name), function_name)
+
+    start = time.perf_counter()
+    function(**kwargs(n_files))
+    queue.put((time.perf_counter() - start, peak_rss_mb()))
+
+
+def benchmark(n_works: int, n_files: int = 2, seed: int = 0, keep: bool = False):
+    """Time every stage of the pipeline on a synthetic corpus of n_works works.
+
+    Parameters
+    ----------
+        n_works (int): see make_synthetic_corpus()
+        n_files (int): see make_synthetic_corpus()
+        seed (int): see make_synthetic_corpus()
+        keep (bool): whether to keep the synthetic corpus directory, rather than deleting it afterwards
+
+    Returns
+    ----------
+        dict: stage:{"seconds", "records", "records_per_second", "peak_rss_mb"}
+    """
+    root = mkdtemp(prefix=f"nlp4sg_bench_{n_works}_").replace("\\", "/")
+    make_synthetic_corpus(root, n_works, n_files=n_files, seed=seed)
+    server, url = serve_openalex(root)
+
+    # spawned stage processes inherit the environment, and so the synthetic corpora_path
+    previous_path = environ.get("NLP4SG_CORPORA_PATH")
+    environ["NLP4SG_CORPORA_PATH"] = root
+    context = multiprocessing.get_context("spawn")
+    results = {}
+
+    try:
+        for i, (name, *_) in enumerate(benchmark_stages):
+            queue = context.Queue()
+            process = context.Process(target=run_stage, args=(i, f"{url}/works", n_files, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0: raise RuntimeError(f"stage {name} failed (exit code {process.exitcode})")
+            seconds, peak = queue.get()
+
+            results[name] = {"seconds": round(seconds, 3), "records": n_works,
+                             "records_per_second": round(n_works / seconds, 1) if seconds else None,
+                             "peak_rss_mb": round(peak, 1) if peak else None}
+            print(f"{n_works:>9} works | {name:<24} | {seconds:9.2f}s | {results[name]['records_per_second']:>10} rec/s | " +
+                  f"{results[name]['peak_rss_mb']} MB")
+    finally:
+        server.shutdown()
+        if previous_path is None: del environ["NLP4SG_CORPORA_PATH"]
+        else: environ["NLP4SG_CORPORA_PATH"] = previous_path
+        if not keep: rmtree(root, ignore_errors=True)
+        else: print(f"kept synthetic corpus at {root}")
+
+    return results
+
+
+def benchmark_startup(repeats: int = 5):
+    """Time the cold start of each of startup_commands, i.e. how long a job waits before its stage begins.
+
+    Parameters
+    ----------
+        repeats (int): the number of times each command is run; the median is reported
+
+    Returns
+    ----------
+        dict: command:{"seconds" (median), "min_seconds"}
+    """
+    results = {}
+    for name, arguments in startup_commands:
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + arguments, cwd=dirname(abspath(__file__)), check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+
+        results[name] = {"seconds": round(statistics.median(times), 3), "min_seconds": round(min(times), 3)}
+        print(f"startup | {name:<28} | {results[name]['seconds']:7.3f}s")
+
+    return results
+
+
+def run_benchmarks(sizes: list = [1000, 10000], out_path: str = "benchmark_results.json", n_files: int = 2,
+                   seed: int = 0, keep: bool = False, startup_repeats: int = 5):
+    """Benchmark every stage at several corpus sizes, saving the results as JSON for comparison across runs.
+
+    Parameters
+    ----------
+        sizes (list): numbers of works to benchmark with
+        out_path (str): where to save the results
+        n_files (int): see make_synthetic_corpus()
+        seed (int): see make_synthetic_corpus()
+        keep (bool): see benchmark()
+        startup_repeats (int): see benchmark_startup(); 0 skips startup benchmarks
+
+    Returns
+    ----------
+        dict: the saved results
+    """
+    results = {"timestamp": datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "platform": platform.platform(),
+               "seed": seed, "n_files": n_files,
+               "startup": benchmark_startup(startup_repeats) if startup_repeats else {},
+               "sizes": {str(n): benchmark(n, n_files, seed, keep) for n in sizes}}
+
+    with open(out_path, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"saved results to {abspath(out_path)}")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each pipeline stage on synthetic corpora")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--out", type=str, default="benchmark_results.json")
+    parser.add_argument("--n_files", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic corpora")
+    parser.add_argument("--startup_repeats", type=int, default=5, help="runs per cold-start benchmark (0 to skip)")
+    args = parser.parse_args()
+
+    run_benchmarks(args.sizes, args.out, args.n_files, args.seed, args.keep, args.startup_repeats)
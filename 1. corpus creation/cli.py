@@ -0,0 +1,152 @@
+from os import environ
+from os.path import dirname, abspath
+import argparse
+import importlib
+import runpy
+import sys
+
+# a single entry point for every stage, e.g.
+#   python cli.py --corpora_path /scratch/corpora get_openalex_info --start 0 --end 1846 --verbose
+# nothing beyond the standard library is imported until a subcommand runs, and then only that subcommand's
+# module (pandas for csv_builder, torch for task 1, etc.), so --help and light stages start quickly
+
+here = dirname(abspath(__file__))
+classification_dir = f"{here}/../2. NLP4SG classification"
+
+# global options, applied through the environment before any stage module is imported (paths.py, metrics.py,
+# and profiling.py read it at import), so that subprocesses (e.g. of pipeline.py) inherit them too
+global_options = [("--corpora_path", "NLP4SG_CORPORA_PATH", "overrides paths.corpora_path"),
+                  ("--openalex_endpoint", "NLP4SG_OPENALEX_ENDPOINT", "e.g. a stand-in server (see synthetic.py)"),
+                  ("--s2_datasets_api", "NLP4SG_S2_DATASETS_API", "e.g. a stand-in server (see synthetic.py)"),
+                  ("--metrics_dir", "NLP4SG_METRICS_DIR", "write stage metrics snapshots here ('on' for datasets/metrics); off by default"),
+                  ("--profile", "NLP4SG_PROFILE", "comma-separated profile modes (cpu, mem, rss, or all)"),
+                  ("--profile_dir", "NLP4SG_PROFILE_DIR", "where profile artifacts are written"),
+                  ("--mem_budget_mb", "NLP4SG_MEM_BUDGET_MB", "warn as RSS nears this many MB")]
+
+# arguments shared by several stages; defaults are left to the stage functions themselves
+start_end = [("--start", {"type": int, "help": "first file/subdirectory (for job segmentation)"}),
+             ("--end", {"type": int, "help": "last file/subdirectory (exclusive)"})]
+delete_jsonls = [("--delete_jsonls", {"action": argparse.BooleanOptionalAction})]
+output_format = [("--output_format", {"type": str, "choices": ["csv", "parquet"]})]
+parts_dir = [("--parts_dir", {"type": str, "help": "per-JSONL CorpusID files (see merge_corpusids())"})]
+
+# subcommand:(module, function, description, arguments); every argument's dest is a keyword of the function
+stage_commands = {
+    "download_s2orc": ("create_subcorpora", "download_s2orc", "download and gunzip S2ORC JSONL files",
+                       [("--call_extract", {"action": argparse.BooleanOptionalAction}),
+                        ("--extract_works", {"action": argparse.BooleanOptionalAction})] + delete_jsonls),
+    "download_s2_papers": ("create_subcorpora", "download_s2_papers", "download and gunzip Papers JSONL files",
+                           [("--call_extract", {"action": argparse.BooleanOptionalAction})] + delete_jsonls),
+    "extract_from_s2orc": ("create_subcorpora", "extract_from_s2orc", "split S2ORC JSONLs into per-paper files",
+                           start_end + [("--extract_works", {"action": argparse.BooleanOptionalAction})] + delete_jsonls
+                           + parts_dir),
+    "extract_from_papers": ("create_subcorpora", "extract_from_papers", "split Papers JSONLs into per-paper files",
+                            start_end + [("--batch_size", {"type": int})] + delete_jsonls + parts_dir),
+    "merge_corpusids": ("create_subcorpora", "merge_corpusids", "rebuild the CorpusID files from per-JSONL files",
+                        parts_dir + [("--out_dir", {"type": str})]),
+    "apply_s2_diffs": ("create_subcorpora", "apply_s2_diffs", "update extracted files to a later release, from its diffs",
+                       [("--end_release", {"type": str, "help": "e.g. 2024-06-18, or latest"}),
+                        ("--start_release", {"type": str, "help": "defaults to the release last updated to"}),
+                        ("--datasets", {"type": str, "nargs": "+", "choices": ["s2orc", "papers"]}),
+                        ("--delete_diffs", {"action": argparse.BooleanOptionalAction})]),
+    "get_openalex_info": ("create_subcorpora", "get_openalex_info", "match papers to OpenAlex works",
+                          start_end + [("--mailto", {"type": str, "help": "defaults to credentials.mailto"}),
+                                       ("--verbose", {"action": argparse.BooleanOptionalAction}),
+                                       ("--get_ids_from_s2orc", {"action": argparse.BooleanOptionalAction}),
+                                       ("--fields", {"type": str, "nargs": "+", "help": "defaults to openalex_fields"}),
+                                       ("--full_records", {"action": argparse.BooleanOptionalAction,
+                                                           "help": "store whole OpenAlex works"})]),
+    "write_openalex_filepaths": ("create_subcorpora", "write_openalex_filepaths", "list every OpenAlex work file", []),
+    "extract_authors": ("create_subcorpora", "extract_authors", "write a file per OpenAlex author", []),
+    "extract_authors_2": ("create_subcorpora", "extract_authors_2", "write a file per OpenAlex author, in parallel", []),
+    "make_author_csv": ("csv_builder", "make_author_csv", "build authors.csv from author files", []),
+    "csv_builder": ("csv_builder", "csv_builder", "build a papers CSV (or Parquet file) for a subdirectory range",
+                    start_end + [("--threshold", {"type": float}), ("--batch_size", {"type": int}),
+                                 ("--processes", {"type": int}), ("--canonical_path", {"type": str})] + output_format),
+    "merge_csvs": ("csv_builder", "merge_csvs", "merge csv_builder outputs into a single file",
+                   [("--chunksize", {"type": int})] + output_format),
+    "extract_abstracts": ("csv_builder", "extract_abstracts", "write titles and abstracts of NLP papers for task 1",
+                          [("--papers_path", {"type": str}), ("--out_path", {"type": str, "help": ".parquet or .csv"}),
+                           ("--processes", {"type": int}), ("--chunksize", {"type": int}), ("--batch_size", {"type": int}),
+                           ("--canonical_path", {"type": str, "help": "skips duplicates (see find_duplicates)"})]),
+    "find_duplicates": ("dedup", "find_duplicates", "map duplicate papers (by title/year/first author, or OpenAlex ID) to canonical ones",
+                        [("--papers_path", {"type": str}), ("--out_path", {"type": str}), ("--chunksize", {"type": int})]),
+    "build_author_graph": ("author_graph", "build_author_graph", "build the sparse works x authors matrix from a papers file",
+                           [("--papers_path", {"type": str}), ("--out_path", {"type": str}), ("--chunksize", {"type": int})]),
+    "write_author_features": ("author_graph", "write_author_features", "write per-work author features from the graph",
+                              [("--graph_path", {"type": str}), ("--out_path", {"type": str})]),
+    "annotate_venues": ("venue_matcher", "annotate_venues", "annotate papers with Google Scholar venues",
+                        [("--papers_path", {"type": str}), ("--min_similarity", {"type": float}),
+                         ("--processes", {"type": int}), ("--chunksize", {"type": int})]),
+}
+
+# subcommand:(script, description); the script is run as __main__, with every argument after the subcommand
+script_commands = {
+    "pipeline": (f"{here}/pipeline.py", "run the out-of-date stages of the corpus pipeline (see pipeline.py)"),
+    "benchmark": (f"{here}/benchmarks.py", "benchmark stages on synthetic corpora (see benchmarks.py)"),
+    "task1": (f"{classification_dir}/nlp4sg_task1.py", "NLP4SG classification (see nlp4sg_task1.py)"),
+    "task2": (f"{classification_dir}/nlp4sg_task2.py", "SDG prediction (see nlp4sg_task2.py)"),
+}
+
+
+def make_parser():
+    """Build the argument parser, with a subcommand per stage (see stage_commands and script_commands).
+
+    Parameters
+    ----------
+        None
+
+    Returns
+    ----------
+        argparse.ArgumentParser: the parser
+    """
+    parser = argparse.ArgumentParser(description="Run a stage of the corpus creation or classification pipeline")
+    for flag, variable, help in global_options:
+        parser.add_argument(flag, type=str, default=None, help=f"{help} (sets {variable})")
+
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for command, (_, _, description, arguments) in stage_commands.items():
+        subparser = subparsers.add_parser(command, help=description, description=description)
+        for flag, kwargs in arguments:
+            subparser.add_argument(flag, default=None, **kwargs)
+
+    for command, (_, description) in script_commands.items():
+        subparsers.add_parser(command, help=description, description=description, add_help=False)
+
+    return parser
+
+
+def main(argv: list = None):
+    """Parse argv, apply the global options, then import and run the chosen subcommand.
+
+    Parameters
+    ----------
+        argv (list): command-line arguments; defaults to sys.argv[1:]
+
+    Returns
+    ----------
+        None
+    """
+    parser = make_parser()
+    args, script_args = parser.parse_known_args(argv)
+    args = vars(args)
+    for flag, variable, _ in global_options:
+        value = args.pop(flag[2:])
+        if value is not None: environ[variable] = value
+
+    command = args.pop("command")
+    if command in script_commands:  # e.g. cli.py task1 --data papers.parquet --backend onnx
+        script = script_commands[command][0]
+        sys.argv = [script] + script_args
+        sys.path.insert(0, dirname(script))
+        runpy.run_path(script, run_name="__main__")
+        return
+
+    if script_args: parser.error(f"unrecognized arguments: {' '.join(script_args)}")
+    module_name, function_name, _, _ = stage_commands[command]
+    function = getattr(importlib.import_module(module_name), function_name)
+    function(**{k: v for k, v in args.items() if v is not None})  # unset options keep the function's defaults
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,40 @@
 from paths import *
-from credentials import headers, mailto
 
-from os.path import exists
-from os import mkdir, makedirs, remove, walk
-import requests
+from os.path import exists, getsize, dirname
+from os import mkdir, makedirs, remove, replace, walk, environ
 from tqdm import tqdm 
-from urllib.request import urlretrieve as urlretrieve
 import glob
 from gzip import open as gunzip
-from shutil import copyfileobj
-from cprint import cprint 
+from shutil import copyfileobj, move, rmtree
 import ijson
 import json
 from re import sub as re_sub
 from unicodedata import normalize
 from ast import literal_eval
 from hashlib import md5
+import metrics
+import profiling
 
+# OpenAlex works API; module-level (and NLP4SG_OPENALEX_ENDPOINT, for subprocesses, e.g. of pipeline.py) so 
+# that it can be pointed at a stand-in server (see synthetic.py)
+openalex_endpoint = environ.get("NLP4SG_OPENALEX_ENDPOINT", "https://api.openalex.org/works")
+
+# Semantic Scholar datasets API (likewise overridable, for NLP4SG_S2_DATASETS_API), and the release that the
+# datasets are downloaded from; apply_s2_diffs() updates extracted files from there to later releases
+s2_datasets_api = environ.get("NLP4SG_S2_DATASETS_API", "https://api.semanticscholar.org/datasets/v1")
+s2_release = "2024-01-02"
+
+# the OpenAlex work fields that the pipeline reads (get_openalex_info() matching, extract_authors(), csv_builder(),
+# and extract_abstracts()), requested with the API's select parameter, which only takes top-level fields; the
+# stored W*.json files keep them in this order, trimmed by slim_work() to the nested fields actually used
+openalex_fields = ["id", "ids", "title", "publication_year", "publication_date", "primary_location", "authorships",
+                   "concepts", "abstract_inverted_index"]
+
+# requests, urllib.request, cprint, and credentials are imported by the stages that use them, rather than 
+# here, so that importing this module (e.g. for cli.py, or a stage that never goes online) stays fast
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
 def download_s2orc(call_extract: bool = False, extract_works: bool = True, delete_jsonls: bool = False):
     """Downloads and gunzips S2ORC JSONL files from Semantic Scholar.
 
@@ -33,14 +51,19 @@ def download_s2orc(call_extract: bool = False, extract_works: bool = True, delet
     ----------
         None
     """
+    import requests
+    from urllib.request import urlretrieve
+    from credentials import headers
+
     if not exists(s2orc_path): mkdir(s2orc_path)
 
     # while 'latest' was previously the release used, datasets after 2024-01-02 seem off-spec -- 
     # i.e. rather than there being 30 files, there are ~200-500. unclear what the cause of 
     # this is, but for now, we're relegating ourselves to using the older version, since 
     # this is presumably an issue on SemanticScholar's end
-    s2orc = "https://api.semanticscholar.org/datasets/v1/release/2024-01-02/dataset/s2orc"
+    s2orc = f"{s2_datasets_api}/release/{s2_release}/dataset/s2orc"
     db_files = requests.get(s2orc, headers=headers).json()["files"]
+    metrics.inc("http_requests")
     
     with tqdm(range(len(db_files)), desc="Downloading S2ORC") as pbar:
         for i in pbar:
@@ -48,6 +71,9 @@ def download_s2orc(call_extract: bool = False, extract_works: bool = True, delet
             s2orc_gz = s2orc_jsonl + ".gz"
             if not (exists(s2orc_jsonl) or exists(s2orc_gz)):
                 urlretrieve(db_files[i], s2orc_gz)
+                metrics.inc("http_requests")
+                metrics.inc("files_created")
+                metrics.inc("bytes_written", getsize(s2orc_gz))
             
             pbar.update(1)
 
@@ -70,6 +96,8 @@ def download_s2orc(call_extract: bool = False, extract_works: bool = True, delet
             pbar.update(1)
 
 
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
 def download_s2_papers(call_extract: bool = False, delete_jsonls: bool = False):
     """Downloads and gunzips the Semantic Scholar 'Papers' JSONL files.
 
@@ -84,16 +112,24 @@ def download_s2_papers(call_extract: bool = False, delete_jsonls: bool = False):
     ----------
         None
     """
+    import requests
+    from urllib.request import urlretrieve
+    from credentials import headers
+
     if not exists(s2_papers_db_path): mkdir(s2_papers_db_path)
 
     # L38
-    s2_papers = "https://api.semanticscholar.org/datasets/v1/release/2024-01-02/dataset/papers"
+    s2_papers = f"{s2_datasets_api}/release/{s2_release}/dataset/papers"
     db_files = requests.get(s2_papers, headers=headers).json()["files"]
+    metrics.inc("http_requests")
     for i in tqdm(range(len(db_files)), desc="Downloading Papers"): 
         papers_jsonl = f"{s2_papers_db_path}/papers-{i}.jsonl"
         papers_gz = papers_jsonl + ".gz"
         if not (exists(papers_jsonl) or exists(papers_gz)):
             urlretrieve(db_files[i], papers_gz)
+            metrics.inc("http_requests")
+            metrics.inc("files_created")
+            metrics.inc("bytes_written", getsize(papers_gz))
 
     with tqdm(glob.glob(f"{s2_papers_db_path}/*.gz"), leave=False, desc="Gunzipping Papers") as pbar:
         for f in pbar:           
@@ -113,7 +149,10 @@ def download_s2_papers(call_extract: bool = False, delete_jsonls: bool = False):
             pbar.update(1)
 
 
-def extract_from_s2orc(start: int = 0, end: int = 30, extract_works: bool = True, delete_jsonls: bool = False):
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def extract_from_s2orc(start: int = 0, end: int = 30, extract_works: bool = True, delete_jsonls: bool = False,
+                       parts_dir: str = None):
     """Using the downloaded S2ORC dataset, extract individual paper JSON files and organize
     based on whether that paper was published at ACL.
 
@@ -123,7 +162,7 @@ def extract_from_s2orc(start: int = 0, end: int = 30, extract_works: bool = True
     contents' first four CorpusID digits.
     
     This function additionally creates two txt files that store all ACL and non-ACL 
-    CorpusIDs for future use.
+    CorpusIDs for future use (or, with parts_dir, a pair per JSONL; see merge_corpusids()).
 
     Parameters
     ----------
@@ -132,6 +171,9 @@ def extract_from_s2orc(start: int = 0, end: int = 30, extract_works: bool = True
         extract_works (bool): whether to extract individual works from JSONL files; if False, 
                               still creates destination directories and grouping directories
         delete_jsonls (bool): whether to delete each JSONL file after extraction from it is complete
+        parts_dir (str): if given, each JSONL's CorpusIDs (all of them, extracted before or not) are written to
+                         {parts_dir}/s2orc-{i}.{acl|non_acl}.txt rather than appended to the shared files, so
+                         that runs over different JSONLs can't interleave writes
                               
     Returns
     ----------
@@ -145,10 +187,12 @@ def extract_from_s2orc(start: int = 0, end: int = 30, extract_works: bool = True
     s2orc_jsonls = tqdm(range(start, end))
     for i in s2orc_jsonls:
         curr_jsonl = f"{s2orc_path}/s2orc-{i}.jsonl"
+        parts = open_corpusid_parts(parts_dir, f"s2orc-{i}", ["acl", "non_acl"]) if parts_dir else None
 
         with open(curr_jsonl, encoding="utf-8") as f:
-            with tqdm(total=366000, leave=False, desc=f"Looping through {curr_jsonl.split('/')[-1]}") as pbar:  # ~366k papers per JSONL
+            with metrics.progress(total=366000, leave=False, desc=f"Looping through {curr_jsonl.split('/')[-1]}") as pbar:  # ~366k papers per JSONL
                 for l in f:  # loop through every JSON in the JSONL
+                    metrics.inc("records")
                     curr_corpusid = ""
                     curr_is_acl = False 
 
@@ -171,6 +215,7 @@ def extract_from_s2orc(start: int = 0, end: int = 30, extract_works: bool = True
                     subdir = f"{sub_a if curr_is_acl else sub_c}/{subdir_name}"
                     paper_dir = f"{subdir}/{curr_corpusid}"
                     s2orc_file = f"{paper_dir}/s2orc-{curr_corpusid}.json"
+                    if parts: parts["acl" if curr_is_acl else "non_acl"].write(f"{curr_corpusid}\n")
 
                     if not exists(s2orc_file):
                         makedirs(paper_dir, exist_ok=True)
@@ -179,18 +224,25 @@ def extract_from_s2orc(start: int = 0, end: int = 30, extract_works: bool = True
                         j = json.loads(l if extract_works else "{}")
                         with open(s2orc_file, 'w') as sf:
                             json.dump(j, sf, indent=4)
+                            metrics.inc("bytes_written", sf.tell())
                         
-                        pbar.set_description(f"Created file at {s2orc_file}")
+                        metrics.inc("files_created")
 
-                        with open(f"{datasets_path}/{'' if curr_is_acl else 'non_'}acl_corpusids.txt", 'a') as cf:
-                            cf.write(f"{curr_corpusid}\n")
+                        if not parts:
+                            with open(f"{datasets_path}/{'' if curr_is_acl else 'non_'}acl_corpusids.txt", 'a') as cf:
+                                cf.write(f"{curr_corpusid}\n")
 
                     pbar.update(1)
         
+        if parts: close_corpusid_parts(parts)
+        metrics.inc("bytes_read", getsize(curr_jsonl))
         if delete_jsonls: remove(curr_jsonl)            
 
 
-def extract_from_papers(batch_size: int = 5000, start: int = 0, end: int = 30, delete_jsonls: bool = False):
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def extract_from_papers(batch_size: int = 5000, start: int = 0, end: int = 30, delete_jsonls: bool = False,
+                        parts_dir: str = None):
     """For each paper in the Papers database, create {corpusId}.json (in either the ACL or non-ACL
     directory, as appropriate) containing Semantic Scholar info (e.g. corpusId, externalIds, etc.).
 
@@ -200,6 +252,9 @@ def extract_from_papers(batch_size: int = 5000, start: int = 0, end: int = 30, d
         start (int): which Papers JSONL file to start at (for job segmentation)
         end (int): which Papers JSONL file to end at
         delete_jsonls (bool): whether to delete each JSONL file after extraction from it is complete
+        parts_dir (str): if given, CorpusIDs are read from the S2ORC files extract_from_s2orc() wrote there, and
+                         each JSONL's CorpusIDs missing from S2ORC are written to 
+                         {parts_dir}/papers-{i}.{acl|non_acl|missing}.txt rather than appended to the shared files
     
     Returns
     ----------
@@ -212,23 +267,32 @@ def extract_from_papers(batch_size: int = 5000, start: int = 0, end: int = 30, d
     other_corpusids = set()
 
     # load ACL and non-ACL CorpusID sets from files; see L134
-    with open(f"{datasets_path}/acl_corpusids.txt") as f:
-        for line in tqdm(f, total=80000):
-            acl_corpusids.add(line.strip())
+    if parts_dir:
+        acl_files = sorted(glob.glob(f"{parts_dir}/s2orc-*.acl.txt"))
+        other_files = sorted(glob.glob(f"{parts_dir}/s2orc-*.non_acl.txt"))
+    else:
+        acl_files, other_files = [f"{datasets_path}/acl_corpusids.txt"], [f"{datasets_path}/non_acl_corpusids.txt"]
+
+    for path in acl_files:
+        with open(path) as f:
+            for line in tqdm(f, total=80000):
+                acl_corpusids.add(line.strip())
     
-    with open(f"{datasets_path}/non_acl_corpusids.txt") as f:
-        for line in tqdm(f, total=10000000):
-            other_corpusids.add(line.strip())
+    for path in other_files:
+        with open(path) as f:
+            for line in tqdm(f, total=10000000):
+                other_corpusids.add(line.strip())
 
     batch = {}  # from /path/to/make/file/at/{CorpusID}.json to paper metadata
     batched_is_acl = {}  # from /path/...{CorpusID.json} to is_acl (True or False)
 
     def write_batch():
-        with tqdm(batch, leave=False) as batch_bar:
+        with metrics.progress(batch, leave=False, desc="Writing batched files") as batch_bar:
             for file_path in batch_bar:
-                batch_bar.set_description(f'Writing file at {file_path}')
                 with open(file_path, 'w') as f2:
                     json.dump(batch[file_path], f2, indent=4)
+                    metrics.inc("bytes_written", f2.tell())
+                metrics.inc("files_created")
 
         batch.clear()
         batched_is_acl.clear() 
@@ -236,10 +300,12 @@ def extract_from_papers(batch_size: int = 5000, start: int = 0, end: int = 30, d
     papers_jsonls = tqdm(range(start, end))
     for i in papers_jsonls:
         curr_jsonl = f"{s2_papers_db_path}/papers-{i}.jsonl"
+        parts = open_corpusid_parts(parts_dir, f"papers-{i}", ["acl", "non_acl", "missing"]) if parts_dir else None
 
         with open(curr_jsonl, encoding="utf-8") as f:
-            with tqdm(total=7300000, leave=False, desc=f"Looping through {curr_jsonl.split('/')[-1]}") as pbar:
+            with metrics.progress(total=7300000, leave=False, desc=f"Looping through {curr_jsonl.split('/')[-1]}") as pbar:
                 for l in f:  # loop through every JSON in the JSONL
+                    metrics.inc("records")
                     curr_corpusid = ""
                     curr_is_acl = False 
 
@@ -256,12 +322,16 @@ def extract_from_papers(batch_size: int = 5000, start: int = 0, end: int = 30, d
                     if not curr_corpusid.strip(): continue  # missing CorpusID, somehow
                     elif not (curr_corpusid in acl_corpusids or curr_corpusid in other_corpusids):
                         # if the current CorpusID has not been seen previously, note it
-                        with open(f"{datasets_path}/missing_from_s2orc.txt", "a") as f:
-                            f.write(f"{curr_corpusid}\n")
+                        if parts:
+                            parts["missing"].write(f"{curr_corpusid}\n")
+                            parts["acl" if curr_is_acl else "non_acl"].write(f"{curr_corpusid}\n")
+                        else:
+                            with open(f"{datasets_path}/missing_from_s2orc.txt", "a") as f:
+                                f.write(f"{curr_corpusid}\n")
 
-                        # and add the CorpusID to the relevant file
-                        with open(f"{datasets_path}/{'' if curr_is_acl else 'non_'}acl_corpusids.txt", 'a') as f:
-                            f.write(f"{curr_corpusid}\n")
+                            # and add the CorpusID to the relevant file
+                            with open(f"{datasets_path}/{'' if curr_is_acl else 'non_'}acl_corpusids.txt", 'a') as f:
+                                f.write(f"{curr_corpusid}\n")
 
                     if curr_is_acl: acl_corpusids.discard(curr_corpusid)
                     else: other_corpusids.discard(curr_corpusid)
@@ -276,20 +346,337 @@ def extract_from_papers(batch_size: int = 5000, start: int = 0, end: int = 30, d
                         
                         batched_is_acl[paper_out] = curr_is_acl
                         batch[paper_out] = json.loads(l)
-
-                        pbar.set_description(f"Batched {paper_out}")
                     else:
-                        pbar.set_description(f"Not batching {paper_out}")
+                        metrics.inc("skipped_existing")
                     
                     if len(batch) >= batch_size: write_batch()
                     pbar.update(1)
         
         write_batch()  # write out any remaining files (may be < batch_size)
+        if parts: close_corpusid_parts(parts)
+        metrics.inc("bytes_read", getsize(curr_jsonl))
         if delete_jsonls: remove(curr_jsonl)
     
     write_batch()
 
 
+def open_corpusid_parts(parts_dir: str, name: str, kinds: list):
+    """Open a JSONL's CorpusID files in parts_dir for writing, as {parts_dir}/{name}.{kind}.txt.tmp; rerunning
+    the JSONL rewrites them from scratch, and close_corpusid_parts() moves them into place."""
+    makedirs(parts_dir, exist_ok=True)
+    return {kind: open(f"{parts_dir}/{name}.{kind}.txt.tmp", "w") for kind in kinds}
+
+
+def close_corpusid_parts(parts: dict):
+    """Close the files opened by open_corpusid_parts(), replacing the previous ones (so that a JSONL cut off
+    partway through never leaves a partial file for merge_corpusids())."""
+    for f in parts.values():
+        f.close()
+        replace(f.name, f.name[:-len(".tmp")])
+
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def merge_corpusids(parts_dir: str = corpusid_parts_path, out_dir: str = datasets_path):
+    """Rebuild acl_corpusids.txt, non_acl_corpusids.txt, and missing_from_s2orc.txt from the per-JSONL files
+    written by extract_from_s2orc() and extract_from_papers() with parts_dir (S2ORC files first, then Papers
+    files, each in JSONL order); a CorpusID listed more than once (e.g. missing from S2ORC, and in two Papers
+    JSONLs) is kept once.
+
+    Parameters
+    ----------
+        parts_dir (str): the per-JSONL files
+        out_dir (str): where to write the merged files
+
+    Returns
+    ----------
+        None
+    """
+    def jsonl_order(path):
+        name = path.replace("\\", "/").split("/")[-1]
+        return (not name.startswith("s2orc-"), int(name.split(".")[0].split("-")[-1]))
+
+    if not glob.glob(f"{parts_dir}/s2orc-*.txt"): raise LookupError(f"no per-JSONL CorpusID files in {parts_dir}")
+
+    for kind, out_name in [("acl", "acl_corpusids.txt"), ("non_acl", "non_acl_corpusids.txt"),
+                           ("missing", "missing_from_s2orc.txt")]:
+        seen = set()
+        out_path = f"{out_dir}/{out_name}"
+        with open(f"{out_path}.tmp", "w") as out:
+            for path in sorted(glob.glob(f"{parts_dir}/*.{kind}.txt"), key=jsonl_order):
+                with open(path) as f:
+                    for line in f:
+                        if line not in seen:
+                            seen.add(line)
+                            out.write(line)
+                metrics.inc("bytes_read", getsize(path))
+        replace(f"{out_path}.tmp", out_path)
+        metrics.inc("records", len(seen))
+        metrics.inc("files_created")
+        metrics.inc("bytes_written", getsize(out_path))
+
+
+def openalex_identifiers(paper: dict):
+    """The fields of a Papers record that get_openalex_info() matches on; if none change, neither does its match."""
+    external_ids = paper.get("externalids") or {}
+    return (external_ids.get("MAG"), external_ids.get("DOI"), paper.get("title"), paper.get("publicationdate"), 
+            paper.get("year"))
+
+
+def filter_lines(path: str, drop: set, key=lambda line: line):
+    """Rewrite a file without the lines whose key (by default, the stripped line itself) is in drop."""
+    if not exists(path) or not drop: return
+    with open(path) as f_in, open(f"{path}.tmp", "w") as f_out:
+        for line in f_in:
+            if key(line.strip()) not in drop: f_out.write(line)
+    replace(f"{path}.tmp", path)
+
+
+def apply_s2_journal(journal_path: str):
+    """Apply the bookkeeping recorded (in journal_path) while applying a Semantic Scholar diff: update the 
+    CorpusID files, forget the OpenAlex matches of changed papers, and mark them for rematching and their 
+    subdirectories for CSV rebuilds. See apply_s2_diffs().
+
+    Parameters
+    ----------
+        journal_path (str): the journal; "release {release}" (the release the diff updates to), then lines of
+                            "{event} {CorpusID}", where event is rematch, delete, acl, or non_acl (the 
+                            subcorpus that a new or moved paper is now in)
+
+    Returns
+    ----------
+        tuple: (the release, CorpusIDs to rematch, subdirectories to rebuild)
+    """
+    release, rematch, deleted, membership = None, set(), set(), {}
+    with open(journal_path) as f:
+        for line in f:
+            event, corpus_id = line.split()
+            if event == "release": release = corpus_id
+            elif event == "rematch": rematch.add(corpus_id)
+            elif event == "delete": 
+                deleted.add(corpus_id)
+                membership[corpus_id] = None
+            else: membership[corpus_id] = event
+
+    # every changed CorpusID is removed from both files, then re-added to the right one
+    changed = set(membership)
+    for is_acl in [True, False]:
+        corpusids_path = f"{datasets_path}/{'' if is_acl else 'non_'}acl_corpusids.txt"
+        filter_lines(corpusids_path, changed)
+        with open(corpusids_path, "a") as f:
+            for corpus_id, subcorpus in membership.items():
+                if subcorpus == ("acl" if is_acl else "non_acl"): f.write(f"{corpus_id}\n")
+
+    # forgetting a CorpusID's match means that the next get_openalex_info() over its subdirectory matches it afresh
+    forget = rematch | deleted
+    for path in glob.glob(f"{datasets_path}/openalex_found_*.txt") + glob.glob(f"{datasets_path}/openalex_unfound_*.txt"):
+        filter_lines(path, forget)
+    filter_lines(f"{datasets_path}/openalex_paths.txt", forget, key=lambda path: path.split("/")[-2])
+
+    rematch -= deleted
+    rebuild = sorted({corpus_id[:4] for corpus_id in forget})
+    for path, marked in [(f"{datasets_path}/openalex_rematch_{release}.txt", rematch), 
+                         (f"{datasets_path}/csv_rebuild_{release}.txt", rebuild)]:
+        if not marked: continue
+        with open(path, "a+") as f:  # both datasets' diffs (and replayed journals) may mark the same papers
+            f.seek(0)
+            already = {line.strip() for line in f}
+            for item in sorted(set(marked) - already): f.write(f"{item}\n")
+
+    metrics.inc("rematch", len(rematch))
+    return release, rematch, rebuild
+
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def apply_s2_diffs(end_release: str = "latest", start_release: str = None, datasets: list = ["s2orc", "papers"],
+                   delete_diffs: bool = True):
+    """Update the extracted S2ORC and Papers files from one Semantic Scholar release to another by applying
+    release-to-release diffs (updated and deleted records), rather than downloading and extracting both
+    datasets again. Only the paper directories named in the diffs, and the CorpusID files, are touched.
+
+    New and deleted papers, papers whose ACL status changed (which are moved to the other subcorpus), and 
+    papers whose OpenAlex identifiers (see openalex_identifiers()) changed have their OpenAlex files removed,
+    and their CorpusIDs removed from openalex_found/unfound_*.txt and openalex_paths.txt, so that the next 
+    get_openalex_info() over their subdirectories rematches them; they're listed in openalex_rematch_{release}.txt,
+    and their subdirectories (whose csv_builder() rows are stale) in csv_rebuild_{release}.txt. After that, 
+    write_openalex_filepaths() and csv_builder() over those subdirectories bring the CSVs up to date (pipeline.py
+    reruns all of these by itself, since their inputs have changed).
+
+    Parameters
+    ----------
+        end_release (str): the release to update to, e.g. "2024-06-18", or "latest"
+        start_release (str): the release the extracted files are at; defaults to the one recorded by the 
+                             previous call (in s2_releases.json), or else s2_release
+        datasets (list): the datasets to update, "s2orc" and/or "papers"
+        delete_diffs (bool): whether to delete each diff file after applying it
+    
+    Returns
+    ----------
+        dict: dataset:{"release", "rematch" (CorpusIDs), "csv_rebuild" (subdirectories)}
+    """
+    import requests
+    from urllib.request import urlretrieve
+    from credentials import headers
+
+    releases_path = f"{datasets_path}/s2_releases.json"
+    journal_path = f"{datasets_path}/s2_diffs_journal.txt"
+    releases = {}
+    if exists(releases_path):
+        with open(releases_path) as f:
+            releases = json.load(f)
+
+    if exists(journal_path):  # a previous call was interrupted while applying a diff, which is applied again
+        apply_s2_journal(journal_path)
+        remove(journal_path)
+
+    journal = None
+
+    def note(event: str, corpus_id: str):  # journaled before the change it describes is made
+        journal.write(f"{event} {corpus_id}\n")
+        journal.flush()
+
+    def forget_match(corpus_id: str, paper_dir: str):
+        note("rematch", corpus_id)
+        for path in glob.glob(f"{paper_dir}/W*.json") + glob.glob(f"{paper_dir}/NOT_IN_OPENALEX"):
+            remove(path)
+
+    def locate(corpus_id: str):  # the paper's directory in either subcorpus, if it has one
+        for subcorpus in [sub_a, sub_c]:
+            paper_dir = f"{subcorpus}/{corpus_id[:4]}/{corpus_id}"
+            if exists(paper_dir): return paper_dir
+        return None
+
+    def place(corpus_id: str, is_acl: bool):  # the paper's directory, moved to (or made in) the right subcorpus
+        paper_dir = f"{sub_a if is_acl else sub_c}/{corpus_id[:4]}/{corpus_id}"
+        current_dir = locate(corpus_id)
+        if current_dir == paper_dir: return paper_dir
+
+        note("acl" if is_acl else "non_acl", corpus_id)
+        if current_dir:  # ACL status changed; get_openalex_info() records it in the OpenAlex file, too
+            makedirs(dirname(paper_dir), exist_ok=True)
+            move(current_dir, paper_dir)
+        else:
+            makedirs(paper_dir)
+        forget_match(corpus_id, paper_dir)
+        return paper_dir
+
+    def update(dataset: str, record: dict):
+        corpus_id = str(record["corpusid"])
+        external_ids = record.get("externalids") or {}
+
+        if dataset == "papers":  # Papers is the authority on ACL status, as in extract_from_papers()
+            paper_dir = place(corpus_id, bool(external_ids.get("ACL")))
+            paper_out = f"{paper_dir}/{corpus_id}.json"
+            if exists(paper_out):
+                with open(paper_out) as f:
+                    if openalex_identifiers(json.load(f)) != openalex_identifiers(record): forget_match(corpus_id, paper_dir)
+            else:
+                forget_match(corpus_id, paper_dir)  # matched from S2ORC until now, if at all
+        else:  # S2ORC files stay wherever the paper already is; only new papers are placed by S2ORC's ACL ID
+            paper_dir = locate(corpus_id) or place(corpus_id, bool(external_ids.get("acl")))
+            paper_out = f"{paper_dir}/s2orc-{corpus_id}.json"
+
+        with open(paper_out, "w") as f:
+            json.dump(record, f, indent=4)
+            metrics.inc("bytes_written", f.tell())
+        metrics.inc("updated")
+
+    def delete(dataset: str, record: dict):
+        corpus_id = str(record["corpusid"])
+        paper_dir = locate(corpus_id)
+        if paper_dir is None: return
+
+        paper_file = f"{paper_dir}/{corpus_id}.json" if dataset == "papers" else f"{paper_dir}/s2orc-{corpus_id}.json"
+        if not exists(paper_file): return
+        
+        if not (exists(f"{paper_dir}/{corpus_id}.json") and exists(f"{paper_dir}/s2orc-{corpus_id}.json")):
+            note("delete", corpus_id)  # in neither dataset anymore
+            rmtree(paper_dir)
+        else:
+            if dataset == "papers": forget_match(corpus_id, paper_dir)  # to be matched from S2ORC instead
+            remove(paper_file)
+        metrics.inc("deleted")
+
+    results = {}
+    for dataset in datasets:
+        start = start_release or releases.get(dataset, s2_release)
+        results[dataset] = {"release": start, "rematch": set(), "csv_rebuild": set()}
+        if start == end_release: continue
+
+        response = requests.get(f"{s2_datasets_api}/diffs/{start}/to/{end_release}/{dataset}", headers=headers)
+        metrics.inc("http_requests")
+        response.raise_for_status()
+
+        for diff in response.json()["diffs"]:
+            diff_dir = f"{s2_diffs_path}/{dataset}/{diff['from_release']}_{diff['to_release']}"
+            makedirs(diff_dir, exist_ok=True)
+            journal = open(journal_path, "a")
+            journal.write(f"release {diff['to_release']}\n")
+
+            # updates first, then deletions, as Semantic Scholar specifies
+            for kind, apply in [("update", update), ("delete", delete)]:
+                for i, url in enumerate(tqdm(diff[f"{kind}_files"], desc=f"Applying {dataset} {kind}s ({diff['to_release']})")):
+                    diff_gz = f"{diff_dir}/{kind}-{i}.jsonl.gz"
+                    if not exists(diff_gz):
+                        urlretrieve(url, f"{diff_gz}.part")  # renamed once complete, so a partial file is never applied
+                        replace(f"{diff_gz}.part", diff_gz)
+                        metrics.inc("http_requests")
+                    
+                    with gunzip(diff_gz, "rt", encoding="utf-8") as f:
+                        for l in metrics.progress(f, leave=False, desc=diff_gz.split("/")[-1]):
+                            metrics.inc("records")
+                            apply(dataset, json.loads(l))
+                    
+                    metrics.inc("bytes_read", getsize(diff_gz))
+                    if delete_diffs: remove(diff_gz)
+
+            journal.close()
+            _, rematch, rebuild = apply_s2_journal(journal_path)
+            results[dataset]["rematch"] |= rematch
+            results[dataset]["csv_rebuild"] |= set(rebuild)
+            results[dataset]["release"] = releases[dataset] = diff["to_release"]
+
+            with open(f"{releases_path}.tmp", "w") as f:
+                json.dump(releases, f, indent=4)
+            replace(f"{releases_path}.tmp", releases_path)
+            remove(journal_path)  # only once the release is recorded; an interrupted call replays it
+        
+        tqdm.write(f"{dataset}: at release {results[dataset]['release']}; {len(results[dataset]['rematch'])} papers " + 
+                   f"to rematch, {len(results[dataset]['csv_rebuild'])} subdirectories to rebuild")
+
+    return {dataset: {"release": result["release"], "rematch": sorted(result["rematch"]), 
+                      "csv_rebuild": sorted(result["csv_rebuild"])} for dataset, result in results.items()}
+
+
+def slim_work(work: dict, fields: list = openalex_fields):
+    """Trim an OpenAlex work to the slim schema stored by get_openalex_info(): the given top-level fields, in
+    order, with primary_location, authorships, and concepts cut down to the nested fields the pipeline reads.
+
+    Parameters
+    ----------
+        work (dict): an OpenAlex work, as returned by the API (with or without select)
+        fields (list): the top-level fields to keep; see openalex_fields
+
+    Returns
+    ----------
+        dict: the slim work
+    """
+    slim = {}
+    for field in fields:
+        value = work.get(field)
+        match field:
+            case "primary_location" if value:  # the venue
+                source = value.get("source")
+                value = {"source": {"display_name": source.get("display_name")} if source else None}
+            case "authorships" if value:
+                value = [{"author": {"id": a["author"]["id"]}} for a in value if (a.get("author") or {}).get("id")]
+            case "concepts" if value:
+                value = [{"id": c["id"], "score": c["score"]} for c in value]
+        slim[field] = value
+    return slim
+
+
 def process_title(title: str):
     """Normalizes and cleans the provided paper title.
     
@@ -311,8 +698,30 @@ def process_title(title: str):
     return w
 
 
-def get_openalex_info(mailto: str = mailto, verbose: bool = False, start: int = 0, end: int = 10000,
-                      get_ids_from_s2orc: bool = True):
+def process_titles(titles):
+    """Vectorized process_title(), for a whole column of titles at once (see dedup.py).
+
+    Parameters
+    ----------
+        titles (pd.Series): titles; missing titles stay missing
+    
+    Returns
+    ----------
+        pd.Series: the processed titles
+    """
+    # object dtype, so that the patterns run through re (Unicode \d and \w, as in process_title()) rather than
+    # pyarrow's RE2, where they're ASCII-only
+    return (titles.astype(object).str.normalize("NFKC").str.lower()
+            .str.replace(r"\d+", " ", regex=True)
+            .str.replace(r"[^\w ]", " ", regex=True)
+            .str.replace(r" {2,}", " ", regex=True)
+            .str.strip())
+
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def get_openalex_info(mailto: str = None, verbose: bool = False, start: int = 0, end: int = 10000,
+                      get_ids_from_s2orc: bool = True, fields: list = None, full_records: bool = False):
     """Loop through every paper exctracted from S2ORC and/or Papers, matching it to its OpenAlex
     equivalent. Create a file W{OpenAlexID}.json for each, which contains the found OpenAlex 
     metadata.
@@ -322,16 +731,25 @@ def get_openalex_info(mailto: str = mailto, verbose: bool = False, start: int =
     
     Parameters
     ----------
-        mailto (str): the email associated with OpenAlex (if any; registering one increases query rate limit)
+        mailto (str): the email associated with OpenAlex (if any; registering one increases query rate limit);
+                      defaults to credentials.mailto
         verbose (bool): 
         start (int): the subdirectory to begin with (first four digits of CorpusID; for job segmentation)
         end (int): the subdirectory to end with
         get_ids_from_s2orc (bool): whether to use CorpusIDs from S2ORC works that didn't have a match in Papers
+        fields (list): the top-level work fields to request and store; defaults to openalex_fields (id, ids, and
+                       title are always included, since matching needs them)
+        full_records (bool): whether to request and store whole OpenAlex works, as they come from the API, rather
+                             than the slim schema (see slim_work())
     
     Returns 
     ----------
         None 
     """
+    import requests
+    from cprint import cprint
+    if mailto is None: from credentials import mailto
+
     # create files to track whether a given CorpusID has been found or failed in OpenAlex
     found_ids_filepath = f"{datasets_path}/openalex_found_{start}-{end}.txt"
     unfound_ids_filepath = f"{datasets_path}/openalex_unfound_{start}-{end}.txt"
@@ -360,11 +778,15 @@ def get_openalex_info(mailto: str = mailto, verbose: bool = False, start: int =
         #       somewhat unlikely edge case since S2ORC info should always = Papers, but possible
         paper_path = f"{sub_a if is_acl else sub_c}/{unfound_corpus_id[:4]}/{unfound_corpus_id}/NOT_IN_OPENALEX"
         with open(paper_path, 'w') as f: pass
+        metrics.inc("unfound")
 
-    endpoint = "https://api.openalex.org/works"
+    endpoint = openalex_endpoint
     # "Where do you get your API key, you ask? For now, please just use an MD5 hash of your email address."
     api_key = md5(mailto.encode("utf-8")).hexdigest() 
     params = {"mailto": mailto, "api_key": api_key, "per-page": 100}
+    if not full_records:  # only transfer (and store) the fields used downstream
+        fields = list(dict.fromkeys(["id", "ids", "title"] + (fields or openalex_fields)))
+        params["select"] = ",".join(fields)
     
     batches = {"mag": {}, "doi": {}, "date": {}, "year": {}, "title": {}}
     batches_info = {}  # {CorpusID: {"mag": ..., "doi": ..., etc.}}; raw identifiers for batched CorpusIDs
@@ -394,11 +816,16 @@ def get_openalex_info(mailto: str = mailto, verbose: bool = False, start: int =
                 while 'results' not in results:  # loop until successful query complete
                     if verbose: tqdm.write('Looping until batch results successfully queried')
                     try:
-                        results = requests.get(endpoint, params=params)
+                        metrics.inc("http_requests", identifier=identifier)
+                        with metrics.timer("http_latency", identifier=identifier):
+                            results = requests.get(endpoint, params=params)
                         if verbose: tqdm.write(f"{results.request.url}")
                         results = results.json()
-                        if 'error' in results.keys(): tqdm.write(f"error in openalex results: {results['error']} \nmessage: {results['message']}")
+                        if 'error' in results.keys(): 
+                            metrics.inc("http_errors", identifier=identifier)
+                            tqdm.write(f"error in openalex results: {results['error']} \nmessage: {results['message']}")
                     except:
+                        metrics.inc("retries", identifier=identifier)
                         if verbose: 
                             tqdm.write(f'Trying requests.get again, id={identifier}')
                             tqdm.write(params["filter"])
@@ -448,11 +875,16 @@ def get_openalex_info(mailto: str = mailto, verbose: bool = False, start: int =
                     while 'results' not in results:
                         if verbose: tqdm.write('Starting a while loop')
                         try:
-                            results = requests.get(endpoint, params=params)
+                            metrics.inc("http_requests", identifier=identifier)
+                            with metrics.timer("http_latency", identifier=identifier):
+                                results = requests.get(endpoint, params=params)
                             if verbose: tqdm.write(f"{results.request.url}")
                             results = results.json()
-                            if 'error' in results.keys(): tqdm.write(f"error in openalex results: {results['error']} \nmessage: {results['message']}")
+                            if 'error' in results.keys(): 
+                                metrics.inc("http_errors", identifier=identifier)
+                                tqdm.write(f"error in openalex results: {results['error']} \nmessage: {results['message']}")
                         except:
+                            metrics.inc("retries", identifier=identifier)
                             if verbose: 
                                 tqdm.write(f'Trying requests.get again, id={identifier}')
                                 tqdm.write(params["filter"])
@@ -489,7 +921,11 @@ def get_openalex_info(mailto: str = mailto, verbose: bool = False, start: int =
             paper_path = f"{sub_a if r['isACL'] else sub_c }/{corpus_id[:4]}/{corpus_id}/{openalex_id}.json"
             
             with open(paper_path, "w") as f:
-                json.dump(r, f, indent=4)
+                if full_records: json.dump(r, f, indent=4)
+                else: json.dump({**{k: r[k] for k in ["isACL", "corpusId", "foundVia"]}, **slim_work(r, fields)}, f)
+                metrics.inc("bytes_written", f.tell())
+            metrics.inc("files_created")
+            metrics.inc("found", identifier=identifier)
             
             with open(found_ids_filepath, 'a') as f:
                 f.write(f"{corpus_id}\n")
@@ -658,7 +1094,7 @@ def get_openalex_info(mailto: str = mailto, verbose: bool = False, start: int =
 
                 check_batch("title", verbose=verbose)
 
-    pbar = tqdm(total=int(11000000/(10000/(end-start))), desc="Looping through papers")
+    pbar = metrics.progress(total=int(11000000/(10000/(end-start))), desc="Looping through papers")
 
     for subcorpus in [sub_a, sub_c]:
         is_acl = subcorpus == sub_a 
@@ -680,7 +1116,9 @@ def get_openalex_info(mailto: str = mailto, verbose: bool = False, start: int =
                 # if the OpenAlex data has already been found/failed, skip
                 curr_corpusid = paper.split("/")[-2] 
 
+                metrics.inc("records")
                 if curr_corpusid in found_ids or curr_corpusid in unfound_ids:
+                    metrics.inc("cache_hits")  # matched (or failed to match) in a previous run
                     pbar.update(1)
                     continue                
                 
@@ -709,7 +1147,10 @@ def get_openalex_info(mailto: str = mailto, verbose: bool = False, start: int =
                     paper = paper.replace("\\", "/")
                     curr_corpusid = paper.split("/")[-2]
 
-                    if curr_corpusid in found_ids or curr_corpusid in unfound_ids:
+                    # also skip papers still batched from their Papers entry, so a CorpusID is never in two batches
+                    metrics.inc("records")
+                    if curr_corpusid in found_ids or curr_corpusid in unfound_ids or curr_corpusid in batches_info:
+                        metrics.inc("cache_hits")
                         pbar.update(1)
                         continue
 
@@ -752,6 +1193,8 @@ def get_openalex_info(mailto: str = mailto, verbose: bool = False, start: int =
     cprint(f"Finished {start}-{end} for both Subcorpus A and Subcorpus C", c="g")
 
 
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
 def extract_authors():
     """Create an author file for every author present in OpenAlex files. Each author file contains the OpenAlex ID 
     of ACL and non-ACL paper that they have written.
@@ -777,12 +1220,15 @@ def extract_authors():
     makedirs(authors_path, exist_ok=True)
     
     papers = glob.iglob(f"{corpora_path}/subcorpus_*/*/*/W*.json")  
-    for paper in tqdm(papers, total=11000000, desc="Extracting authors from all papers"):
+    for paper in metrics.progress(papers, total=11000000, desc="Extracting authors from all papers"):
+        metrics.inc("records")
         paper = paper.replace("\\", "/")
         paper_split = paper.split('/')
         corpus_id = paper_split[-2]
 
-        if corpus_id in seen_papers:  continue  # don't duplicate author contribs!
+        if corpus_id in seen_papers:  # don't duplicate author contribs!
+            metrics.inc("cache_hits")
+            continue
 
         paper_is_acl = False if paper_split[-4] == 'subcorpus_c' else True
         authors = []
@@ -793,7 +1239,7 @@ def extract_authors():
             for prefix, event, value in parser:
                 if prefix == 'authorships.item.author.id':
                     authors.append(value.split('/')[-1])
-                if prefix == 'countries_distinct_count':
+                if prefix in ['countries_distinct_count', 'concepts']:  # past authorships, in full or slim works
                     break
         
         for author_id in authors:
@@ -806,8 +1252,10 @@ def extract_authors():
             try: # if an author has been extracted previously, we should append/modify their file
                 with open(author_file, "r") as f: 
                     author_dict = json.load(f)
+                    metrics.inc("bytes_read", f.tell())
             except FileNotFoundError:
                 author_dict = {"acl_papers": [], "non_acl_papers": []}
+                metrics.inc("files_created")
             
             # cast to sets for extra insurance against duplicate papers
             acl_papers = set(author_dict["acl_papers"])  
@@ -822,12 +1270,15 @@ def extract_authors():
 
             with open(author_file, "w") as f: 
                 json.dump(author_dict, f, indent=4)
+                metrics.inc("bytes_written", f.tell())
 
         seen_papers.add(corpus_id)
         with open(seen_papers_filepath, "a") as f:
             f.write(f"{corpus_id}\n")
     
 
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
 def write_openalex_filepaths():
     openalex_paths = f"{datasets_path}/openalex_paths.txt"
 
@@ -837,6 +1288,7 @@ def write_openalex_filepaths():
                 for filename in files: 
                     if filename[0] == "W":
                         f.write(dir.replace("\\", "/") + "/" + filename + "\n")
+                        metrics.inc("records")
 
 
 
@@ -866,10 +1318,12 @@ def extract_author_ids(f):
     for prefix, event, value in parser:
         if prefix == 'authorships.item.author.id':
             authors.append(value.split('/')[-1])
-        if prefix == 'countries_distinct_count':
+        if prefix in ['countries_distinct_count', 'concepts']:
             break
     return authors
 
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
 def extract_authors_2():
     from multiprocessing import Pool
             
@@ -893,6 +1347,7 @@ def extract_authors_2():
         print('')
         with Pool() as pool:
             results = pool.map(process_file, paths)
+            metrics.inc("records", len(paths))  # pool workers' own counters aren't collected
             for result in tqdm(results, desc='updating authors_dict with pool results'):
                 for author_info in result:
                     update_authors_dict(authors_dict, author_info)
@@ -907,6 +1362,8 @@ def extract_authors_2():
             makedirs(subdir_path, exist_ok=True)
             with open(f"{subdir_path}/{author_id}.json", "w") as f:
                 json.dump(papers, f, indent=4)
+                metrics.inc("bytes_written", f.tell())
+            metrics.inc("files_created")
     
     def remove_dupes(authors_dict):
         for author in tqdm(authors_dict, desc='Removing dupes'):
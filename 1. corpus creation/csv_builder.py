@@ -1,22 +1,42 @@
 from paths import *
 
-from os.path import exists
+from os.path import exists, getsize, getmtime
 from os import makedirs, listdir
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from tqdm import tqdm 
 import glob
 import ijson
 import json
-from multiprocessing import Pool
+from multiprocessing import Pool, get_start_method
 from ast import literal_eval
+import metrics
+import profiling
 
-csv_columns = ["title", "corpus_id", "openalex_id", "author_ids", "venue", "is_acl", "is_nlp", 
+csv_columns = ["title", "corpus_id", "openalex_id", "author_ids", "venue", "year", "is_acl", "is_nlp", 
                "max_acl_contribs", "openalex_path", "s2orc_path"]
 
+# typed equivalent of csv_columns, for output_format="parquet"
+papers_schema = pa.schema([("title", pa.string()), ("corpus_id", pa.int64()), ("openalex_id", pa.string()),
+                           ("author_ids", pa.list_(pa.string())), ("venue", pa.dictionary(pa.int32(), pa.string())),
+                           ("year", pa.int64()), ("is_acl", pa.bool_()), ("is_nlp", pa.bool_()), 
+                           ("max_acl_contribs", pa.int64()), ("openalex_path", pa.string()), ("s2orc_path", pa.string())])
+
+# classifier input written by extract_abstracts(), i.e. nlp4sg_task1.py's task1_columns plus where each 
+# abstract came from ("s2orc", "openalex", or null if neither had one)
+abstracts_schema = pa.schema([("corpus_id", pa.int64()), ("openalex_id", pa.string()), ("title", pa.string()),
+                              ("abstract", pa.string()), ("abstract_source", pa.dictionary(pa.int32(), pa.string()))])
+
 # OpenAlex concepts that we consider indicative of "NLP" content
 concepts = {'C204321447', 'C41895202', 'C23123220', 'C203005215', 'C119857082', 
             'C186644900', 'C28490314', 'C2777530160', 'C137293760'}
 
+# a single nonzero entry of the works x concepts score matrix; see save_concept_scores()
+concept_score_dtype = [("concept", np.int64), ("score", np.float64)]
+
 def process_author_file(path):
     """Given the path to an author's file, extract and return its data as a dictionary.
 
@@ -39,6 +59,8 @@ def process_author_file(path):
             'non_acl_papers': [int(id) for id in j['non_acl_papers']]}
 
 
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
 def make_author_csv():
     """Collate OpenAlex author info into a single CSV.
 
@@ -58,11 +80,141 @@ def make_author_csv():
     with Pool() as pool:
         results = pool.map(process_author_file, author_files)
     
+    metrics.inc("records", len(results))
+    
     df = pd.DataFrame(results, columns=author_columns)
     df.to_csv(f"{csvs_path}/authors.csv")
+    metrics.inc("files_created")
+
+
+# AuthorID -> number of ACL papers; module-level so that csv_builder() pool workers inherit it on fork 
+# (or, under spawn, receive one pickled copy through the pool initializer) rather than a copy with every subdir
+author_acl_contribs = {}
+
+
+@profiling.profiled(profiles_path)
+def load_author_acl_contribs():
+    """Load authors.csv into a dictionary mapping each AuthorID to their number of ACL contributions.
+
+    Parameters
+    ----------
+        None 
+
+    Returns
+    ----------
+        dict: AuthorID (int):number of ACL papers (int)
+    """
+    tqdm.write('Loading authors CSV...')
+    author_df = pd.read_csv(f"{csvs_path}/authors.csv", usecols=['AuthorID', 'acl_papers'])
+    contribs = dict(zip(author_df['AuthorID'], author_df['acl_papers'].map(lambda x: len(literal_eval(x)))))
+    tqdm.write('Loaded authors CSV!')
+
+    return contribs
+
+
+def init_csv_worker(contribs: dict = None):
+    """Pool initializer for csv_builder(); shares the author lookup with each worker process.
+
+    Parameters
+    ----------
+        contribs (dict): see load_author_acl_contribs(); None (under fork) keeps the inherited lookup
+
+    Returns
+    ----------
+        None
+    """
+    global author_acl_contribs
+    if contribs is not None: author_acl_contribs = contribs
+
+
+def process_work(work: str, threshold: float):
+    """Extract a single row of the papers CSV from an OpenAlex W*.json file.
+
+    Parameters
+    ----------
+        work (str): path to an OpenAlex W*.json file
+        threshold (float): see csv_builder()
+
+    Returns
+    ----------
+        dict: csv_columns:values for the work, plus concept_scores, a list of (numeric concept ID, score) 
+              for every concept tagged on the work (see save_concept_scores())
+    """
+    work_row = {"openalex_path": work, "openalex_id": work.split("/")[-1].split(".")[0],
+                "author_ids": [], "year": None, "max_acl_contribs": 0, "is_nlp": False, "concept_scores": []}
+    
+    with open(work) as w:
+        parser = ijson.parse(w)
+        last_concept = None
+        
+        for prefix, event, value in parser:
+            match prefix:
+                case "isACL": 
+                    work_row["is_acl"] = value  # set during get_openalex_info()
+                case "corpusId": 
+                    work_row["corpus_id"] = value  # CorpusID
+                    work_row["s2orc_path"] = "/".join(work.split("/")[:-1]) + f"/s2orc-{value}.json"  # path to associated s2orc file
+                case "title": 
+                    work_row["title"] = value
+                case "publication_year":
+                    work_row["year"] = value
+                case "primary_location.source.display_name":  # venue where work was published
+                    work_row["venue"] = value
+                case "authorships.item.author.id":  # add each author from the paper to author_ids
+                    author_id = value.split("/")[-1]
+                    work_row["author_ids"].append(author_id)
+
+                    # if, somehow, the author was not put in authors.csv, mark as -1
+                    acl_contribs = author_acl_contribs.get(int(author_id[1:]), -1)
+
+                    # store number of ACL contribs from the author who has most contributed to ACL
+                    work_row["max_acl_contribs"] = max(work_row["max_acl_contribs"], acl_contribs)  
+                case "concepts.item.id": 
+                    last_concept = value.split("/")[-1]
+                case "concepts.item.score":  # if work is not yet NLP, check if the current concept is NLP and above the "NLP" threshold
+                    # compared as the same float64 that's saved, so that recompute_is_nlp() agrees exactly
+                    # (ijson gives a Decimal, and Decimal("0.7") > 0.7 even though float64 0.7 isn't)
+                    score = float(value)
+                    work_row["concept_scores"].append((int(last_concept[1:]), score))
+                    if not work_row["is_nlp"] and last_concept in concepts and score > threshold: 
+                        work_row["is_nlp"] = True
+                case "locations_count" | "abstract_inverted_index":  # past the fields used, in full or slim works
+                    break
+    
+    return work_row
+
+
+def process_subdir(subdir: str, works: list, threshold: float, show_progress: bool = True):
+    """Extract rows from all OpenAlex files in a single four-digit subdirectory.
+
+    Parameters
+    ----------
+        subdir (str): the subdirectory (first four digits of CorpusID)
+        works (list): paths to the subdirectory's OpenAlex W*.json files
+        threshold (float): see csv_builder()
+        show_progress (bool): whether to display a progress bar for the subdirectory's works
+
+    Returns
+    ----------
+        list: a row (dict) for each work
+    """
+    rows = []
+    
+    with metrics.progress(works, leave=False, desc=f"Extracting from {subdir}/", disable=not show_progress) as pbar:
+        for work in pbar:
+            rows.append(process_work(work, threshold))
 
+    return rows
 
-def csv_builder(threshold: float = 0.0, start: int = 0, end: int = 10000, batch_size: int = 1000):
+
+def _process_subdir_star(args):  # Pool.imap only passes a single argument
+    return process_subdir(*args, show_progress=False)
+
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def csv_builder(threshold: float = 0.0, start: int = 0, end: int = 10000, batch_size: int = 1000, 
+                processes: int = 1, output_format: str = "csv", canonical_path: str = None):
     """Navigate through each OpenAlex metadata JSON file, extracting key information and appending to a 
     master data CSV. Utilize authors.csv to determine which author has the most ACL contributions, adding
     this information to the CSV as well.
@@ -73,28 +225,30 @@ def csv_builder(threshold: float = 0.0, start: int = 0, end: int = 10000, batch_
         start (int): the subdirectory to begin with (first four digits of CorpusID; for job segmentation)
         end (int): the subdirectory to end with
         batch_size (int): the number of works to add to the dataframe at once (rather than one at a time)
+        processes (int): the number of worker processes to hand subdirectories to; 1 processes subdirectories 
+                         in sequence, None uses every available core
+        output_format (str): "csv", or "parquet" for a typed file (see papers_schema)
+        canonical_path (str): a canonical ID mapping (see dedup.find_duplicates()), whose redundant works are skipped
     
     Returns
     ----------
         None
     """
     if threshold < 0 or threshold > 1: raise ValueError(f"threshold (= {threshold}) must be between 0.0 and 1.0")
+    if output_format not in ["csv", "parquet"]: raise ValueError(f"output_format (= {output_format}) must be 'csv' or 'parquet'")
     if not exists(csvs_path): makedirs(csvs_path)
 
-    df = pd.DataFrame(columns=csv_columns)
-
-    tqdm.write('Loading authors CSV...')
-    author_df = pd.read_csv(f"{csvs_path}/authors.csv", usecols=['AuthorID', 'acl_papers', 'non_acl_papers'],      
-                            index_col='AuthorID')
-    author_df.sort_index(inplace=True)
-    tqdm.write('Loaded authors CSV!')
-
-    subdirs = tqdm([str(x) for x in range(start, end)], leave=False)
+    init_csv_worker(load_author_acl_contribs())
     
     with open(f"{datasets_path}/openalex_paths.txt") as f:
         openalex_paths = {l.strip() for l in tqdm(f, desc='loading openalex paths')}
         openalex_works_dict = {}
 
+        if canonical_path:  # .../{CorpusID}/W{OpenAlexID}.json
+            from dedup import redundant_rows
+            redundant = {f"{c}/{w}.json" for c, w in redundant_rows(canonical_path)}
+            openalex_paths = {p for p in openalex_paths if "/".join(p.split("/")[-2:]) not in redundant}
+
         for path in tqdm(openalex_paths, desc='sorting openalex paths'):
             subdir = path.split('/')[-3]  # four-digit CorpusID substring
             
@@ -105,96 +259,504 @@ def csv_builder(threshold: float = 0.0, start: int = 0, end: int = 10000, batch_
         
         del openalex_paths  # remove file from memory
 
-    for subdir in subdirs:
-        subdirs.set_description(f"Looping through {subdir}/ in all subcorpora")
-        batch = []
-        
-        num_works = 0  # display total number of works to be processed for the subdir
+    # if subdir doesn't exist in either subcorpus, or has no OpenAlex files, skip it
+    subdirs = [str(x) for x in range(start, end) 
+               if (exists(f"{sub_a}/{x}") or exists(f"{sub_c}/{x}")) and str(x) in openalex_works_dict]
+    
+    frames = []  # one DataFrame per batch; concatenated once at the end, rather than once per batch
+    batch = []
+    concept_chunks = []  # one concept_score_dtype array per batch, as with frames
+    concept_counts = []  # number of concepts per work, in row order
+    batch_concepts = []
+
+    def flush():
+        frames.append(pd.DataFrame(batch, columns=csv_columns))
+        concept_chunks.append(np.array(batch_concepts, dtype=concept_score_dtype))
+        batch.clear()
+        batch_concepts.clear()
+
+    def collect(rows):
+        metrics.inc("records", len(rows))  # counted here, since pool workers' own counters aren't collected
+        for row in rows:
+            work_concepts = row.pop("concept_scores")
+            concept_counts.append(len(work_concepts))
+            batch_concepts.extend(work_concepts)
+            batch.append(row)
+
+            if len(batch) >= batch_size: flush()
+
+    if processes == 1:
+        for subdir in metrics.progress(subdirs, desc="Looping through subdirs in all subcorpora"):
+            collect(process_subdir(subdir, openalex_works_dict[subdir], threshold))
+    else:
+        tasks = [(subdir, openalex_works_dict[subdir], threshold) for subdir in subdirs]
+        del openalex_works_dict  # workers only need their own subdir's paths
+
+        # forked workers inherit the read-only author lookup as it is at pool creation, so it's only pickled to 
+        # them (once each) under spawn; imap (rather than imap_unordered) keeps each partition's output in 
+        # subdir order
+        initargs = () if get_start_method() == "fork" else (author_acl_contribs,)
+        with Pool(processes, initializer=init_csv_worker, initargs=initargs) as pool:
+            results = pool.imap(_process_subdir_star, tasks)
+            for rows in metrics.progress(results, total=len(tasks), desc="Looping through subdirs in all subcorpora"):
+                collect(rows)
+    
+    flush()  # any remaining works (may be < batch_size)
+    df = pd.concat(frames, ignore_index=True)
+    df["year"] = df["year"].astype("Int64")  # rather than float, for works without a year
 
-        if exists(f"{sub_a}/{subdir}"): num_works += len(listdir(f"{sub_a}/{subdir}/"))
-        elif exists(f"{sub_c}/{subdir}"): num_works += len(listdir(f"{sub_c}/{subdir}/"))
-        else: continue  # if subdir doesn't exist, skip it
+    if start > 0 or end < 10000:
+        out_path = f"{csvs_path}/papers_subcsv_{start}-{end}.{output_format}"
+        scores_path = f"{csvs_path}/concept_scores_{start}-{end}.npz"
+    else:  # if no custom range was set, store df in a single, complete file
+        out_path = f"{csvs_path}/papers.{output_format}"
+        scores_path = f"{csvs_path}/concept_scores.npz"
 
-        if subdir not in openalex_works_dict: continue  # if subdir doesn't exist, skip it
-        
-        works = openalex_works_dict[subdir]  # OpenAlex files present for subdir in either sub_a or sub_c
-        pbar = tqdm(total=num_works, leave=False)
+    save_concept_scores(scores_path, df["openalex_id"], concept_counts, np.concatenate(concept_chunks))
 
-        for work in works:
-            pbar.set_description(f"Extracting from {work}")
-            work_row = {"openalex_path": work, "openalex_id": work.split("/")[-1].split(".")[0],
-                        "author_ids": [], "max_acl_contribs": 0, "is_nlp": False}
-            
-            with open(work) as w:
-                parser = ijson.parse(w)
-                last_concept = None
-                
-                for prefix, event, value in parser:
-                    match prefix:
-                        case "isACL": 
-                            work_row["is_acl"] = value  # set during get_openalex_info()
-                        case "corpusId": 
-                            work_row["corpus_id"] = value  # CorpusID
-                            work_row["s2orc_path"] = "/".join(work.split("/")[:-1]) + f"/s2orc-{value}.json"  # path to associated s2orc file
-                        case "title": 
-                            work_row["title"] = value
-                        case "primary_location.source.display_name":  # venue where work was published
-                            work_row["venue"] = value
-                        case "authorships.item.author.id":  # add each author from the paper to author_ids
-                            author_id = value.split("/")[-1]
-                            work_row["author_ids"].append(author_id)
-
-                            try: 
-                                acl_contribs = len(literal_eval(author_df.loc[int(author_id[1:])]['acl_papers']))
-                            except KeyError:  # if, somehow, the author was not put in the author_df
-                                acl_contribs = -1
-
-                            # store number of ACL contribs from the author who has most contributed to ACL
-                            work_row["max_acl_contribs"] = max(work_row["max_acl_contribs"], acl_contribs)  
-                        case "concepts.item.id": 
-                            if not work_row["is_nlp"]:  # if work is not yet considered NLP, continue checking concepts
-                                last_concept = value.split("/")[-1]
-                        case "concepts.item.score":  # if work is not yet NLP, check if the current concept is NLP and above the "NLP" threshold
-                            if not work_row["is_nlp"] and last_concept in concepts and value > threshold: 
-                                work_row["is_nlp"] = True
-                        case "locations_count":
-                            break
-            
-            pbar.update(1)
-            batch.append(work_row)
+    if output_format == "parquet":
+        with pq.ParquetWriter(out_path, papers_schema) as writer:
+            write_papers_parquet(writer, df)
+    else:
+        df.to_csv(out_path, index=False)
+    metrics.inc("files_created", 2)
+    metrics.inc("bytes_written", getsize(out_path) + getsize(scores_path))
 
-            if len(batch) >= batch_size:
-                df = pd.concat([df, pd.DataFrame(batch)], ignore_index=True)
-                batch = []
 
-        df = pd.concat([df, pd.DataFrame(batch)], ignore_index=True)  # update df with all works from current subdir
+def save_concept_scores(path: str, openalex_ids, counts: list, entries):
+    """Save every work's OpenAlex concept scores as a sparse (CSR) works x concepts matrix, so that 
+    is_nlp can be recomputed (see recompute_is_nlp()) without reparsing OpenAlex files.
 
-    if start > 0 or end < 10000:
-        df.to_csv(f"{csvs_path}/papers_subcsv_{start}-{end}.csv")
-    else:  # if no custom range was set, store df in a single, complete CSV
-        df.to_csv(f"{csvs_path}/papers.csv")
+    Parameters
+    ----------
+        path (str): where to save the .npz file
+        openalex_ids (list-like): OpenAlex IDs of the matrix's rows, in the same order as csv_builder()'s rows
+        counts (list): the number of concepts for each work
+        entries (np.ndarray): concept_score_dtype entries for all works, in row order
+
+    Returns
+    ----------
+        None
+    """
+    indptr = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+    np.savez_compressed(path, openalex_ids=np.asarray(openalex_ids, dtype=str), indptr=indptr, 
+                        concepts=entries["concept"], scores=entries["score"])
 
 
-def merge_csvs():
-    """Combine any/all papers_subcsv_{start}-{end}.csv CSVs into a single CSV. Used to assemble 
-    results of job-based csb_builder() calls.
+@profiling.profiled(profiles_path)
+def load_concept_scores(paths: list = None):
+    """Load (and, for job-based csv_builder() calls, stack) concept score matrices.
 
     Parameters
     ----------
-        None 
+        paths (list): .npz files saved by csv_builder(); if None, either concept_scores.npz (from a full 
+                      csv_builder() run) or the concept_scores_{start}-{end}.npz files of job-based runs in 
+                      csvs_path, whichever was written more recently, but never both (their works would overlap)
+
+    Returns
+    ----------
+        dict: "openalex_ids", "indptr", "concepts", and "scores" arrays (see save_concept_scores())
+    """
+    if paths is None: 
+        full = [f"{csvs_path}/concept_scores.npz"] if exists(f"{csvs_path}/concept_scores.npz") else []
+        ranged = sorted(glob.glob(f"{csvs_path}/concept_scores_*-*.npz"), key=subcsv_key)
+        newest = lambda files: max((getmtime(f) for f in files), default=-1)
+        paths = full if newest(full) >= newest(ranged) else ranged
+    
+    parts = [np.load(path) for path in paths]
+    offsets = np.cumsum([0] + [len(p["concepts"]) for p in parts[:-1]])
+    
+    return {"openalex_ids": np.concatenate([p["openalex_ids"] for p in parts]),
+            "indptr": np.concatenate([[0]] + [p["indptr"][1:] + o for p, o in zip(parts, offsets)]),
+            "concepts": np.concatenate([p["concepts"] for p in parts]),
+            "scores": np.concatenate([p["scores"] for p in parts])}
+
+
+@profiling.profiled(profiles_path)
+def recompute_is_nlp(concept_scores: dict, threshold: float = 0.0, nlp_concepts: set = concepts):
+    """Decide is_nlp for every work, as csv_builder() would have for the given threshold and concepts, but
+    as a single vectorized pass over the concept score matrix.
+
+    Parameters
+    ----------
+        concept_scores (dict): see load_concept_scores()
+        threshold (float): OpenAlex concept similarity threshold, to be considered an "NLP" paper
+        nlp_concepts (set): OpenAlex concept IDs (e.g. "C204321447") considered indicative of "NLP" content
+
+    Returns
+    ----------
+        pd.Series: is_nlp (bool), indexed by (unique) openalex_id; e.g. df["openalex_id"].map(...). A work 
+                   saved more than once (e.g. by overlapping job ranges) is NLP if any of its copies is
+    """
+    if threshold < 0 or threshold > 1: raise ValueError(f"threshold (= {threshold}) must be between 0.0 and 1.0")
+
+    n_works = len(concept_scores["openalex_ids"])
+    rows = np.repeat(np.arange(n_works), np.diff(concept_scores["indptr"]))  # row of every entry
+    
+    nlp_ids = np.array([int(c[1:]) for c in nlp_concepts], dtype=np.int64)
+    hits = np.isin(concept_scores["concepts"], nlp_ids) & (concept_scores["scores"] > threshold)
+    is_nlp = np.bincount(rows[hits], minlength=n_works) > 0
+
+    return pd.Series(is_nlp, index=concept_scores["openalex_ids"], name="is_nlp").groupby(level=0).max()
+
+
+def normalize_papers(df):
+    """Coerce a papers DataFrame (built by csv_builder(), or read back from a CSV or Parquet file) to 
+    csv_columns, with author_ids as lists and typed is_acl/is_nlp flags.
+
+    Parameters
+    ----------
+        df (pd.DataFrame): papers rows
+
+    Returns
+    ----------
+        pd.DataFrame: the normalized rows
+    """
+    df = df.reindex(columns=csv_columns)  # consistent column order, whatever the source
+    
+    # CSVs store author_ids as a list's string repr; Parquet as arrays
+    df["author_ids"] = df["author_ids"].map(lambda x: literal_eval(x) if isinstance(x, str) 
+                                            else [] if x is None or isinstance(x, float) else list(x))
+    for flag in ["is_acl", "is_nlp"]:
+        df[flag] = df[flag].astype("boolean")
+    df["year"] = df["year"].astype("Int64")  # missing in older files, or for works without one
+
+    return df
+
+
+def write_papers_parquet(writer, df, row_group_size: int = 100000):
+    """Write papers rows to an open Parquet file, NLP and non-NLP works in separate row groups; since 
+    each row group's is_nlp statistics are then a single value, readers filtering on is_nlp (e.g. 
+    pq.read_table(..., filters=[("is_nlp", "==", True)])) skip every non-matching row group unread.
+
+    Parameters
+    ----------
+        writer (pq.ParquetWriter): a writer opened with papers_schema
+        df (pd.DataFrame): papers rows; see normalize_papers()
+        row_group_size (int): the maximum number of rows per row group
     
     Returns
     ----------
         None
     """
-    merged_csv = pd.DataFrame(columns=csv_columns)
+    table = pa.Table.from_pandas(normalize_papers(df), preserve_index=False).cast(papers_schema)
+
+    for flag in [True, False]:
+        group = table.filter(pc.equal(table["is_nlp"], flag))
+        if group.num_rows: writer.write_table(group, row_group_size=row_group_size)
+
+
+def iter_papers(path: str, chunksize: int, columns: list = csv_columns):
+    """Read a papers CSV or Parquet file chunksize rows at a time.
+
+    Parameters
+    ----------
+        path (str): path to a .csv or .parquet papers file
+        chunksize (int): the number of rows per chunk
+        columns (list): which columns to read (where present)
+
+    Returns
+    ----------
+        generator: pd.DataFrame chunks
+    """
+    if path.endswith(".parquet"):
+        pf = pq.ParquetFile(path)
+        present = [c for c in columns if c in pf.schema_arrow.names]
+        for batch in pf.iter_batches(batch_size=chunksize, columns=present):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=lambda c: c in columns, chunksize=chunksize)
+
+
+def filter_unseen(ids, seen: list):
+    """Find which IDs have not been seen before (in seen, or earlier in ids), and add them to seen. IDs 
+    are stored as sorted int64 arrays, i.e. 8 bytes per unique ID, regardless of how many are merged.
+
+    seen is kept as a few sorted runs of decreasing length: a new run is merged into the last one while that 
+    one is no longer than it (like carrying in a binary counter), so each ID is only copied O(log n) times 
+    over a merge, rather than once per chunk, and there are at most log2(n) runs to search.
+
+    Parameters
+    ----------
+        ids (np.ndarray): int64 IDs to check, in order
+        seen (list): sorted int64 arrays of the IDs seen so far (initially []); updated in place
+
+    Returns
+    ----------
+        np.ndarray: boolean mask of unseen ids
+    """
+    unseen = ~pd.Series(ids).duplicated().to_numpy()  # keep only the first of any repeats
+    for run in seen:
+        pos = np.searchsorted(run, ids).clip(max=len(run) - 1)
+        unseen &= run[pos] != ids
+
+    new = np.sort(ids[unseen])
+    while seen and len(seen[-1]) <= len(new):
+        new = np.sort(np.concatenate([seen.pop(), new]), kind="stable")
+    if len(new): seen.append(new)
+
+    return unseen
+
+
+def count_rows(path: str):
+    """Count the rows of a papers CSV or Parquet file, independently of iter_papers() (from Parquet metadata,
+    or by reading a single CSV column)."""
+    if path.endswith(".parquet"): return pq.ParquetFile(path).metadata.num_rows
+    return sum(len(chunk) for chunk in pd.read_csv(path, usecols=["corpus_id"], chunksize=1000000))
+
+
+def subcsv_key(path: str):
+    """Sort key for papers_subcsv_{start}-{end}.csv paths, i.e. by start, then end."""
+    return tuple(int(x) for x in path.split("_")[-1].split(".")[0].split("-"))
+
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def merge_csvs(chunksize: int = 200000, output_format: str = "csv"):
+    """Combine any/all papers_subcsv_{start}-{end}.csv (or .parquet) files into a single file. Used 
+    to assemble results of job-based csb_builder() calls.
+
+    Subcsvs are streamed in order of their subdirectory range, chunksize rows at a time, and appended 
+    to the merged file; rows whose corpus_id or openalex_id was already written (e.g. from overlapping 
+    job ranges), or is missing, are dropped. Leftover index columns from older subcsvs are dropped as well.
+    Afterwards, the merged file is checked against the subcsvs: its row count (as read back from disk) plus 
+    the rows dropped must equal the subcsvs' own row counts, and it must hold no duplicate IDs.
+
+    Parameters
+    ----------
+        chunksize (int): the number of rows to read from a subcsv at a time
+        output_format (str): "csv", or "parquet" for a typed file (see papers_schema)
+    
+    Returns
+    ----------
+        dict: the reconciliation (see reconcile_merge())
+    """
+    if output_format not in ["csv", "parquet"]: raise ValueError(f"output_format (= {output_format}) must be 'csv' or 'parquet'")
+
+    subcsvs = sorted(glob.glob(f"{csvs_path}/papers_subcsv_*-*.csv") + glob.glob(f"{csvs_path}/papers_subcsv_*-*.parquet"), 
+                     key=subcsv_key)
+    merged_path = f"{csvs_path}/papers_merged.{output_format}"
+    writer = pq.ParquetWriter(merged_path, papers_schema) if output_format == "parquet" else None
     
-    # combine all subcsvs into one single, complete CSV
-    for csv in glob.iglob(f"{csvs_path}/papers_sub*"):
-        df = pd.read_csv(csv)
-        merged_csv = pd.concat([merged_csv, df], ignore_index=True)
+    seen_corpus_ids, seen_openalex_ids = [], []  # see filter_unseen()
+    counts = {"read": 0, "missing_id": 0, "dupe_corpus_id": 0, "dupe_openalex_id": 0, "written": 0}
+    header = True
+
+    for csv in tqdm(subcsvs, desc="Merging subcsvs"):
+        file_rows = 0
+
+        for chunk in iter_papers(csv, chunksize):
+            chunk = normalize_papers(chunk)
+            file_rows += len(chunk)
+
+            keep = chunk["corpus_id"].notna() & chunk["openalex_id"].astype("string").str.fullmatch(r"W\d+").fillna(False)
+            counts["missing_id"] += int((~keep).sum())
+            chunk = chunk[keep.to_numpy(dtype=bool)]
+
+            keep = filter_unseen(chunk["corpus_id"].to_numpy(dtype=np.int64), seen_corpus_ids)
+            counts["dupe_corpus_id"] += int((~keep).sum())
+            chunk = chunk[keep]
 
-    merged_csv.to_csv(f"{csvs_path}/papers_merged.csv")
+            openalex_ids = chunk["openalex_id"].str[1:].to_numpy(dtype=np.int64)  # W{digits}
+            keep = filter_unseen(openalex_ids, seen_openalex_ids)
+            counts["dupe_openalex_id"] += int((~keep).sum())
+            chunk = chunk[keep]
+
+            if writer: 
+                write_papers_parquet(writer, chunk)
+            else:
+                chunk.to_csv(merged_path, mode="w" if header else "a", header=header, index=False)
+                header = False
+            counts["written"] += len(chunk)
+
+        counts["read"] += file_rows
+        metrics.inc("records", file_rows)
+        metrics.inc("bytes_read", getsize(csv))
+        tqdm.write(f"{csv.split('/')[-1]}: {file_rows} rows")
+    
+    if writer: writer.close()
+    metrics.inc("files_created")
+    metrics.inc("bytes_written", getsize(merged_path) if exists(merged_path) else 0)
+    
+    dropped = counts["missing_id"] + counts["dupe_corpus_id"] + counts["dupe_openalex_id"]
+    tqdm.write(f"Read {counts['read']} rows from {len(subcsvs)} subcsvs; dropped {counts['missing_id']} rows " +
+               f"missing an ID, {counts['dupe_corpus_id']} duplicate corpus_ids, and {counts['dupe_openalex_id']} " + 
+               f"duplicate openalex_ids; wrote {counts['written']} rows to {merged_path}")
+    return reconcile_merge(subcsvs, merged_path, dropped)
+
+
+def reconcile_merge(subcsvs: list, merged_path: str, dropped: int):
+    """Check a merged papers file against the subcsvs it was merged from, with counts taken from the files 
+    themselves rather than from the merge: the subcsvs' rows must equal the merged file's rows plus those 
+    dropped, and the merged file must hold no duplicate corpus_ids or openalex_ids.
+
+    Parameters
+    ----------
+        subcsvs (list): paths to the subcsvs
+        merged_path (str): path to the merged file
+        dropped (int): the number of rows the merge dropped
+
+    Returns
+    ----------
+        dict: "subcsv_rows", "merged_rows", "dropped", "dupe_corpus_ids", "dupe_openalex_ids", and "ok"
+    """
+    subcsv_rows = sum(count_rows(csv) for csv in subcsvs)
+    merged_rows = count_rows(merged_path) if exists(merged_path) else 0
+    dupes = {"dupe_corpus_ids": 0, "dupe_openalex_ids": 0}
+    if merged_rows:
+        ids = pd.concat(iter_papers(merged_path, 1000000, ["corpus_id", "openalex_id"]), ignore_index=True)
+        dupes = {"dupe_corpus_ids": int(ids["corpus_id"].duplicated().sum()), 
+                 "dupe_openalex_ids": int(ids["openalex_id"].duplicated().sum())}
+
+    ok = subcsv_rows == merged_rows + dropped and not any(dupes.values())
+    if not ok:
+        tqdm.write(f"WARNING: merge does not reconcile: subcsvs have {subcsv_rows} rows; {merged_path} has " +
+                   f"{merged_rows}, plus {dropped} dropped; {dupes['dupe_corpus_ids']} duplicate corpus_ids and " +
+                   f"{dupes['dupe_openalex_ids']} duplicate openalex_ids remain")
+    return {"subcsv_rows": subcsv_rows, "merged_rows": merged_rows, "dropped": dropped, **dupes, "ok": ok}
+
+
+def s2orc_spans(path: str):
+    """Get the title and abstract of an extracted S2ORC file, by slicing its text with the offsets in its
+    annotations (as get_openalex_info() does for titles). The file is parsed as a stream, and only up to 
+    the title and abstract annotations; the remaining annotations (often the bulk of the file) are skipped.
+
+    Parameters
+    ----------
+        path (str): path to an s2orc-{CorpusID}.json file
+
+    Returns
+    ----------
+        tuple: (title, abstract); either is None if the file (or its annotation) is missing
+    """
+    text, spans = None, {}
+    try:
+        with open(path, "rb") as f:
+            for prefix, event, value in ijson.parse(f):
+                if prefix == "content.text": text = value
+                elif prefix in ("content.annotations.title", "content.annotations.abstract"):
+                    spans[prefix.split(".")[-1]] = json.loads(value) if value else None
+                    if len(spans) == 2: break
+    except FileNotFoundError:  # e.g. a Papers-only work
+        return None, None
+    if not text: return None, None
+
+    def first_span(name):
+        if not spans.get(name): return None
+        span = text[int(spans[name][0]["start"]):int(spans[name][0]["end"])].strip()
+        return span or None
+
+    return first_span("title"), first_span("abstract")
+
+
+def openalex_abstract(path: str):
+    """Rebuild the abstract of an OpenAlex W*.json file from its abstract_inverted_index (word:positions).
+
+    Parameters
+    ----------
+        path (str): path to an OpenAlex W*.json file
+
+    Returns
+    ----------
+        str: the abstract, or None if the work has none
+    """
+    try:
+        with open(path, "rb") as f:
+            index = next(ijson.items(f, "abstract_inverted_index"), None)
+    except FileNotFoundError:
+        return None
+    if not index: return None
+
+    words = [None] * (max(p for positions in index.values() for p in positions) + 1)
+    for word, positions in index.items():
+        for p in positions: words[p] = word
+    return " ".join(w for w in words if w is not None) or None
+
+
+def extract_text(works: list):
+    """Get the title, abstract, and abstract source of each of a batch of works; see extract_abstracts().
+
+    Parameters
+    ----------
+        works (list): (title, s2orc_path, openalex_path) of each work
+
+    Returns
+    ----------
+        list: (title, abstract, abstract_source) of each work
+    """
+    rows = []
+    for title, s2orc_path, openalex_path in works:
+        s2orc_title, abstract = s2orc_spans(s2orc_path) if isinstance(s2orc_path, str) else (None, None)
+        source = "s2orc" if abstract else None
+        if not abstract and isinstance(openalex_path, str):
+            abstract = openalex_abstract(openalex_path)
+            source = "openalex" if abstract else None
+        rows.append((s2orc_title or title, abstract, source))
+    return rows
+
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def extract_abstracts(papers_path: str = f"{csvs_path}/papers.csv", out_path: str = f"{csvs_path}/task1_input.parquet",
+                      processes: int = None, chunksize: int = 100000, batch_size: int = 500, canonical_path: str = None):
+    """Write the title and abstract of every is_nlp paper to a compact file that nlp4sg_task1.py can classify 
+    directly (e.g. --data datasets/csvs/task1_input.parquet), so that neither it nor anything after it needs the
+    full-text documents. Titles and abstracts are sliced from S2ORC files (see s2orc_spans()); works with no
+    S2ORC abstract fall back to OpenAlex's abstract_inverted_index, and works with no S2ORC title to the papers
+    file's (OpenAlex) title. Papers are streamed chunksize rows at a time, and files are read in parallel, 
+    batch_size works per task.
+
+    Parameters
+    ----------
+        papers_path (str): path to a papers .csv or .parquet file built by csv_builder()/merge_csvs()
+        out_path (str): where to write the classifier input; .parquet (see abstracts_schema) or .csv
+        processes (int): the number of worker processes; None uses every available core
+        chunksize (int): the number of papers to read (and write) at a time
+        batch_size (int): the number of works per worker task
+        canonical_path (str): a canonical ID mapping (see dedup.find_duplicates()), whose redundant papers are skipped
+
+    Returns
+    ----------
+        None
+    """
+    columns = ["corpus_id", "openalex_id", "title", "is_nlp", "s2orc_path", "openalex_path"]
+    writer = pq.ParquetWriter(out_path, abstracts_schema) if out_path.endswith(".parquet") else None
+    header = True
+    sources = {"s2orc": 0, "openalex": 0, None: 0}
+    if canonical_path:
+        from dedup import redundant_rows, drop_redundant
+        redundant = redundant_rows(canonical_path)
+
+    with Pool(processes) as pool:
+        for chunk in iter_papers(papers_path, chunksize, columns):
+            chunk = chunk[chunk["is_nlp"].astype(str).str.lower() == "true"]  # bool in Parquet, "True" in CSV
+            if canonical_path: chunk = drop_redundant(chunk, redundant)
+            works = list(zip(chunk["title"], chunk["s2orc_path"], chunk["openalex_path"]))
+            batches = [works[i:i + batch_size] for i in range(0, len(works), batch_size)]
+
+            rows = [row for batch in metrics.progress(pool.imap(extract_text, batches), total=len(batches), leave=False,
+                                                       desc="Extracting abstracts") for row in batch]
+            out = pd.DataFrame({"corpus_id": chunk["corpus_id"].to_numpy(), "openalex_id": chunk["openalex_id"].to_numpy(),
+                                "title": [r[0] for r in rows], "abstract": [r[1] for r in rows], 
+                                "abstract_source": [r[2] for r in rows]})
+            for source in sources: sources[source] += sum(r[2] == source for r in rows)
+            metrics.inc("records", len(out))
+
+            if writer:
+                writer.write_table(pa.Table.from_pandas(out, preserve_index=False).cast(abstracts_schema))
+            else:
+                out.to_csv(out_path, mode="w" if header else "a", header=header, index=False)
+                header = False
+
+    if writer: writer.close()
+    elif header: pd.DataFrame(columns=abstracts_schema.names).to_csv(out_path, index=False)  # no NLP papers at all
+    metrics.inc("files_created")
+    metrics.inc("bytes_written", getsize(out_path))
+    for source, count in sources.items(): metrics.inc("abstracts", count, source=source or "none")
+
+    total = sum(sources.values())
+    tqdm.write(f"Wrote {total} papers to {out_path}: {sources['s2orc']} abstracts from S2ORC, {sources['openalex']} " + 
+               f"from OpenAlex, {sources[None]} without an abstract")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,150 @@
+from paths import *
+from csv_builder import iter_papers
+from create_subcorpora import process_titles
+
+from os.path import getsize
+import pandas as pd
+import numpy as np
+import metrics
+import profiling
+
+# written by find_duplicates(): a row for every paper that is a duplicate of another (corpus_id, openalex_id),
+# mapping it to its group's canonical paper; papers not listed are their own canonical paper
+canonical_ids_path = f"{csvs_path}/canonical_ids.csv"
+canonical_columns = ["corpus_id", "openalex_id", "canonical_corpus_id", "canonical_openalex_id", "same_title",
+                     "shared_openalex_id"]
+
+
+def title_keys(titles, years, first_authors):
+    """Hash each paper's normalized title (see process_titles()) together with its year and first author.
+
+    Parameters
+    ----------
+        titles (pd.Series): titles
+        years (pd.Series): publication years (or missing)
+        first_authors (pd.Series): OpenAlex IDs of first authors (or missing)
+
+    Returns
+    ----------
+        np.ndarray: a uint64 key per paper, or 0 for papers whose normalized title is empty
+    """
+    normalized = process_titles(titles).fillna("")
+    keys = pd.util.hash_pandas_object(pd.DataFrame({"title": normalized, "year": years.astype("Int64"),
+                                                    "first_author": first_authors.astype(object)}),
+                                      index=False).to_numpy().copy()
+    keys[(normalized == "").to_numpy()] = 0  # without a title, there's nothing to match on
+    return keys
+
+
+def first_authors(author_ids):
+    """The first of each paper's author_ids, whether stored as lists (Parquet) or their string repr (CSV)."""
+    if author_ids.map(lambda x: isinstance(x, str)).any():
+        return author_ids.str.extract(r"(A\d+)", expand=False)
+    return author_ids.map(lambda x: x[0] if x is not None and len(x) else None)
+
+
+def group_min(labels, keys, mask=None):
+    """Replace every label with the smallest label among the rows sharing its key (only rows in mask)."""
+    if mask is None: mask = np.ones(len(labels), dtype=bool)
+    labels = labels.copy()
+    labels[mask] = pd.Series(labels[mask]).groupby(keys[mask]).transform("min").to_numpy()
+    return labels
+
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def find_duplicates(papers_path: str = f"{csvs_path}/papers.csv", out_path: str = canonical_ids_path,
+                    chunksize: int = 200000):
+    """Find papers listed more than once in a papers file: those with the same normalized title, year, and first
+    author (e.g. one paper under several CorpusIDs), and those sharing an OpenAlex ID (e.g. matched from both
+    Subcorpus A and C). Papers connected by either are grouped, and every group's canonical paper is its first
+    ACL paper, else its lowest CorpusID; the mapping is written to out_path (see canonical_ids_path), for
+    csv_builder(), extract_abstracts(), and nlp4sg_task1.py (--canonical_ids) to skip redundant rows.
+
+    Parameters
+    ----------
+        papers_path (str): path to a papers .csv or .parquet file built by csv_builder()/merge_csvs()
+        out_path (str): where to write the mapping
+        chunksize (int): the number of papers to read at a time
+
+    Returns
+    ----------
+        None
+    """
+    columns = ["title", "corpus_id", "openalex_id", "author_ids", "year", "is_acl"]
+    corpus_ids, openalex_ids, is_acl, keys = [], [], [], []
+
+    for chunk in metrics.progress(iter_papers(papers_path, chunksize, columns), desc="Hashing titles"):
+        if "year" not in chunk: chunk["year"] = None  # papers files built before the year column
+        corpus_ids.append(chunk["corpus_id"].to_numpy(dtype=np.int64))
+        openalex_ids.append(chunk["openalex_id"].to_numpy(dtype=str))
+        is_acl.append(chunk["is_acl"].astype(str).str.lower().eq("true").to_numpy())  # bool in Parquet, "True" in CSV
+        keys.append(title_keys(chunk["title"], chunk["year"], first_authors(chunk["author_ids"])))
+        metrics.inc("records", len(chunk))
+
+    corpus_ids, openalex_ids = np.concatenate(corpus_ids), np.concatenate(openalex_ids)
+    is_acl, keys = np.concatenate(is_acl), np.concatenate(keys)
+    openalex_keys = pd.factorize(openalex_ids)[0]
+    titled = keys != 0
+
+    # label every row by its rank (ACL first, then by CorpusID), then spread the smallest label through each
+    # group of rows sharing a title key, an OpenAlex ID, or a CorpusID until nothing changes; rows joined only
+    # through a chain (A~B by title, B~C by OpenAlex ID) take a few rounds
+    order = np.lexsort((corpus_ids, ~is_acl))
+    labels = np.empty(len(order), dtype=np.int64)
+    labels[order] = np.arange(len(order))
+    while True:
+        updated = group_min(labels, keys, titled)
+        updated = group_min(updated, openalex_keys)
+        updated = group_min(updated, corpus_ids)
+        if (updated == labels).all(): break
+        labels = updated
+
+    same_title = titled & (pd.Series(keys).map(pd.Series(keys[titled]).value_counts()).fillna(0).to_numpy() > 1)
+    openalex_claims = pd.Series(corpus_ids).groupby(openalex_keys).transform("nunique").to_numpy()
+    group_sizes = pd.Series(labels).map(pd.Series(labels).value_counts()).to_numpy()
+
+    # join every row to its group's canonical (i.e. lowest-ranked) row
+    rows = pd.DataFrame({"corpus_id": corpus_ids, "openalex_id": openalex_ids, "label": labels,
+                         "same_title": same_title, "shared_openalex_id": openalex_claims > 1})[group_sizes > 1]
+    canonical = pd.DataFrame({"label": np.arange(len(order)), "canonical_corpus_id": corpus_ids[order],
+                              "canonical_openalex_id": openalex_ids[order]})
+    rows = rows.merge(canonical, on="label", how="left")[canonical_columns]
+    rows.to_csv(out_path, index=False)
+
+    redundant = redundant_rows(rows)
+    metrics.inc("duplicates", len(redundant))
+    metrics.inc("files_created")
+    metrics.inc("bytes_written", getsize(out_path))
+    print(f"{len(redundant)} of {len(corpus_ids)} papers are duplicates ({rows['canonical_corpus_id'].nunique()} groups; " +
+          f"{int(rows['same_title'].sum())} by title, {int(rows['shared_openalex_id'].sum())} by OpenAlex ID); " +
+          f"written to {out_path}")
+
+
+def redundant_rows(canonical_ids):
+    """The (corpus_id, openalex_id) pairs of a canonical ID mapping that map to another paper, i.e. that can
+    be skipped.
+
+    Parameters
+    ----------
+        canonical_ids (pd.DataFrame or str): the mapping written by find_duplicates(), or its path
+
+    Returns
+    ----------
+        pd.MultiIndex: (corpus_id, openalex_id) pairs, for e.g. MultiIndex.isin()
+    """
+    if isinstance(canonical_ids, str): canonical_ids = pd.read_csv(canonical_ids)
+    redundant = canonical_ids[(canonical_ids["corpus_id"] != canonical_ids["canonical_corpus_id"]) |
+                              (canonical_ids["openalex_id"] != canonical_ids["canonical_openalex_id"])]
+    return pd.MultiIndex.from_arrays([redundant["corpus_id"].astype(np.int64), redundant["openalex_id"].astype(str)],
+                                     names=["corpus_id", "openalex_id"])
+
+
+def drop_redundant(df, redundant):
+    """Drop the rows of a papers DataFrame (with corpus_id and openalex_id columns) in redundant_rows()."""
+    pairs = pd.MultiIndex.from_arrays([df["corpus_id"].astype(np.int64), df["openalex_id"].astype(str)])
+    return df[~pairs.isin(redundant)]
+
+
+if __name__ == "__main__":
+    pass
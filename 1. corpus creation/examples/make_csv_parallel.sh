@@ -0,0 +1,15 @@
+#!/bin/bash
+
+#SBATCH -A p31502                                                      # Allocation
+#SBATCH -p long                                                        # Queue
+#SBATCH -N 1                                                           # Number of nodes
+#SBATCH -n 16                                                          # Number of cores (processors)
+#SBATCH -t 48:00:00                                                    # Walltime/duration of job
+#SBATCH --mem-per-cpu=4G                                               # Memory per CPU
+#SBATCH --output=./outfiles/make_csv_parallel.out                      # Path for output must already exist
+#SBATCH --error=./outfiles/make_csv_parallel.err                       # Path for error must already exist
+#SBATCH --job-name="Making CSV (parallel)"
+
+conda activate nlp4sg
+cd /projects/p31502/projects/nlp4sg/1.\ corpus\ creation
+python -c "from csv_builder import csv_builder; csv_builder(processes=16)"
\ No newline at end of file
@@ -0,0 +1,242 @@
+from os import environ, getpid, makedirs, replace
+from functools import wraps
+from contextlib import contextmanager
+from threading import Thread, Event
+from tqdm import tqdm
+import json
+import time
+
+# where stage snapshots are written, in which format ("json" or "prom", a Prometheus textfile), and how
+# often; snapshots are off unless NLP4SG_METRICS_DIR is set, to a directory or to "on" (the directory passed
+# to @stage_metrics). counters are kept either way, for callers and tests to read
+metrics_dir = environ.get("NLP4SG_METRICS_DIR")
+metrics_format = environ.get("NLP4SG_METRICS_FORMAT", "json")
+metrics_interval = float(environ.get("NLP4SG_METRICS_INTERVAL", 30))
+
+# how often progress bars redraw, in seconds; with set_description() calls gone from hot loops, bars only
+# do formatting work on this timer rather than once per record
+progress_interval = float(environ.get("NLP4SG_PROGRESS_INTERVAL", 1.0))
+
+# upper bounds (seconds) of latency histogram buckets; the last bucket is +Inf
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# this process's metrics; keys are (name, sorted label items). Only ever updated from the thread running
+# the stage, and copied (atomically, under the GIL) by the snapshot thread
+counters = {}
+histograms = {}  # key:[bucket counts..., +Inf count, sum]
+
+# the outermost running stage, for nested stages (e.g. download_s2orc() calling extract_from_s2orc())
+current_stage = {"name": None, "started": None, "depth": 0}
+
+
+def _key(name: str, labels: dict):
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Add to a counter, e.g. inc("records") or inc("http_requests", identifier="mag").
+
+    Parameters
+    ----------
+        name (str): the counter, e.g. records, bytes_read, bytes_written, files_created, http_requests,
+                    retries, cache_hits
+        value (float): the amount to add
+        **labels: label:value pairs distinguishing this series of the counter
+
+    Returns
+    ----------
+        None
+    """
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    """Record a latency in a histogram (see latency_buckets).
+
+    Parameters
+    ----------
+        name (str): the histogram, e.g. http_latency
+        seconds (float): the observed latency
+        **labels: see inc()
+
+    Returns
+    ----------
+        None
+    """
+    key = _key(name, labels)
+    if key not in histograms: histograms[key] = [0] * (len(latency_buckets) + 2)
+
+    buckets = histograms[key]
+    for i, bound in enumerate(latency_buckets):
+        if seconds <= bound:
+            buckets[i] += 1
+            break
+    else:
+        buckets[-2] += 1
+    buckets[-1] += seconds
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """Time a block of code into a histogram; see observe()."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def reset():
+    """Clear every counter and histogram."""
+    counters.clear()
+    histograms.clear()
+
+
+def progress(iterable=None, **kwargs):
+    """A tqdm progress bar that redraws every progress_interval seconds (rather than tqdm's default of
+    10 times a second), so that progress reporting stays negligible in loops over millions of records."""
+    kwargs.setdefault("mininterval", progress_interval)
+    return tqdm(iterable, **kwargs)
+
+
+def snapshot():
+    """Get a JSON-serializable copy of this process's metrics.
+
+    Parameters
+    ----------
+        None
+
+    Returns
+    ----------
+        dict: stage, pid, timestamps, counters (with a per-second rate for each), and histograms
+    """
+    now = time.time()
+    elapsed = now - current_stage["started"] if current_stage["started"] else 0.0
+
+    def label_string(labels):
+        return ",".join(f"{k}={v}" for k, v in labels)
+
+    counter_items = sorted(dict(counters).items())
+    histogram_items = sorted((k, list(v)) for k, v in dict(histograms).items())
+
+    return {"stage": current_stage["name"], "pid": getpid(), "updated": now, "elapsed_seconds": round(elapsed, 3),
+            "counters": [{"name": name, "labels": label_string(labels), "value": value,
+                          "per_second": round(value / elapsed, 3) if elapsed else None}
+                         for (name, labels), value in counter_items],
+            "histograms": [{"name": name, "labels": label_string(labels), "buckets": list(latency_buckets) + ["+Inf"],
+                            "counts": buckets[:-1], "count": sum(buckets[:-1]), "sum": round(buckets[-1], 6)}
+                           for (name, labels), buckets in histogram_items]}
+
+
+def prometheus_text(snap: dict):
+    """Render a snapshot() in the Prometheus text exposition format (e.g. for node_exporter's textfile
+    collector). Counters become nlp4sg_{name}_total, and histograms nlp4sg_{name}_seconds.
+
+    Parameters
+    ----------
+        snap (dict): see snapshot()
+
+    Returns
+    ----------
+        str: the textfile's contents
+    """
+    def labels(extra: str, **more):
+        pairs = [f'stage="{snap["stage"]}"', f'pid="{snap["pid"]}"']
+        pairs += [f'{k}="{v}"' for k, v in (p.split("=", 1) for p in extra.split(",") if p)]
+        pairs += [f'{k}="{v}"' for k, v in more.items()]
+        return "{" + ",".join(pairs) + "}"
+
+    lines = []
+    for counter in snap["counters"]:
+        metric = f"nlp4sg_{counter['name']}_total"
+        if f"# TYPE {metric} counter" not in lines: lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{labels(counter['labels'])} {counter['value']}")
+
+    for histogram in snap["histograms"]:
+        metric = f"nlp4sg_{histogram['name']}_seconds"
+        if f"# TYPE {metric} histogram" not in lines: lines.append(f"# TYPE {metric} histogram")
+
+        cumulative = 0
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            cumulative += count
+            lines.append(f"{metric}_bucket{labels(histogram['labels'], le=bound)} {cumulative}")
+        lines.append(f"{metric}_sum{labels(histogram['labels'])} {histogram['sum']}")
+        lines.append(f"{metric}_count{labels(histogram['labels'])} {histogram['count']}")
+
+    lines.append(f"nlp4sg_elapsed_seconds{labels('')} {snap['elapsed_seconds']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_snapshot(path: str, fmt: str = metrics_format):
+    """Write snapshot() to path, atomically (so that a scraper never reads a half-written file).
+
+    Parameters
+    ----------
+        path (str): the file to write
+        fmt (str): "json" or "prom"
+
+    Returns
+    ----------
+        None
+    """
+    snap = snapshot()
+    with open(f"{path}.tmp", "w") as f:
+        if fmt == "prom": f.write(prometheus_text(snap))
+        else: json.dump(snap, f, indent=4)
+    replace(f"{path}.tmp", path)
+
+
+def stage_metrics(directory: str = None, name: str = None):
+    """Decorator marking a function as a pipeline stage: its metrics start from zero, and snapshots are
+    written to {directory}/{stage}-{pid}.{json|prom} every metrics_interval seconds, and once more when the
+    stage finishes (or fails). Nested stages count towards the outermost one.
+
+    Parameters
+    ----------
+        directory (str): where to write snapshots when NLP4SG_METRICS_DIR is "on"; snapshots are off unless
+                         NLP4SG_METRICS_DIR is set (and other values of it override this)
+        name (str): the stage's name; defaults to the function's name
+
+    Returns
+    ----------
+        function: the decorator
+    """
+    def decorator(function):
+        stage = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if current_stage["depth"] > 0:  # nested; already being tracked
+                current_stage["depth"] += 1
+                try: return function(*args, **kwargs)
+                finally: current_stage["depth"] -= 1
+
+            reset()
+            current_stage.update(name=stage, started=time.time(), depth=1)
+
+            out_dir = directory if metrics_dir == "on" else metrics_dir
+            if out_dir == "off": out_dir = None
+            path, done = None, Event()
+            if out_dir:
+                makedirs(out_dir, exist_ok=True)
+                path = f"{out_dir}/{stage}-{getpid()}.{'prom' if metrics_format == 'prom' else 'json'}"
+
+                def dump():  # periodic snapshots, until the stage is done
+                    while not done.wait(metrics_interval):
+                        write_snapshot(path)
+                Thread(target=dump, daemon=True).start()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                done.set()
+                if path: write_snapshot(path)
+                current_stage.update(depth=0)
+
+        return wrapper
+    return decorator
+
+
+if __name__ == "__main__":
+    pass
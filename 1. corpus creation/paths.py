@@ -2,8 +2,11 @@
 # filepaths, we recommend only modifying the paths in this file (namely corpora_path, since 
 # all others paths rely on it). Otherwise, custom filepaths are untested
 
-# main directory, in which datasets are downloaded and subcorpora are built
-corpora_path = "USER MUST SET ME"
+from os import environ
+
+# main directory, in which datasets are downloaded and subcorpora are built; may instead be set through 
+# the NLP4SG_CORPORA_PATH environment variable (e.g. for benchmarks.py)
+corpora_path = environ.get("NLP4SG_CORPORA_PATH", "USER MUST SET ME")
 
 datasets_path = f"{corpora_path}/datasets"  # where datasets are stored
 authors_path = f"{corpora_path}/authors"  # where OpenAlex author profiles are stored
@@ -11,7 +14,11 @@ authors_path = f"{corpora_path}/authors"  # where OpenAlex author profiles are s
 # https://api.semanticscholar.org/api-docs/datasets
 s2orc_path = f"{datasets_path}/s2orc"  # full text, abstracts, etc.
 s2_papers_db_path = f"{datasets_path}/s2_papers"  # metadata
+s2_diffs_path = f"{datasets_path}/s2_diffs"  # release-to-release diffs (see apply_s2_diffs())
 csvs_path = f"{datasets_path}/csvs"  # results/data CSVs
+corpusid_parts_path = f"{datasets_path}/corpusid_parts"  # per-JSONL CorpusID files (see merge_corpusids())
+metrics_path = f"{datasets_path}/metrics"  # per-stage metrics snapshots (see metrics.py)
+profiles_path = f"{datasets_path}/profiles"  # opt-in per-stage profiles (see profiling.py)
 
 # subcorpora created by create_subcorpora.py
 sub_a = f"{corpora_path}/subcorpus_a"  # where ACL files are stored
@@ -0,0 +1,459 @@
+from paths import *
+
+from os import environ, makedirs, remove, replace, stat
+from os.path import exists, dirname, abspath, isdir
+from shutil import rmtree
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from hashlib import sha256
+from tqdm import tqdm
+import subprocess
+import argparse
+import shlex
+import glob
+import json
+import time
+import sys
+
+# fingerprints of every file seen so far, and the inputs/outputs/params of every stage partition run so far
+state_path = f"{datasets_path}/pipeline_state.json"
+logs_path = f"{datasets_path}/pipeline_logs"  # one log per stage partition
+
+corpus_dir = dirname(abspath(__file__)).replace("\\", "/")
+classification_dir = f"{corpus_dir}/../2. NLP4SG classification"
+
+# files up to hash_limit bytes are hashed in full; larger ones (e.g. multi-GB JSONLs) by their size and
+# hash_sample bytes from their start, middle, and end
+hash_limit = 256 * 1024 ** 2
+hash_sample = 1024 ** 2
+
+
+def file_fingerprint(path: str, hashes: dict):
+    """Get a file's content hash, reusing the cached hash while its size and mtime are unchanged.
+
+    Parameters
+    ----------
+        path (str): the file
+        hashes (dict): path:[size, mtime_ns, sha256] cache, updated in place
+
+    Returns
+    ----------
+        str: the file's sha256 (sampled, for files over hash_limit)
+    """
+    st = stat(path)
+    cached = hashes.get(path)
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns: return cached[2]
+
+    h = sha256()
+    with open(path, "rb") as f:
+        if st.st_size <= hash_limit:
+            for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+        else:
+            h.update(str(st.st_size).encode())
+            for offset in [0, st.st_size // 2, st.st_size - hash_sample]:
+                f.seek(offset)
+                h.update(f.read(hash_sample))
+
+    hashes[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+    return hashes[path][2]
+
+
+def fingerprint(patterns: list, hashes: dict):
+    """Fingerprint every file matching a list of paths/glob patterns.
+
+    Parameters
+    ----------
+        patterns (list): paths or glob patterns
+        hashes (dict): see file_fingerprint()
+
+    Returns
+    ----------
+        dict: path:sha256 for every matching file; pattern:None for patterns matching nothing
+    """
+    fingerprints = {}
+    for pattern in patterns:
+        paths = sorted(p.replace("\\", "/") for p in glob.glob(pattern))
+        if not paths: fingerprints[pattern] = None
+        for path in paths: fingerprints[path] = file_fingerprint(path, hashes)
+    return fingerprints
+
+
+def python_call(module: str, function: str, **kwargs):
+    """Command running module.function(**kwargs) in a fresh interpreter, as the SLURM examples do."""
+    return [sys.executable, "-c", f"from {module} import {function}; {function}(**{kwargs!r})"]
+
+
+def ranges(n: int, total: int = 10000):
+    """Split subdirectories 0-total into n contiguous (start, end) ranges."""
+    bounds = [total * i // n for i in range(n + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(n) if bounds[i] < bounds[i + 1]]
+
+
+def partition(key: str, command: list, inputs: list = [], outputs: list = [], params: dict = None,
+              clean: list = [], cwd: str = corpus_dir, resume: bool = False):
+    """A unit of work of a stage.
+
+    Parameters
+    ----------
+        key (str): unique name, e.g. csv_builder[0-2500]
+        command (list): argv to run
+        inputs (list): paths/glob patterns it reads; it's out of date when their contents change
+        outputs (list): paths/glob patterns it writes; it's out of date when one is missing
+        params (dict): anything else its outputs depend on; defaults to the command
+        clean (list): files or directories to delete before rerunning (for outputs that are appended to, or 
+                      checkpointed)
+        resume (bool): whether the command resumes from its own checkpoint; if so, clean is skipped when its
+                       last attempt, with the same parameters and inputs, failed or was interrupted
+        cwd (str): working directory for the command
+
+    Returns
+    ----------
+        dict: the partition
+    """
+    return {"key": key, "command": command, "inputs": inputs, "outputs": outputs, "clean": clean, "cwd": cwd,
+            "resume": resume,
+            "params": params if params is not None else {"command": command[1:]}}
+
+
+def pipeline_stages(partitions: int = 4, threshold: float = 0.0, output_format: str = "csv",
+                    get_ids_from_s2orc: bool = True, classify: bool = False, task1_args: str = "", task2_args: str = ""):
+    """Declare the pipeline: each stage's upstream stages, and a function listing its partitions (called
+    once its upstream stages are done, so that e.g. extraction is split by however many JSONLs were
+    downloaded).
+
+    Parameters
+    ----------
+        partitions (int): how many subdirectory ranges get_openalex_info() and csv_builder() are split into
+        threshold (float): see csv_builder()
+        output_format (str): see csv_builder()
+        get_ids_from_s2orc (bool): see get_openalex_info()
+        classify (bool): whether to add the NLP4SG classification stages (task 1, then task 2)
+        task1_args (str): extra command-line arguments for nlp4sg_task1.py
+        task2_args (str): extra command-line arguments for nlp4sg_task2.py
+
+    Returns
+    ----------
+        list: {"name", "after", "partitions"} stage dicts, in a valid running order
+    """
+    corpusid_files = [f"{datasets_path}/acl_corpusids.txt", f"{datasets_path}/non_acl_corpusids.txt"]
+    missing_path = f"{datasets_path}/missing_from_s2orc.txt"
+    openalex_paths = f"{datasets_path}/openalex_paths.txt"
+    seen_papers = f"{datasets_path}/seen_papers_for_author_extract.txt"
+    ranged = ranges(partitions)
+
+    def jsonl_indices(pattern):
+        return sorted(int(p.replace("\\", "/").split("-")[-1].split(".")[0]) for p in glob.glob(pattern))
+
+    def csv_outputs(start, end):
+        if len(ranged) == 1: return [f"{csvs_path}/papers.{output_format}", f"{csvs_path}/concept_scores.npz"]
+        return [f"{csvs_path}/papers_subcsv_{start}-{end}.{output_format}", f"{csvs_path}/concept_scores_{start}-{end}.npz"]
+
+    papers_path = f"{csvs_path}/papers.{output_format}" if len(ranged) == 1 else f"{csvs_path}/papers_merged.{output_format}"
+    abstracts_path = f"{csvs_path}/task1_input.parquet"
+    task1_path = f"{csvs_path}/nlp4sg_results_task_1.parquet"  # for Parquet input, a directory of Parquet parts
+    task2_path = f"{csvs_path}/nlp4sg_results_task_2.csv"
+
+    stages = [
+        {"name": "download_s2orc", "after": [], "partitions": lambda: [
+            partition("download_s2orc", python_call("create_subcorpora", "download_s2orc"),
+                      outputs=[f"{s2orc_path}/s2orc-*.jsonl"])]},
+        {"name": "download_s2_papers", "after": [], "partitions": lambda: [
+            partition("download_s2_papers", python_call("create_subcorpora", "download_s2_papers"),
+                      outputs=[f"{s2_papers_db_path}/papers-*.jsonl"])]},
+        # each extraction partition writes only its own JSONL's CorpusID files (rewritten in full when it reruns),
+        # and merge_corpusids rebuilds the shared ones from them, so concurrent partitions never share a file
+        {"name": "extract_from_s2orc", "after": ["download_s2orc"], "partitions": lambda: [
+            partition(f"extract_from_s2orc[{i}]", python_call("create_subcorpora", "extract_from_s2orc", start=i, end=i + 1,
+                                                              parts_dir=corpusid_parts_path),
+                      inputs=[f"{s2orc_path}/s2orc-{i}.jsonl"],
+                      outputs=[f"{corpusid_parts_path}/s2orc-{i}.{kind}.txt" for kind in ["acl", "non_acl"]])
+            for i in jsonl_indices(f"{s2orc_path}/s2orc-*.jsonl")]},
+        {"name": "extract_from_papers", "after": ["download_s2_papers", "extract_from_s2orc"], "partitions": lambda: [
+            partition(f"extract_from_papers[{i}]", python_call("create_subcorpora", "extract_from_papers", start=i, end=i + 1,
+                                                               parts_dir=corpusid_parts_path),
+                      inputs=[f"{s2_papers_db_path}/papers-{i}.jsonl", f"{corpusid_parts_path}/s2orc-*.txt"],
+                      outputs=[f"{corpusid_parts_path}/papers-{i}.{kind}.txt" for kind in ["acl", "non_acl", "missing"]])
+            for i in jsonl_indices(f"{s2_papers_db_path}/papers-*.jsonl")]},
+        {"name": "merge_corpusids", "after": ["extract_from_papers"], "partitions": lambda: [
+            partition("merge_corpusids", python_call("create_subcorpora", "merge_corpusids"),
+                      inputs=[f"{corpusid_parts_path}/*.txt"], outputs=corpusid_files + [missing_path])]},
+        {"name": "get_openalex_info", "after": ["merge_corpusids"], "partitions": lambda: [
+            partition(f"get_openalex_info[{start}-{end}]",
+                      python_call("create_subcorpora", "get_openalex_info", start=start, end=end,
+                                  get_ids_from_s2orc=get_ids_from_s2orc),
+                      inputs=corpusid_files, outputs=[f"{datasets_path}/openalex_found_{start}-{end}.txt"])
+            for start, end in ranged]},
+        {"name": "write_openalex_filepaths", "after": ["get_openalex_info"], "partitions": lambda: [
+            partition("write_openalex_filepaths", python_call("create_subcorpora", "write_openalex_filepaths"),
+                      inputs=[f"{datasets_path}/openalex_found_*.txt"], outputs=[openalex_paths],
+                      clean=[openalex_paths])]},  # appended to, so it's rebuilt from scratch
+        {"name": "extract_authors", "after": ["write_openalex_filepaths"], "partitions": lambda: [
+            partition("extract_authors", python_call("create_subcorpora", "extract_authors"),
+                      inputs=[openalex_paths], outputs=[seen_papers])]},
+        {"name": "make_author_csv", "after": ["extract_authors"], "partitions": lambda: [
+            partition("make_author_csv", python_call("csv_builder", "make_author_csv"),
+                      inputs=[seen_papers], outputs=[f"{csvs_path}/authors.csv"])]},
+        {"name": "csv_builder", "after": ["make_author_csv"], "partitions": lambda: [
+            partition(f"csv_builder[{start}-{end}]",
+                      python_call("csv_builder", "csv_builder", threshold=threshold, start=start, end=end,
+                                  output_format=output_format),
+                      inputs=[f"{csvs_path}/authors.csv", openalex_paths], outputs=csv_outputs(start, end))
+            for start, end in ranged]},
+    ]
+
+    if len(ranged) > 1:
+        stages.append({"name": "merge_csvs", "after": ["csv_builder"], "partitions": lambda: [
+            partition("merge_csvs", python_call("csv_builder", "merge_csvs", output_format=output_format),
+                      inputs=[f"{csvs_path}/papers_subcsv_{start}-{end}.{output_format}" for start, end in ranged],
+                      outputs=[papers_path])]})
+
+    papers_stage = stages[-1]["name"]  # the stage writing papers_path (merge_csvs, or csv_builder if unpartitioned)
+    graph_path, features_path = f"{csvs_path}/author_graph.npz", f"{csvs_path}/author_features.csv"
+    canonical_path = f"{csvs_path}/canonical_ids.csv"
+    stages += [
+        {"name": "build_author_graph", "after": [papers_stage], "partitions": lambda: [
+            partition("build_author_graph", python_call("author_graph", "build_author_graph", papers_path=papers_path,
+                                                        out_path=graph_path),
+                      inputs=[papers_path], outputs=[graph_path])]},
+        {"name": "write_author_features", "after": ["build_author_graph"], "partitions": lambda: [
+            partition("write_author_features", python_call("author_graph", "write_author_features", graph_path=graph_path,
+                                                           out_path=features_path),
+                      inputs=[graph_path], outputs=[features_path])]},
+        {"name": "find_duplicates", "after": [papers_stage], "partitions": lambda: [
+            partition("find_duplicates", python_call("dedup", "find_duplicates", papers_path=papers_path,
+                                                     out_path=canonical_path),
+                      inputs=[papers_path], outputs=[canonical_path])]},
+    ]
+
+    if classify:
+        task1 = [sys.executable, "nlp4sg_task1.py", "--data", abstracts_path, "--output", task1_path] + shlex.split(task1_args)
+        task2 = [sys.executable, "nlp4sg_task2.py", "--data", task1_path, "--output", task2_path] + shlex.split(task2_args)
+        stages += [
+            {"name": "extract_abstracts", "after": ["find_duplicates"], "partitions": lambda: [
+                partition("extract_abstracts", python_call("csv_builder", "extract_abstracts", papers_path=papers_path,
+                                                           out_path=abstracts_path, canonical_path=canonical_path),
+                          inputs=[papers_path, canonical_path], outputs=[abstracts_path])]},
+            {"name": "nlp4sg_task1", "after": ["extract_abstracts"], "partitions": lambda: [
+                partition("nlp4sg_task1", task1, inputs=[abstracts_path], outputs=[f"{task1_path}/part-*.parquet"], cwd=classification_dir,
+                          clean=[task1_path, f"{task1_path}.checkpoint.json"], resume=True)]},
+            {"name": "nlp4sg_task2", "after": ["nlp4sg_task1"], "partitions": lambda: [
+                partition("nlp4sg_task2", task2, inputs=[f"{task1_path}/part-*.parquet"], outputs=[task2_path], cwd=classification_dir,
+                          clean=[task2_path, f"{task2_path}.checkpoint.json"], resume=True)]},
+        ]
+
+    return stages
+
+
+def load_state(path: str = state_path):
+    """Load the pipeline state (see state_path), or an empty one. Besides the partitions run, it holds the
+    parameters and input fingerprints of every partition started but not (yet) finished, under "attempts"."""
+    if not exists(path): return {"hashes": {}, "partitions": {}, "attempts": {}}
+    with open(path) as f:
+        state = json.load(f)
+    state.setdefault("attempts", {})  # states saved before attempts were tracked
+    return state
+
+
+def save_state(state: dict, path: str = state_path):
+    """Save the pipeline state atomically, so that a killed runner never leaves it half-written."""
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f, indent=1)
+    replace(f"{path}.tmp", path)
+
+
+def out_of_date(part: dict, state: dict, upstream_finished: float):
+    """Why a partition needs to run, if it does.
+
+    Parameters
+    ----------
+        part (dict): see partition()
+        state (dict): see load_state()
+        upstream_finished (float): when the most recent partition of any upstream stage finished
+
+    Returns
+    ----------
+        str: the reason, or None if it's up to date
+    """
+    record = state["partitions"].get(part["key"])
+    if not record: return "never run"
+    if record["params"] != part["params"]: return "parameters changed"
+    if upstream_finished > record["started"]: return "upstream stage reran"
+    if any(fp is None for fp in fingerprint(part["outputs"], state["hashes"]).values()): return "output missing"
+
+    inputs = fingerprint(part["inputs"], state["hashes"])
+    if inputs != record["inputs"]:
+        changed = [path for path in set(inputs) | set(record["inputs"]) if inputs.get(path) != record["inputs"].get(path)]
+        return f"input changed ({sorted(changed)[0]}{' and others' if len(changed) > 1 else ''})"
+    return None
+
+
+def resumable(part: dict, state: dict):
+    """Whether a partition that resumes from its own checkpoint (see partition()) last failed or was interrupted
+    with the same parameters and inputs, i.e. whether its outputs can be resumed from rather than cleaned."""
+    attempt = state["attempts"].get(part["key"])
+    return part["resume"] and bool(attempt) and attempt["params"] == part["params"] and \
+        attempt["inputs"] == fingerprint(part["inputs"], state["hashes"])
+
+
+def run_partition(part: dict, clean: bool = True):
+    """Run a partition's command, logging its output to {logs_path}/{key}.log.
+
+    Parameters
+    ----------
+        part (dict): see partition()
+        clean (bool): whether to delete its clean paths first
+
+    Returns
+    ----------
+        tuple: (start time, end time, exit code)
+    """
+    for path in part["clean"] if clean else []:
+        if isdir(path): rmtree(path)
+        elif exists(path): remove(path)
+
+    started = time.time()
+    with open(f"{logs_path}/{part['key']}.log", "w") as log:
+        code = subprocess.run(part["command"], cwd=part["cwd"], stdout=log, stderr=subprocess.STDOUT,
+                              env={**environ, "NLP4SG_CORPORA_PATH": corpora_path}).returncode
+    return started, time.time(), code
+
+
+def run_pipeline(stages: list, jobs: int = 4, until: str = None, force: list = [], mark_done: list = [],
+                 dry_run: bool = False):
+    """Run every out-of-date partition of every stage, in dependency order, up to jobs partitions at once
+    (partitions of a stage, and independent stages, run concurrently). A stage's partitions are only
+    listed and checked once its upstream stages are done; a partition is out of date if it has never
+    run, its parameters changed, an input's contents changed, an output is missing, or an upstream
+    partition ran after it did.
+
+    Parameters
+    ----------
+        stages (list): see pipeline_stages()
+        jobs (int): the maximum number of partitions running at once
+        until (str): the last stage to run (with everything it depends on); None runs every stage
+        force (list): names of stages to rerun regardless
+        mark_done (list): names of stages to record as up to date without running them (e.g. stages already
+                          run by hand before adopting the pipeline runner)
+        dry_run (bool): only print what would run, assuming anything downstream of a rerun reruns too
+
+    Returns
+    ----------
+        None
+    """
+    by_name = {stage["name"]: stage for stage in stages}
+    if until:
+        if until not in by_name: raise ValueError(f"until (= {until}) must be one of {list(by_name)}")
+        needed, frontier = set(), [until]
+        while frontier:
+            name = frontier.pop()
+            if name not in needed:
+                needed.add(name)
+                frontier += by_name[name]["after"]
+        stages = [stage for stage in stages if stage["name"] in needed]
+
+    makedirs(logs_path, exist_ok=True)
+    state = load_state()
+    lock = Lock()
+    finished = {}  # stage:when its last partition finished, once all of them have
+    latest = {}  # stage:when its last partition finished so far
+    rerun = set()  # stages with partitions (to be) rerun, for dry runs
+    running = {}  # future:(stage name, partition)
+    remaining = {stage["name"]: None for stage in stages}  # stage:number of partitions still running
+    failed = []
+
+    def start_ready(pool):
+        for stage in stages:
+            name = stage["name"]
+            if name in finished or remaining[name] is not None or any(a not in finished for a in stage["after"] if a in remaining):
+                continue
+
+            upstream = max([finished.get(a, 0) for a in stage["after"]] + [0])
+            parts = stage["partitions"]()
+            todo = []
+            for part in parts:
+                if name in mark_done and not dry_run:
+                    now = time.time()
+                    record(part, now, now)
+                    tqdm.write(f"marked done: {part['key']}")
+                    continue
+
+                reason = "forced" if name in force else out_of_date(part, state, upstream)
+                if dry_run and reason is None and any(a in rerun for a in stage["after"]): reason = "upstream stage reruns"
+                if reason:
+                    tqdm.write(f"{'would run' if dry_run else 'running'} {part['key']}: {reason}")
+                    todo.append(part)
+                else:
+                    tqdm.write(f"up to date: {part['key']}")
+
+            if not parts: tqdm.write(f"{name}: no partitions (are its inputs missing?)")
+            if todo: rerun.add(name)
+
+            latest[name] = max([state["partitions"].get(p["key"], {}).get("finished", 0) for p in parts if p not in todo] + [0])
+            if dry_run or not todo:
+                finished[name] = latest[name]
+                continue
+
+            remaining[name] = len(todo)
+            for part in todo:
+                clean = name in force or not resumable(part, state)
+                if part["clean"] and not clean: tqdm.write(f"resuming {part['key']} from its last attempt")
+                with lock:
+                    state["attempts"][part["key"]] = {"params": part["params"],
+                                                      "inputs": fingerprint(part["inputs"], state["hashes"])}
+                    save_state(state)
+                running[pool.submit(run_partition, part, clean)] = (name, part)
+
+    def record(part, started, ended):
+        with lock:
+            state["partitions"][part["key"]] = {
+                "params": part["params"], "started": started, "finished": ended,
+                "inputs": fingerprint(part["inputs"], state["hashes"]),
+                "outputs": fingerprint(part["outputs"], state["hashes"])}
+            state["attempts"].pop(part["key"], None)
+            save_state(state)
+
+    with ThreadPoolExecutor(jobs) as pool:
+        start_ready(pool)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, part = running.pop(future)
+                started, ended, code = future.result()
+
+                if code != 0:
+                    failed.append(part["key"])
+                    tqdm.write(f"FAILED {part['key']} (exit code {code}); see {logs_path}/{part['key']}.log")
+                else:
+                    tqdm.write(f"finished {part['key']} in {ended - started:.1f}s")
+                    record(part, started, ended)
+                    latest[name] = max(latest[name], ended)
+
+                remaining[name] -= 1
+                if remaining[name] == 0 and not failed: finished[name] = latest[name]
+
+            if not failed: start_ready(pool)
+
+    if failed: raise RuntimeError(f"{len(failed)} partition(s) failed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the out-of-date stages of the corpus pipeline")
+    parser.add_argument("--jobs", type=int, default=4, help="maximum partitions running at once")
+    parser.add_argument("--partitions", type=int, default=4,
+                        help="subdirectory ranges that get_openalex_info and csv_builder are split into")
+    parser.add_argument("--threshold", type=float, default=0.0, help="see csv_builder()")
+    parser.add_argument("--output_format", type=str, default="csv", choices=["csv", "parquet"])
+    parser.add_argument("--no_s2orc_ids", action="store_true", help="get_openalex_info(get_ids_from_s2orc=False)")
+    parser.add_argument("--classify", action="store_true", help="also run NLP4SG classification (tasks 1 and 2)")
+    parser.add_argument("--task1_args", type=str, default="", help="extra arguments for nlp4sg_task1.py")
+    parser.add_argument("--task2_args", type=str, default="", help="extra arguments for nlp4sg_task2.py")
+    parser.add_argument("--until", type=str, default=None, help="last stage to run")
+    parser.add_argument("--force", type=str, nargs="*", default=[], help="stages to rerun regardless")
+    parser.add_argument("--mark_done", type=str, nargs="*", default=[], 
+                        help="stages to record as up to date without running (e.g. already run by hand)")
+    parser.add_argument("--dry_run", action="store_true", help="only print what would run")
+    args = parser.parse_args()
+
+    stages = pipeline_stages(args.partitions, args.threshold, args.output_format, not args.no_s2orc_ids,
+                             args.classify, args.task1_args, args.task2_args)
+    run_pipeline(stages, args.jobs, args.until, args.force, args.mark_done, args.dry_run)
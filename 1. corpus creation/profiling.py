@@ -0,0 +1,267 @@
+from os import environ, getpid, makedirs
+from functools import wraps
+from threading import Thread, Event, get_ident
+from collections import Counter
+from tqdm import tqdm
+import tracemalloc
+import psutil
+import sys
+import time
+
+# opt-in profiling of pipeline stages; NLP4SG_PROFILE is a comma-separated list of modes:
+#   cpu  sampling CPU profile (collapsed stacks, for flamegraph.pl/speedscope, plus top functions)
+#   mem  tracemalloc allocations by call site, at the stage's peak traced memory
+#   rss  resident set size (including child processes) over time
+# or "all"; artifacts are written to {directory}/{stage}-{job}.* (see profiled()). RSS is checked against the
+# memory budget (see memory_budget_mb()) whenever there is one, in any mode or none
+profile_config = {"modes": set(environ.get("NLP4SG_PROFILE", "").replace(" ", "").split(",")) - {""},
+                  "dir": environ.get("NLP4SG_PROFILE_DIR"),
+                  "interval": float(environ.get("NLP4SG_PROFILE_INTERVAL", 0.01)),  # seconds between CPU samples
+                  "rss_interval": float(environ.get("NLP4SG_RSS_INTERVAL", 1.0)),  # seconds between RSS samples
+                  "budget_mb": float(environ["NLP4SG_MEM_BUDGET_MB"]) if environ.get("NLP4SG_MEM_BUDGET_MB") else None,
+                  "warn_fraction": float(environ.get("NLP4SG_MEM_WARN_FRACTION", 0.9)),
+                  "active": False}
+
+profile_modes = {"cpu", "mem", "rss"}
+
+
+def configure(modes: str = None, directory: str = None, budget_mb: float = None):
+    """Enable profiling from code or a command-line flag, rather than the environment.
+
+    Parameters
+    ----------
+        modes (str): comma-separated profile modes (see NLP4SG_PROFILE), or None to leave unchanged
+        directory (str): overrides where artifacts are written, or None to leave unchanged
+        budget_mb (float): the memory budget, in MB, or None to leave unchanged
+
+    Returns
+    ----------
+        None
+    """
+    if modes is not None: profile_config["modes"] = set(modes.replace(" ", "").split(",")) - {""}
+    if directory is not None: profile_config["dir"] = directory
+    if budget_mb is not None: profile_config["budget_mb"] = budget_mb
+
+
+def memory_budget_mb():
+    """Get the job's memory budget: NLP4SG_MEM_BUDGET_MB, or else the SLURM allocation, if any.
+
+    Parameters
+    ----------
+        None
+
+    Returns
+    ----------
+        float: the budget in MB, or None if there isn't one
+    """
+    if profile_config["budget_mb"]: return profile_config["budget_mb"]
+    if environ.get("SLURM_MEM_PER_NODE"): return float(environ["SLURM_MEM_PER_NODE"])
+    if environ.get("SLURM_MEM_PER_CPU") and environ.get("SLURM_CPUS_ON_NODE"):
+        return float(environ["SLURM_MEM_PER_CPU"]) * int(environ["SLURM_CPUS_ON_NODE"])
+    return None
+
+
+def job_tag():
+    """SLURM job (and array task) ID plus PID, so that concurrent jobs never share artifact files."""
+    job = environ.get("SLURM_JOB_ID")
+    if job and environ.get("SLURM_ARRAY_TASK_ID"): job += f"_{environ['SLURM_ARRAY_TASK_ID']}"
+    return f"{job}-{getpid()}" if job else str(getpid())
+
+
+def rss_mb(process):
+    """Resident set size of a process and its children (e.g. Pool workers), in MB."""
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try: total += child.memory_info().rss
+        except psutil.Error: pass  # exited since being listed
+    return total / 1024 ** 2
+
+
+def frame_stack(frame):
+    """Collapsed-stack representation (root first) of a frame, e.g. "module:function:line;..."."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_filename.replace(chr(92), '/').split('/')[-1]}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def write_cpu_profile(path: str, stacks: Counter, top: int = 40):
+    """Write collapsed stacks (path.folded) and the top functions by self and total samples (path.txt).
+
+    Parameters
+    ----------
+        path (str): the artifact path, without extension
+        stacks (Counter): collapsed stack:number of samples
+        top (int): the number of functions to list
+
+    Returns
+    ----------
+        None
+    """
+    stacks = Counter(stacks)  # copy; the sampler may still be adding to it
+    total = sum(stacks.values()) or 1
+    self_counts, total_counts = Counter(), Counter()
+
+    with open(f"{path}.folded", "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+            frames = [":".join(s.split(":")[:2]) for s in stack.split(";")]  # without line numbers
+            self_counts[frames[-1]] += count
+            for frame in set(frames): total_counts[frame] += count
+
+    with open(f"{path}.txt", "w") as f:
+        f.write(f"{total} samples\n\nself%   total%  function\n")
+        for frame, count in self_counts.most_common(top):
+            f.write(f"{100 * count / total:6.2f}  {100 * total_counts[frame] / total:6.2f}  {frame}\n")
+
+
+def write_mem_profile(path: str, snapshot, peak: int, top: int = 40):
+    """Write the top allocation sites of a tracemalloc snapshot (taken near the peak) to path.
+
+    Parameters
+    ----------
+        path (str): the artifact file
+        snapshot (tracemalloc.Snapshot): the snapshot
+        peak (int): peak traced memory, in bytes
+        top (int): the number of call sites to list
+
+    Returns
+    ----------
+        None
+    """
+    with open(path, "w") as f:
+        f.write(f"peak traced memory: {peak / 1024 ** 2:.1f} MB\n")
+        if snapshot is None: return
+
+        stats = snapshot.statistics("lineno")
+        f.write(f"at snapshot: {sum(s.size for s in stats) / 1024 ** 2:.1f} MB in {len(stats)} call sites\n\n")
+        for stat in stats[:top]:
+            frame = stat.traceback[0]
+            f.write(f"{stat.size / 1024 ** 2:10.2f} MB  {stat.count:>10} blocks  {frame.filename}:{frame.lineno}\n")
+
+
+class StageProfiler:
+    """Background sampler for a single stage: CPU stacks of the stage's thread, tracemalloc snapshots as
+    traced memory reaches new peaks, and RSS, with artifacts rewritten periodically so that they survive
+    the job being killed."""
+
+    def __init__(self, stage: str, directory: str, modes: set):
+        if modes: makedirs(directory, exist_ok=True)  # with no modes, only the memory budget is watched
+        self.path = f"{directory}/{stage}-{job_tag()}"
+        self.stage = stage
+        self.modes = modes
+        self.thread_id = get_ident()
+        self.stacks = Counter()
+        self.done = Event()
+        self.budget = memory_budget_mb()
+        self.warned_at = None
+        self.peak_snapshot = None
+        self.snapshot_at = 0
+
+    def start(self):
+        if "mem" in self.modes and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+        if "rss" in self.modes:
+            self.rss_file = open(f"{self.path}.rss.csv", "w")
+            self.rss_file.write("seconds,rss_mb,budget_mb\n")
+
+        self.started = time.perf_counter()
+        self.thread = Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        process = psutil.Process()
+        next_rss = next_write = 0.0
+
+        while not self.done.wait(profile_config["interval"] if "cpu" in self.modes else profile_config["rss_interval"]):
+            now = time.perf_counter() - self.started
+
+            if "cpu" in self.modes:
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None: self.stacks[frame_stack(frame)] += 1
+
+            if now >= next_rss:
+                next_rss = now + profile_config["rss_interval"]
+                if "mem" in self.modes: self.check_traced()
+                if "rss" in self.modes or self.budget: self.check_rss(now, rss_mb(process))
+
+            if now >= next_write:  # keep artifacts current, in case the job is killed
+                next_write = now + 30
+                self.write()
+
+    def check_traced(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if current > 1.1 * self.snapshot_at and current >= peak * 0.9:  # a new peak (by 10%): re-snapshot
+            self.peak_snapshot = tracemalloc.take_snapshot()
+            self.snapshot_at = current
+
+    def check_rss(self, seconds: float, rss: float):
+        if "rss" in self.modes:
+            self.rss_file.write(f"{seconds:.2f},{rss:.1f},{self.budget or ''}\n")
+            self.rss_file.flush()
+
+        if not self.budget or rss < profile_config["warn_fraction"] * self.budget: return
+        if self.warned_at and rss < 1.05 * self.warned_at: return  # warn again only as usage keeps growing
+
+        self.warned_at = rss
+        tqdm.write(f"WARNING: {self.stage} is using {rss:.0f} MB of its {self.budget:.0f} MB memory budget " +
+                   f"({100 * rss / self.budget:.0f}%)" + (f"; see {self.path}.*" if self.modes else ""), file=sys.stderr)
+        if tracemalloc.is_tracing():
+            write_mem_profile(f"{self.path}.budget.txt", tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1])
+
+    def write(self):
+        if "cpu" in self.modes: write_cpu_profile(f"{self.path}.cpu", self.stacks)
+        if "mem" in self.modes and tracemalloc.is_tracing():
+            write_mem_profile(f"{self.path}.mem.txt", self.peak_snapshot, tracemalloc.get_traced_memory()[1])
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+        if "mem" in self.modes and tracemalloc.is_tracing(): self.check_traced()
+        self.write()
+        if "rss" in self.modes: self.rss_file.close()
+        if "mem" in self.modes: tracemalloc.stop()
+
+
+def profiled(directory: str = "./profiles", name: str = None):
+    """Decorator profiling a pipeline stage when NLP4SG_PROFILE (or configure()) enables any profile modes,
+    and watching its RSS against the memory budget whenever there is one; otherwise, the function is called
+    as is. Artifacts go to {directory}/{stage}-{job}.*, unless
+    NLP4SG_PROFILE_DIR is set. Only the outermost profiled call is profiled; worker processes (e.g. of a
+    Pool) are only covered by RSS, which includes children.
+
+    Parameters
+    ----------
+        directory (str): where to write artifacts
+        name (str): the stage's name; defaults to the function's name
+
+    Returns
+    ----------
+        function: the decorator
+    """
+    def decorator(function):
+        stage = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            modes = profile_modes if "all" in profile_config["modes"] else profile_config["modes"] & profile_modes
+            if profile_config["active"] or not (modes or memory_budget_mb()): return function(*args, **kwargs)
+
+            profile_config["active"] = True
+            profiler = StageProfiler(stage, profile_config["dir"] or directory, modes)
+            profiler.start()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.stop()
+                profile_config["active"] = False
+                if modes: tqdm.write(f"{stage}: profile ({', '.join(sorted(modes))}) written to {profiler.path}.*")
+
+        return wrapper
+    return decorator
+
+
+if __name__ == "__main__":
+    pass
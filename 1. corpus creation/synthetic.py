@@ -0,0 +1,349 @@
+from create_subcorpora import process_title
+from csv_builder import concepts as nlp_concepts
+
+from os import makedirs, listdir
+from os.path import exists
+from gzip import open as gzip_open
+import glob
+import json
+import random
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from tqdm import tqdm
+
+# building blocks for synthetic titles, abstracts, and venues
+words = ["neural", "language", "model", "translation", "corpus", "learning", "semantic", "parsing", "speech",
+         "dialogue", "sentiment", "analysis", "low", "resource", "multilingual", "transformer", "evaluation",
+         "health", "education", "climate", "misinformation", "detection", "graph", "retrieval", "question",
+         "answering", "summarization", "generation", "bias", "fairness", "protein", "network", "economic",
+         "policy", "survey", "robust", "efficient", "data", "annotation", "benchmark", "social", "media"]
+venues = ["ACL", "EMNLP", "NAACL", "Findings of the Association for Computational Linguistics", "COLING",
+          "Journal of Retailing and Consumer Services", "Nature", "Bioinformatics", "The EMBO Journal",
+          "IEEE Transactions on Pattern Analysis and Machine Intelligence", "Accounting Education", None]
+other_concepts = [f"C{n}" for n in range(1000, 1200)]
+
+
+def synthetic_work(rng: random.Random, corpus_id: int, is_acl: bool, authors: list):
+    """Generate the S2ORC, Papers, and OpenAlex records of a single synthetic work.
+
+    Parameters
+    ----------
+        rng (random.Random): the random number generator to draw from
+        corpus_id (int): the work's CorpusID (also used to derive its MAG ID, DOI, and OpenAlex ID)
+        is_acl (bool): whether the work is in the ACL Anthology
+        authors (list): OpenAlex author IDs (e.g. "A123") to draw the work's authors from
+
+    Returns
+    ----------
+        tuple: (S2ORC dict, Papers dict, OpenAlex work dict)
+    """
+    title = " ".join(rng.choice(words) for _ in range(rng.randint(4, 12))).capitalize()
+    abstract_words = [rng.choice(words) for _ in range(rng.randint(40, 200))]
+    abstract = " ".join(abstract_words)
+    body = " ".join(rng.choice(words) for _ in range(rng.randint(200, 2000)))
+    text = f"{title}\n{abstract}\n{body}"
+
+    # some works can only be found in OpenAlex by DOI, or by title (and date/year)
+    mag = str(2000000000 + corpus_id) if rng.random() < 0.7 else None
+    doi = f"10.{rng.randint(1000, 9999)}/syn.{corpus_id}" if rng.random() < 0.8 else None
+    year = rng.randint(1990, 2023)
+    date = f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" if rng.random() < 0.8 else None
+    acl_id = f"{year}.syn-{corpus_id}" if is_acl else None
+
+    s2orc = {"corpusid": corpus_id,
+             "externalids": {"arxiv": None, "mag": mag, "acl": acl_id, "pubmed": None, "doi": doi},
+             "content": {"source": {"pdfurls": None},
+                         "text": text,
+                         "annotations": {"abstract": json.dumps([{"start": len(title) + 1, "end": len(title) + 1 + len(abstract)}]),
+                                         "title": json.dumps([{"start": 0, "end": len(title)}])}}}
+
+    papers = {"corpusid": corpus_id,
+              "externalids": {"ACL": acl_id, "DBLP": None, "ArXiv": None, "MAG": mag, "CorpusId": str(corpus_id),
+                              "PubMed": None, "DOI": doi},
+              "url": f"https://www.semanticscholar.org/paper/{corpus_id}",
+              "title": title, "authors": [], "venue": "", "year": year, "publicationdate": date,
+              "journal": None}
+
+    work_concepts = rng.sample(other_concepts, rng.randint(2, 8))
+    if is_acl or rng.random() < 0.2: work_concepts.insert(0, rng.choice(sorted(nlp_concepts)))
+
+    inverted_index = {}
+    for i, word in enumerate(abstract_words):
+        inverted_index.setdefault(word, []).append(i)
+
+    openalex = {"id": f"https://openalex.org/W{4000000000 + corpus_id}",
+                "doi": f"https://doi.org/{doi}" if doi else None,
+                "title": title, "display_name": title, "publication_year": year, "publication_date": date or f"{year}-01-01",
+                "ids": {"openalex": f"https://openalex.org/W{4000000000 + corpus_id}",
+                        **({"doi": f"https://doi.org/{doi}"} if doi else {}), **({"mag": mag} if mag else {})},
+                "primary_location": {"source": {"display_name": "ACL" if is_acl else rng.choice(venues)}},
+                "authorships": [{"author": {"id": f"https://openalex.org/{a}"}} for a in rng.sample(authors, rng.randint(1, 6))],
+                "countries_distinct_count": 1,
+                "concepts": [{"id": f"https://openalex.org/{c}", "score": round(rng.random(), 6)} for c in work_concepts],
+                "locations_count": 1,
+                "abstract_inverted_index": inverted_index}
+
+    return s2orc, papers, openalex
+
+
+def make_synthetic_corpus(root: str, n_works: int = 10000, acl_fraction: float = 0.05, n_files: int = 2, seed: int = 0):
+    """Write synthetic S2ORC and Papers JSONL files (in the layout download_s2orc()/download_s2_papers() leave
+    them in) under root/datasets, plus the matching OpenAlex works to root/openalex_works.jsonl (see
+    serve_openalex()). Roughly 5% of works are only in Papers, and 5% are not in OpenAlex at all.
+
+    Parameters
+    ----------
+        root (str): the directory to use as corpora_path
+        n_works (int): the number of works to generate
+        acl_fraction (float): the fraction of works in the ACL Anthology
+        n_files (int): the number of S2ORC (and Papers) JSONL files to split works across
+        seed (int): random seed, for reproducible fixtures
+
+    Returns
+    ----------
+        None
+    """
+    rng = random.Random(seed)
+    s2orc_dir = f"{root}/datasets/s2orc"
+    papers_dir = f"{root}/datasets/s2_papers"
+    for dir in [s2orc_dir, papers_dir, f"{root}/datasets/csvs"]:
+        makedirs(dir, exist_ok=True)
+
+    corpus_ids = rng.sample(range(100000, 300000000), n_works)
+    acl_authors = [f"A{5000000000 + i}" for i in range(max(n_works // 20, 10))]
+    all_authors = acl_authors + [f"A{5100000000 + i}" for i in range(max(n_works // 2, 10))]
+
+    s2orc_files = [open(f"{s2orc_dir}/s2orc-{i}.jsonl", "w", encoding="utf-8") for i in range(n_files)]
+    papers_files = [open(f"{papers_dir}/papers-{i}.jsonl", "w", encoding="utf-8") for i in range(n_files)]
+
+    with open(f"{root}/openalex_works.jsonl", "w", encoding="utf-8") as openalex_file:
+        for i, corpus_id in enumerate(tqdm(corpus_ids, desc="Generating synthetic works", leave=False)):
+            # the first two works are always one ACL and one non-ACL work, so both subcorpora exist
+            is_acl = i == 0 or (i > 1 and rng.random() < acl_fraction)
+            s2orc, papers, openalex = synthetic_work(rng, corpus_id, is_acl, acl_authors if is_acl else all_authors)
+
+            if i < 2 or rng.random() >= 0.05:  # ~5% of works are only in Papers
+                s2orc_files[i % n_files].write(json.dumps(s2orc) + "\n")
+            papers_files[i % n_files].write(json.dumps(papers) + "\n")
+            if rng.random() >= 0.05:  # ~5% of works are not in OpenAlex
+                openalex_file.write(json.dumps(openalex) + "\n")
+
+    for f in s2orc_files + papers_files: f.close()
+
+
+def make_synthetic_diff(root: str, start_release: str = "2024-01-02", end_release: str = "2024-01-09", 
+                        n_changed: int = 20, n_touched: int = 20, n_moved: int = 4, n_new: int = 20, 
+                        n_deleted: int = 10, seed: int = 0):
+    """Write a synthetic Semantic Scholar diff, from start_release to end_release, of the corpus written by
+    make_synthetic_corpus() (or of the previous diff's end release), in the layout that serve_openalex()
+    serves it from: root/s2_diffs/{start}/to/{end}/{dataset}/{update|delete}-0.jsonl.gz. The OpenAlex works
+    in root/openalex_works.jsonl are updated to match, so call this before serve_openalex().
+
+    Parameters
+    ----------
+        root (str): the directory passed to make_synthetic_corpus()
+        start_release (str): the release the diff is from
+        end_release (str): the release the diff is to
+        n_changed (int): the number of papers given a new DOI (and no MAG ID), so that they must be rematched
+        n_touched (int): the number of papers updated without any change to their OpenAlex identifiers
+        n_moved (int): the number of papers whose ACL status is flipped
+        n_new (int): the number of new papers (in both S2ORC and Papers)
+        n_deleted (int): the number of papers deleted (from both S2ORC and Papers)
+        seed (int): random seed
+
+    Returns
+    ----------
+        dict: changed/touched/moved/new/deleted:CorpusIDs (as str)
+    """
+    rng = random.Random(seed)
+
+    # the latest version of every record: the original JSONLs, then any earlier diffs (in release order)
+    records = {"papers": {}, "s2orc": {}}
+    for dataset, pattern in [("papers", "s2_papers/papers-*.jsonl"), ("s2orc", "s2orc/s2orc-*.jsonl")]:
+        for path in sorted(glob.glob(f"{root}/datasets/{pattern}")):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    records[dataset][record["corpusid"]] = record
+
+    for diff_dir in sorted(glob.glob(f"{root}/s2_diffs/*/to/*"), key=lambda d: d.replace("\\", "/").split("/")[-1]):
+        for dataset in records:
+            for kind in ["update", "delete"]:
+                path = f"{diff_dir}/{dataset}/{kind}-0.jsonl.gz"
+                if not exists(path): continue
+                with gzip_open(path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if kind == "update": records[dataset][record["corpusid"]] = record
+                        else: records[dataset].pop(record["corpusid"], None)
+
+    with open(f"{root}/openalex_works.jsonl", encoding="utf-8") as f:
+        works = {int(work["id"].split("/W")[-1]) - 4000000000: work for work in map(json.loads, f)}
+
+    corpus_ids = rng.sample(sorted(records["papers"]), n_changed + n_touched + n_moved + n_deleted)
+    changed, corpus_ids = corpus_ids[:n_changed], corpus_ids[n_changed:]
+    touched, corpus_ids = corpus_ids[:n_touched], corpus_ids[n_touched:]
+    moved, deleted = corpus_ids[:n_moved], corpus_ids[n_moved:]
+    updates = {"papers": [], "s2orc": []}
+
+    for corpus_id in changed:
+        paper = records["papers"][corpus_id]
+        doi = f"10.{rng.randint(1000, 9999)}/syn.v2.{corpus_id}"
+        paper["externalids"].update(DOI=doi, MAG=None)
+        updates["papers"].append(paper)
+        if corpus_id in works:
+            works[corpus_id]["doi"] = f"https://doi.org/{doi}"
+            works[corpus_id]["ids"] = {"openalex": works[corpus_id]["id"], "doi": f"https://doi.org/{doi}"}
+
+    for corpus_id in touched:  # e.g. a new citation count, which get_openalex_info() doesn't use
+        records["papers"][corpus_id]["citationcount"] = rng.randint(0, 1000)
+        updates["papers"].append(records["papers"][corpus_id])
+
+    for corpus_id in moved:
+        paper = records["papers"][corpus_id]
+        acl_id = None if paper["externalids"]["ACL"] else f"{paper['year']}.syn-{corpus_id}"
+        paper["externalids"]["ACL"] = acl_id
+        updates["papers"].append(paper)
+        if corpus_id in records["s2orc"]:
+            records["s2orc"][corpus_id]["externalids"]["acl"] = acl_id
+            updates["s2orc"].append(records["s2orc"][corpus_id])
+
+    authors = [f"A{5100000000 + i}" for i in range(10)]
+    # above make_synthetic_corpus()'s CorpusIDs, and distinct from any earlier diff's
+    new = [c for c in rng.sample(range(300000000, 400000000), 2 * n_new) if c not in records["papers"]][:n_new]
+    for corpus_id in new:
+        s2orc, papers, openalex = synthetic_work(rng, corpus_id, rng.random() < 0.05, authors)
+        updates["s2orc"].append(s2orc)
+        updates["papers"].append(papers)
+        works[corpus_id] = openalex
+
+    for corpus_id in deleted:
+        works.pop(corpus_id, None)
+
+    for dataset in records:
+        diff_dir = f"{root}/s2_diffs/{start_release}/to/{end_release}/{dataset}"
+        makedirs(diff_dir, exist_ok=True)
+        with gzip_open(f"{diff_dir}/update-0.jsonl.gz", "wt", encoding="utf-8") as f:
+            for record in updates[dataset]: f.write(json.dumps(record) + "\n")
+        with gzip_open(f"{diff_dir}/delete-0.jsonl.gz", "wt", encoding="utf-8") as f:
+            for corpus_id in deleted:
+                if corpus_id in records[dataset]: f.write(json.dumps({"corpusid": corpus_id}) + "\n")
+
+    with open(f"{root}/openalex_works.jsonl", "w", encoding="utf-8") as f:
+        for work in works.values(): f.write(json.dumps(work) + "\n")
+
+    return {name: [str(c) for c in ids] for name, ids in 
+            [("changed", changed), ("touched", touched), ("moved", moved), ("new", new), ("deleted", deleted)]}
+
+
+class OpenAlexHandler(BaseHTTPRequestHandler):
+    """Answers /works?filter=...(&select=...) queries, as made by get_openalex_info(), from the synthetic works
+    loaded into the server's works_by dictionary (see serve_openalex()); also stands in for the Semantic Scholar
+    datasets API's /diffs/{start}/to/{end}/{dataset}, for diffs written by make_synthetic_diff()."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        works_by = self.server.works_by
+
+        if url.path.startswith("/diffs/"):
+            return self.diffs(*url.path.split("/")[2:])
+        if url.path.startswith("/files/"):
+            return self.file(url.path[len("/files/"):])
+
+        if url.path.rstrip("/").endswith("/works"):
+            filter_string = query.get("filter", [""])[0]
+            per_page = int(query.get("per-page", ["25"])[0])
+
+            if filter_string.startswith("mag:"):
+                results = [works_by["mag"][m] for m in filter_string[4:].split("|") if m in works_by["mag"]]
+            elif filter_string.startswith("doi:"):
+                results = [works_by["doi"][d.lower()] for d in filter_string[4:].split("|") if d.lower() in works_by["doi"]]
+            elif filter_string.startswith("title.search:"):
+                title = process_title(filter_string.split(",")[0][len("title.search:"):])
+                results = works_by["title"].get(title, [])
+            else:
+                return self.respond(403, {"error": "Invalid query parameters error.", "message": filter_string})
+
+            page = results[:per_page]
+            if "select" in query:  # like the API, only return the selected top-level fields
+                select = query["select"][0].split(",")
+                page = [{k: v for k, v in r.items() if k in select} for r in page]
+            return self.respond(200, {"meta": {"count": len(results)}, "results": page})
+
+        self.respond(404, {"error": "Not found", "message": self.path})
+
+    def diffs(self, start: str, _to: str, end: str, dataset: str):
+        # follow diffs from start, one release at a time, until end (or, for "latest", the last one)
+        base = f"http://{self.headers['Host']}/files"
+        diffs, release = [], start
+        while release != end and exists(f"{self.server.root}/s2_diffs/{release}/to"):
+            next_release = sorted(listdir(f"{self.server.root}/s2_diffs/{release}/to"))[0]
+            diff_dir = f"s2_diffs/{release}/to/{next_release}/{dataset}"
+            diffs.append({"from_release": release, "to_release": next_release,
+                          "update_files": [f"{base}/{diff_dir}/update-0.jsonl.gz"],
+                          "delete_files": [f"{base}/{diff_dir}/delete-0.jsonl.gz"]})
+            release = next_release
+
+        if end != "latest" and release != end:
+            return self.respond(404, {"error": "Not found", "message": f"no diffs from {start} to {end}"})
+        self.respond(200, {"dataset": dataset, "start_release": start, "end_release": release, "diffs": diffs})
+
+    def file(self, path: str):
+        path = f"{self.server.root}/{path}"
+        if ".." in path or not exists(path): return self.respond(404, {"error": "Not found", "message": self.path})
+
+        with open(path, "rb") as f:
+            payload = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def respond(self, status: int, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):  # don't log every request
+        pass
+
+
+def serve_openalex(root: str, port: int = 0, handler=OpenAlexHandler):
+    """Start a stand-in OpenAlex server, in a background thread, serving the works written by
+    make_synthetic_corpus(). Point create_subcorpora.openalex_endpoint at f"{url}/works" to use it.
+
+    Parameters
+    ----------
+        root (str): the directory passed to make_synthetic_corpus()
+        port (int): the port to listen on; 0 picks a free port
+        handler (type): the request handler class
+
+    Returns
+    ----------
+        tuple: (the server, its base URL); call server.shutdown() when done
+    """
+    works_by = {"mag": {}, "doi": {}, "title": {}}
+    if exists(f"{root}/openalex_works.jsonl"):
+        with open(f"{root}/openalex_works.jsonl", encoding="utf-8") as f:
+            for line in f:
+                work = json.loads(line)
+                if "mag" in work["ids"]: works_by["mag"][work["ids"]["mag"]] = work
+                if work["doi"]: works_by["doi"][work["doi"][16:].lower()] = work
+                works_by["title"].setdefault(process_title(work["title"]), []).append(work)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.works_by = works_by
+    server.root = root
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    pass
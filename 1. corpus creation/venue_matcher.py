@@ -0,0 +1,209 @@
+from paths import *
+from create_subcorpora import process_title
+from csv_builder import iter_papers, normalize_papers
+
+from os.path import exists, dirname, abspath
+import pandas as pd
+import numpy as np
+from tqdm import tqdm
+from multiprocessing import Pool
+import metrics
+import profiling
+
+# Google Scholar venue slugs (e.g. journal-of-accounting-research) with their categories, and the venue
+# names they were previously (fuzzily) matched to
+venue_info_path = f"{dirname(abspath(__file__))}/../3. data/GoogleScholar_venue_info.csv".replace("\\", "/")
+
+venue_columns = ["venue", "gs_venue", "gs_categories", "venue_match_score"]
+
+# built by build_venue_index(); module-level so that match_venues() pool workers inherit it on fork (or
+# receive it once through the pool initializer), as with csv_builder's author_acl_contribs
+venue_index = {}
+
+
+def venue_ngrams(name: str, n: int = 3):
+    """Get the set of character n-grams of an already-normalized venue name, padded so that the first
+    and last characters of each word take part in as many n-grams as the rest.
+
+    Parameters
+    ----------
+        name (str): a venue name, normalized with process_title()
+        n (int): the n-gram length
+
+    Returns
+    ----------
+        set: the name's n-grams
+    """
+    padded = f" {name} "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def build_venue_index(path: str = venue_info_path, n: int = 3):
+    """Build a character n-gram inverted index over normalized Google Scholar venue names: both the
+    name implied by each venue slug, and any names in its fuzzy_venue_matches.
+
+    Parameters
+    ----------
+        path (str): path to GoogleScholar_venue_info.csv
+        n (int): the n-gram length
+
+    Returns
+    ----------
+        dict: "names" (normalized candidate names), "slugs" (the slug each name belongs to),
+              "exact" (name:candidate index), "sizes" (n-grams per name), "postings" (n-gram:candidate
+              indices), "categories" (slug:"; "-joined Google Scholar categories), and "n"
+    """
+    info = pd.read_csv(path, usecols=["Google Scholar Category", "Venue", "fuzzy_venue_matches"])
+    categories = info.groupby("Venue")["Google Scholar Category"].agg(lambda c: "; ".join(sorted(set(c)))).to_dict()
+
+    names, slugs, exact = [], [], {}
+    for slug, fuzzy_match in info[["Venue", "fuzzy_venue_matches"]].drop_duplicates().itertuples(index=False):
+        for name in [slug.replace("-", " "), fuzzy_match]:
+            if not isinstance(name, str): continue  # missing fuzzy_venue_matches
+
+            name = process_title(name)
+            if name and name not in exact:
+                exact[name] = len(names)
+                names.append(name)
+                slugs.append(slug)
+
+    postings = {}
+    sizes = np.zeros(len(names), dtype=np.int32)
+    for i, name in enumerate(names):
+        grams = venue_ngrams(name, n)
+        sizes[i] = len(grams)
+        for gram in grams:
+            postings.setdefault(gram, []).append(i)
+
+    return {"names": names, "slugs": slugs, "exact": exact, "sizes": sizes, "n": n, "categories": categories,
+            "postings": {gram: np.array(p, dtype=np.int32) for gram, p in postings.items()}}
+
+
+def init_venue_worker(index: dict):
+    """Pool initializer for match_venues(); shares the venue index with each worker process.
+
+    Parameters
+    ----------
+        index (dict): see build_venue_index()
+
+    Returns
+    ----------
+        None
+    """
+    global venue_index
+    venue_index = index
+
+
+def match_venue(venue: str, min_similarity: float = 0.6):
+    """Find the Google Scholar venue most similar to the given venue name, by the Dice coefficient of
+    their character n-grams. Only candidates sharing at least one n-gram (found via the inverted index)
+    are scored, rather than every Google Scholar venue.
+
+    Parameters
+    ----------
+        venue (str): a venue name, e.g. from primary_location.source.display_name
+        min_similarity (float): the minimum Dice coefficient for a match
+
+    Returns
+    ----------
+        tuple: (Google Scholar venue slug or None, similarity)
+    """
+    name = process_title(venue) if isinstance(venue, str) else ""
+    if not name: return (None, 0.0)
+
+    if name in venue_index["exact"]:
+        return (venue_index["slugs"][venue_index["exact"][name]], 1.0)
+
+    grams = venue_ngrams(name, venue_index["n"])
+    hits = [venue_index["postings"][gram] for gram in grams if gram in venue_index["postings"]]
+    if not hits: return (None, 0.0)
+
+    shared = np.bincount(np.concatenate(hits), minlength=len(venue_index["names"]))
+    dice = 2 * shared / (len(grams) + venue_index["sizes"])
+    best = int(dice.argmax())
+
+    if dice[best] < min_similarity: return (None, float(dice[best]))
+    return (venue_index["slugs"][best], float(dice[best]))
+
+
+def _match_venue_star(args):  # Pool.imap only passes a single argument
+    return match_venue(*args)
+
+
+def match_venues(venues: list, min_similarity: float = 0.6, processes: int = None, chunksize: int = 1000):
+    """Match distinct venue names to Google Scholar venues in parallel.
+
+    Parameters
+    ----------
+        venues (list): distinct venue names
+        min_similarity (float): see match_venue()
+        processes (int): the number of worker processes; None uses every available core
+        chunksize (int): the number of venues handed to a worker at a time
+
+    Returns
+    ----------
+        pd.DataFrame: venue_columns, one row per venue
+    """
+    if not venue_index: init_venue_worker(build_venue_index())
+
+    with Pool(processes, initializer=init_venue_worker, initargs=(venue_index,)) as pool:
+        tasks = [(venue, min_similarity) for venue in venues]
+        results = list(tqdm(pool.imap(_match_venue_star, tasks, chunksize=chunksize), total=len(tasks),
+                            desc="Matching venues", leave=False))
+
+    return pd.DataFrame({"venue": venues,
+                         "gs_venue": [slug for slug, _ in results],
+                         "gs_categories": [venue_index["categories"].get(slug) for slug, _ in results],
+                         "venue_match_score": [score for _, score in results]}, columns=venue_columns)
+
+
+@metrics.stage_metrics(metrics_path)
+@profiling.profiled(profiles_path)
+def annotate_venues(papers_path: str = f"{csvs_path}/papers.csv", min_similarity: float = 0.6,
+                    processes: int = None, chunksize: int = 200000):
+    """Annotate every paper with its Google Scholar venue and categories. Each distinct venue string is
+    matched once, and matches are cached in venue_matches.csv, so that later calls (e.g. on a rebuilt
+    papers CSV) only match venues that haven't been seen before.
+
+    Parameters
+    ----------
+        papers_path (str): path to a papers .csv or .parquet file built by csv_builder()/merge_csvs()
+        min_similarity (float): see match_venue()
+        processes (int): see match_venues()
+        chunksize (int): the number of papers to read at a time
+
+    Returns
+    ----------
+        None
+    """
+    cache_path = f"{csvs_path}/venue_matches.csv"
+    out_path = f"{csvs_path}/papers_venues.csv"
+
+    if exists(cache_path):
+        cache = pd.read_csv(cache_path, keep_default_na=False, na_values={"gs_venue": [""], "gs_categories": [""]})
+    else:
+        cache = pd.DataFrame(columns=venue_columns)
+
+    distinct = set()
+    for chunk in tqdm(iter_papers(papers_path, chunksize, columns=["venue"]), desc="Collecting distinct venues"):
+        distinct.update(chunk["venue"].dropna())
+
+    new_venues = sorted(distinct - set(cache["venue"]))
+    tqdm.write(f"{len(distinct)} distinct venues; {len(new_venues)} not yet matched")
+
+    if new_venues:
+        matches = match_venues(new_venues, min_similarity, processes)
+        matches.to_csv(cache_path, mode="a" if exists(cache_path) else "w", header=not exists(cache_path), index=False)
+        cache = pd.concat([cache, matches], ignore_index=True)
+
+    cache = cache.drop_duplicates("venue").set_index("venue")
+    header = True
+    for chunk in tqdm(iter_papers(papers_path, chunksize), desc="Annotating papers"):
+        chunk = normalize_papers(chunk).join(cache, on="venue")
+        chunk.to_csv(out_path, mode="w" if header else "a", header=header, index=False)
+        header = False
+        metrics.inc("records", len(chunk))
+
+
+if __name__ == "__main__":
+    pass
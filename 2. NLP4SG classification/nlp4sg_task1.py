@@ -2,67 +2,587 @@
 # Use classifier from Adauto et al. (2023) to classify NLP papers as "NLP4SG" or "Not NLP4SG"
 #####################
 
-import torch
-from datasets import load_dataset
-from transformers import AutoModelForSequenceClassification,AutoTokenizer,pipeline
+# torch, datasets and transformers are imported where they're first needed, rather than here, so that 
+# --help, the cache and the prefilter (and the onnx backend, for torch) don't pay for loading them
 import pandas as pd
+import numpy as np
+import argparse, hashlib, json, os, random, re, sqlite3, sys, time, zlib
+import multiprocessing
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
-device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-print('Using device:', device)
+# shared stage metrics and opt-in profiling (see metrics.py and profiling.py); metrics snapshots are only 
+# written when NLP4SG_METRICS_DIR is set to a directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1. corpus creation'))
+import metrics
+import profiling
+
+device = None  # probed by get_device(), on first use
+
+model_name = "feradauto/scibert_nlp4sg"
+
+# model identity of each backend; predictions from different backends are cached separately
+backend_names = {"torch": f"{model_name}:torch", "onnx": f"{model_name}:onnx-int8"}
+
+# columns read from a Parquet corpus (see csv_builder's papers_schema); all others are never decoded
+task1_columns = ['corpus_id', 'openalex_id', 'title', 'abstract']
+
+def get_device():
+    global device
+    if device is None:
+        import torch
+        device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+        print('Using device:', device)
+    return device
+
+def load_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name, truncation=True)
 
 def load_data(dataset_path):
-    dataset = load_dataset("csv", data_files={'test':dataset_path})
+    from datasets import load_dataset, Dataset
+    if dataset_path.endswith('.parquet'):
+        # only NLP papers are classified; is_nlp row group statistics let the others be skipped unread
+        schema = pq.read_schema(dataset_path)
+        columns = [c for c in task1_columns if c in schema.names]
+        filters = [('is_nlp', '==', True)] if 'is_nlp' in schema.names else None
+        dataset = {'test': Dataset(pq.read_table(dataset_path, columns=columns, filters=filters))}
+    else:
+        dataset = load_dataset("csv", data_files={'test':dataset_path})
     return(dataset)
 
-def main(dataset):
-    tokenizer = AutoTokenizer.from_pretrained("feradauto/scibert_nlp4sg", truncation=True)
-    model = AutoModelForSequenceClassification.from_pretrained("feradauto/scibert_nlp4sg").to(device)
+class TorchBackend:
+    # eager PyTorch, fp32
+    def __init__(self, threads=None):
+        import torch
+        from transformers import AutoModelForSequenceClassification
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name).to(get_device())
+        self.model.eval()
+        self.name = backend_names["torch"]
 
-    tokenizer_kwargs = {'padding': True, 'truncation': True, 'max_length': 512}
+    def __call__(self, inputs):
+        import torch
+        with torch.inference_mode():
+            tensors = {k: torch.from_numpy(v).to(device) for k, v in inputs.items()}
+            return self.model(**tensors).logits.float().cpu().numpy()
 
-    classifier = pipeline(
-        "text-classification",
-        model=model,
-        tokenizer=tokenizer, **tokenizer_kwargs
-    )
+onnx_dir = "./onnx_scibert_nlp4sg"
 
-    labels = []
-    scores = []
+class OnnxBackend:
+    # ONNX Runtime on CPU, with dynamically int8-quantized weights; the model is exported once, to onnx_dir
+    def __init__(self, threads=None, onnx_dir=onnx_dir):
+        import onnxruntime as ort
 
-    data_all = load_data(dataset)
-    batch_size = 16
+        model_path = f"{onnx_dir}/model.int8.onnx"
+        if not os.path.exists(model_path):
+            export_onnx(onnx_dir)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or 0  # 0 lets ONNX Runtime choose
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.name = backend_names["onnx"]
+
+    def __call__(self, inputs):
+        feed = {k: v.astype(np.int64) for k, v in inputs.items() if k in self.input_names}
+        return self.session.run(["logits"], feed)[0]
 
-    for i in range(0, len(data_all['test']), batch_size):
-        batch = data_all['test'][i:i+batch_size]
+@profiling.profiled()
+def export_onnx(onnx_dir):
+    import torch
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
 
-        texts = []
-        for j in range(len(batch['title'])):
-            text = ""
-            if batch['title'][j]:
-                text += batch['title'][j]
-            if batch['abstract'][j]:
-                text += batch['abstract'][j]
-            texts.append(text)
+    os.makedirs(onnx_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.eval()
 
-        inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-        outputs = model(**inputs)
-        logits = outputs.logits
+    names = ['input_ids', 'attention_mask', 'token_type_ids']  # BertForSequenceClassification's argument order
+    dummy = tokenizer(["a sample title"], return_tensors="pt")
+    torch.onnx.export(model, tuple(dummy[n] for n in names), f"{onnx_dir}/model.onnx", input_names=names,
+                      output_names=['logits'], opset_version=17,
+                      dynamic_axes={**{n: {0: 'batch', 1: 'sequence'} for n in names}, 'logits': {0: 'batch'}})
+    quantize_dynamic(f"{onnx_dir}/model.onnx", f"{onnx_dir}/model.int8.onnx", weight_type=QuantType.QInt8)
+    print(f"exported {model_name} to {onnx_dir}")
 
-        predictions = torch.argmax(logits, dim=1).tolist()
-        scores_batch = torch.nn.functional.softmax(logits, dim=1).max(dim=1).values.tolist()
+def load_backend(backend="torch", threads=None):
+    if backend == "torch":
+        return TorchBackend(threads)
+    elif backend == "onnx":
+        return OnnxBackend(threads)
+    raise ValueError(f"backend (= {backend}) must be 'torch' or 'onnx'")
 
-        labels.extend(['NLP4SG' if p == 1 else 'Not NLP4SG' for p in predictions])
-        scores.extend(scores_batch)
+def build_texts(batch):
+    # title and abstract, concatenated; either may be missing
+    abstracts = batch.get('abstract', [None] * len(batch['title']))
+    texts = []
+    for j in range(len(batch['title'])):
+        text = ""
+        if batch['title'][j]:
+            text += batch['title'][j]
+        if abstracts[j]:
+            text += abstracts[j]
+        texts.append(text)
+    return texts
 
-        if (i+batch_size)%1000==0:
-            print(f"progress: {i + batch_size}/{len(data_all['test'])}")
+def make_batches(lengths, max_tokens=8192, max_batch_size=256):
+    # group row indices, longest first, so that each batch's padded size (rows * longest row) stays
+    # under max_tokens; similar lengths end up together, so little of each batch is padding
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    batch = []
+    for i in order:
+        # order is descending, so the batch's first row is its longest
+        if batch and ((len(batch) + 1) * lengths[batch[0]] > max_tokens or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
 
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+def classify(texts, backend, tokenizer, max_tokens=8192, max_length=512, progress_every=1000, desc="progress"):
+    # tokenize everything once, unpadded; each batch is then padded only to its own longest row
+    encodings = tokenizer(texts, truncation=True, max_length=max_length)
+    lengths = [len(ids) for ids in encodings['input_ids']]
+
+    labels = [None] * len(texts)
+    scores = [None] * len(texts)
+    done = 0
+    start = time.perf_counter()
+
+    for batch in make_batches(lengths, max_tokens):
+        features = {k: [encodings[k][i] for i in batch] for k in encodings.keys()}
+        with metrics.timer('batch_latency'):
+            logits = backend(dict(tokenizer.pad(features, return_tensors="np")))
+
+        predictions = logits.argmax(axis=1).tolist()
+        scores_batch = softmax(logits).max(axis=1).tolist()
+
+        # put predictions back in their original row order
+        for i, p, score in zip(batch, predictions, scores_batch):
+            labels[i] = 'NLP4SG' if p == 1 else 'Not NLP4SG'
+            scores[i] = score
+
+        if (done + len(batch)) // progress_every > done // progress_every:
+            print(f"{desc}: {done + len(batch)}/{len(texts)} ({(done + len(batch)) / (time.perf_counter() - start):.1f} papers/s)")
+        done += len(batch)
+
+    elapsed = time.perf_counter() - start
+    print(f"{desc}: classified {len(texts)} papers in {elapsed:.1f}s ({len(texts) / max(elapsed, 1e-9):.1f} papers/s)")
     return labels, scores
 
+# tokenizer and backend of a run_sharded() worker process, loaded once by init_shard_worker()
+worker_state = {}
+
+def init_shard_worker(backend, threads):
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads)
+    worker_state['tokenizer'] = load_tokenizer()
+    worker_state['backend'] = load_backend(backend, threads)
+
+def classify_shard(args):
+    shard_index, texts, max_tokens = args
+    return classify(texts, worker_state['backend'], worker_state['tokenizer'], max_tokens=max_tokens, 
+                    desc=f"shard {shard_index}")
+
+def make_shard_pool(num_shards, threads_per_shard=2, backend="torch"):
+    # one worker process per shard, each pinned to threads_per_shard threads
+    if backend == "onnx" and not os.path.exists(f"{onnx_dir}/model.int8.onnx"):
+        export_onnx(onnx_dir)  # export once, before the workers would each try to
+
+    # spawn, rather than fork, so that workers don't inherit the parent's torch thread pool
+    return multiprocessing.get_context("spawn").Pool(num_shards, initializer=init_shard_worker, 
+                                                     initargs=(backend, threads_per_shard))
+
+def run_sharded(texts, pool, num_shards, max_tokens=8192):
+    # split texts into num_shards contiguous shards, each classified by one of pool's workers, then merge 
+    # the shards' results back in input order
+    bounds = [len(texts) * i // num_shards for i in range(num_shards + 1)]
+    shards = [(i, texts[bounds[i]:bounds[i + 1]], max_tokens) for i in range(num_shards)]
+    results = pool.map(classify_shard, shards, chunksize=1)
+
+    labels = [label for shard_labels, _ in results for label in shard_labels]
+    scores = [score for _, shard_scores in results for score in shard_scores]
+    return labels, scores
+
+class Classifier:
+    # a backend (or pool of shard workers), loaded on first use and then reused for every call; if every 
+    # text is found in the cache, the model is never loaded at all
+    def __init__(self, backend="torch", threads=None, shards=1, max_tokens=8192):
+        self.backend = backend
+        self.threads = threads
+        self.shards = shards
+        self.max_tokens = max_tokens
+        self.name = backend_names[backend]
+        self.model = None
+        self.tokenizer = None
+        self.pool = None
+
+    def __call__(self, texts):
+        if not texts:
+            return [], []
+        if self.shards > 1:
+            if self.pool is None:
+                self.pool = make_shard_pool(self.shards, self.threads or 2, self.backend)
+            return run_sharded(texts, self.pool, self.shards, self.max_tokens)
+        if self.model is None:
+            self.tokenizer = load_tokenizer()
+            self.model = load_backend(self.backend, self.threads)
+        return classify(texts, self.model, self.tokenizer, max_tokens=self.max_tokens)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+class PredictionCache:
+    # persistent cache of (label, score), keyed by a hash of the model identity and the exact title+abstract text
+    def __init__(self, path="./nlp4sg_task1_cache.sqlite"):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS predictions (key BLOB PRIMARY KEY, label TEXT, score REAL)")
+
+    @staticmethod
+    def key(model_id, text):
+        return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, keys, chunk_size=500):
+        found = {}
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i+chunk_size]
+            rows = self.conn.execute(f"SELECT key, label, score FROM predictions WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            found.update({key: (label, score) for key, label, score in rows})
+        return found
+
+    def put_many(self, keys, labels, scores):
+        with self.conn:  # one transaction
+            self.conn.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)", zip(keys, labels, scores))
+
+def predict(texts, classifier, cache=None):
+    # classify texts, running the model only on those (distinct) texts missing from the cache, if any
+    if cache:
+        keys = [PredictionCache.key(classifier.name, text) for text in texts]
+        cached = cache.get_many(keys)
+        missing = {}  # key: index of its first text; identical texts are only classified once
+        for i, key in enumerate(keys):
+            if key not in cached and key not in missing:
+                missing[key] = i
+        hits = len(texts) - sum(k not in cached for k in keys)
+        metrics.inc('cache_hits', hits)
+        metrics.inc('cache_misses', len(texts) - hits)
+        print(f"cache: {hits} hits, {len(missing)} distinct misses")
+        to_classify = [texts[i] for i in missing.values()]
+    else:
+        to_classify = texts
+
+    labels, scores = classifier(to_classify)
+    if not cache:
+        return labels, scores
+
+    cache.put_many(list(missing), labels, scores)
+    cached.update(zip(missing, zip(labels, scores)))
+    return [cached[k][0] for k in keys], [cached[k][1] for k in keys]
+
+@profiling.profiled()
+def check_agreement(texts, tokenizer, reference, candidate, sample_size=1000, seed=0, max_tokens=8192):
+    # compare a candidate backend's predictions to a reference backend's (e.g. onnx vs. torch) on a random sample
+    sample = random.Random(seed).sample(texts, min(sample_size, len(texts)))
+    ref_labels, ref_scores = classify(sample, reference, tokenizer, max_tokens=max_tokens)
+    labels, scores = classify(sample, candidate, tokenizer, max_tokens=max_tokens)
+
+    deltas = np.abs(np.array(scores) - np.array(ref_scores))
+    agreement = {'sample_size': len(sample),
+                 'flip_rate': float(np.mean([a != b for a, b in zip(labels, ref_labels)])),
+                 'mean_score_delta': float(deltas.mean()),
+                 'max_score_delta': float(deltas.max())}
+    print(f"{candidate.name} vs. {reference.name}: {agreement}")
+    return agreement
+
+def hash_features(texts, n_features=2**18):
+    # binary word unigram and bigram features, hashed into n_features buckets and L2-normalized per text; 
+    # returned as a CSR matrix (indptr, indices, data)
+    indptr = [0]
+    indices = []
+    data = []
+    for text in texts:
+        tokens = re.findall(r"\w+", text.lower())
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        buckets = {zlib.crc32(g.encode("utf-8")) % n_features for g in grams}
+        indices.extend(buckets)
+        data.extend([1 / np.sqrt(len(buckets))] * len(buckets))
+        indptr.append(len(indices))
+    return np.array(indptr), np.array(indices, dtype=np.int64), np.array(data, dtype=np.float32)
+
+class Prefilter:
+    # logistic regression over hash_features(), fit to SciBERT's labels; texts scoring below threshold are 
+    # confidently "Not NLP4SG", and skip SciBERT entirely
+    def __init__(self, weights, bias, threshold=0.0, n_features=2**18):
+        self.weights = weights
+        self.bias = bias
+        self.threshold = threshold
+        self.n_features = n_features
+
+    @staticmethod
+    def logits(features, weights, bias):
+        indptr, indices, data = features
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        return np.bincount(rows, weights=weights[indices] * data, minlength=len(indptr) - 1) + bias
+
+    def scores(self, texts):
+        # probability of "NLP4SG"
+        return 1 / (1 + np.exp(-self.logits(hash_features(texts, self.n_features), self.weights, self.bias)))
+
+    @classmethod
+    def train(cls, texts, labels, n_features=2**18, epochs=300, lr=1.0, l2=1e-6):
+        # full-batch gradient descent on class-balanced log loss, so that rare NLP4SG papers aren't ignored
+        features = hash_features(texts, n_features)
+        indptr, indices, data = features
+        rows = np.repeat(np.arange(len(texts)), np.diff(indptr))
+        y = np.asarray(labels, dtype=np.float64)
+        pos = max(y.sum(), 1)
+        sample_weights = np.where(y == 1, len(y) / (2 * pos), len(y) / (2 * max(len(y) - pos, 1))) / len(y)
+
+        weights = np.zeros(n_features)
+        bias = 0.0
+        for _ in range(epochs):
+            p = 1 / (1 + np.exp(-cls.logits(features, weights, bias)))
+            errors = (p - y) * sample_weights
+            weights -= lr * (np.bincount(indices, weights=errors[rows] * data, minlength=n_features) + l2 * weights)
+            bias -= lr * errors.sum()
+        return cls(weights, bias, 0.0, n_features)
+
+    def save(self, path):
+        np.savez(path, weights=self.weights, bias=self.bias, threshold=self.threshold, n_features=self.n_features)
+
+    @classmethod
+    def load(cls, path):
+        f = np.load(path)
+        return cls(f['weights'], float(f['bias']), float(f['threshold']), int(f['n_features']))
+
+def sample_texts(dataset_path, sample_size, seed=0, chunk_size=10000):
+    # reservoir sample of sample_size texts from the whole dataset, in one streaming pass
+    rng = random.Random(seed)
+    sample = []
+    seen = 0
+    for chunk in iter_chunks(dataset_path, chunk_size):
+        for text in build_texts(chunk_records(chunk)):
+            if len(sample) < sample_size:
+                sample.append(text)
+            else:
+                j = rng.randrange(seen + 1)
+                if j < sample_size:
+                    sample[j] = text
+            seen += 1
+    return sample
+
+@profiling.profiled()
+def calibrate_prefilter(dataset_path, classifier, cache=None, sample_size=20000, target_recall=0.99, seed=0):
+    # fit a Prefilter to SciBERT's labels on a sample, choose the threshold that keeps target_recall of 
+    # SciBERT's NLP4SG papers on a calibration split, and report its effect on a held-out split
+    texts = sample_texts(dataset_path, sample_size, seed)
+    random.Random(seed).shuffle(texts)
+    labels, _ = predict(texts, classifier, cache)
+    y = np.array([label == 'NLP4SG' for label in labels])
+
+    train_end, cal_end = int(len(texts) * 0.6), int(len(texts) * 0.8)
+    prefilter = Prefilter.train(texts[:train_end], y[:train_end])
+
+    cal_scores = prefilter.scores(texts[train_end:cal_end])
+    cal_positives = np.sort(cal_scores[y[train_end:cal_end]])
+    if len(cal_positives):
+        # the largest threshold that still passes target_recall of the calibration positives
+        prefilter.threshold = float(cal_positives[int(np.floor(len(cal_positives) * (1 - target_recall)))])
+
+    held_scores = prefilter.scores(texts[cal_end:])
+    held_y = y[cal_end:]
+    skipped = held_scores < prefilter.threshold
+    report = {'threshold': prefilter.threshold,
+              'held_out_size': len(held_y),
+              'skipped_fraction': float(skipped.mean()) if len(held_y) else 0.0,
+              'recall_loss': float(skipped[held_y].mean()) if held_y.any() else 0.0}
+    print(f"prefilter calibration: {report}")
+    return prefilter, report
+
+@metrics.stage_metrics(name='nlp4sg_task1')
+@profiling.profiled(name='nlp4sg_task1')
+def main(dataset, max_tokens=8192, backend="torch", threads=None, shards=1, cache_path=None):
+    data_all = load_data(dataset)
+    texts = build_texts(data_all['test'][:])
+
+    classifier = Classifier(backend, threads, shards, max_tokens)
+    try:
+        return predict(texts, classifier, PredictionCache(cache_path) if cache_path else None)
+    finally:
+        classifier.close()
+
+def canonical_fingerprint(canonical_path):
+    # the content hash of a canonical ID mapping (or None, without one); a checkpoint only counts rows 
+    # correctly under the mapping it was written with
+    if not canonical_path:
+        return None
+    h = hashlib.sha256()
+    with open(canonical_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def iter_chunks(dataset_path, chunk_size=10000, skip_rows=0, redundant=None):
+    # stream the rows load_data() would load, chunk_size at a time, after the first skip_rows; rows in 
+    # redundant (see dedup.redundant_rows()) are left out before counting, so checkpoints stay consistent
+    if dataset_path.endswith('.parquet'):
+        dataset = ds.dataset(dataset_path)
+        columns = [c for c in task1_columns if c in dataset.schema.names]
+        filter = (ds.field('is_nlp') == True) if 'is_nlp' in dataset.schema.names else None
+        chunks = (batch.to_pandas() for batch in dataset.to_batches(columns=columns, filter=filter, batch_size=chunk_size))
+    elif redundant is None:
+        yield from pd.read_csv(dataset_path, chunksize=chunk_size, skiprows=range(1, skip_rows + 1))
+        return
+    else:
+        chunks = pd.read_csv(dataset_path, chunksize=chunk_size)
+
+    for chunk in chunks:
+        if redundant is not None and len(redundant):
+            pairs = pd.MultiIndex.from_arrays([chunk['corpus_id'].astype(np.int64), chunk['openalex_id'].astype(str)])
+            chunk = chunk.loc[~pairs.isin(redundant)]
+        if skip_rows >= len(chunk):
+            skip_rows -= len(chunk)
+            continue
+        yield chunk.iloc[skip_rows:].copy()  # a copy, since run() adds the label columns to it
+        skip_rows = 0
+
+def chunk_records(chunk):
+    # title/abstract columns of a DataFrame chunk as lists, with missing values as None (see build_texts())
+    text_columns = [c for c in ['title', 'abstract'] if c in chunk.columns]
+    return chunk[text_columns].astype(object).where(chunk[text_columns].notna(), None).to_dict('list')
+
+def cascade(texts, prefilter, classifier, cache=None):
+    # texts scoring below the prefilter's threshold are labelled "Not NLP4SG" (scored 1 - the prefilter's 
+    # NLP4SG probability); only the rest go through SciBERT
+    p = prefilter.scores(texts)
+    passed = np.flatnonzero(p >= prefilter.threshold)
+    labels = ['Not NLP4SG'] * len(texts)
+    scores = (1 - p).tolist()
+
+    passed_labels, passed_scores = predict([texts[i] for i in passed], classifier, cache)
+    for i, label, score in zip(passed, passed_labels, passed_scores):
+        labels[i] = label
+        scores[i] = score
+    return labels, scores, len(texts) - len(passed)
+
+@metrics.stage_metrics(name='nlp4sg_task1')
+@profiling.profiled(name='nlp4sg_task1')
+def run(dataset_path, output_path, chunk_size=10000, max_tokens=8192, backend="torch", threads=None, shards=1,
+        cache_path=None, prefilter_path=None, prefilter_recall=0.99, prefilter_sample=20000, canonical_path=None):
+    # classify dataset_path chunk by chunk, appending each chunk's results to output_path (a CSV, or for 
+    # Parquet input, a directory of Parquet parts) and checkpointing the number of rows done after each; 
+    # a restarted run resumes after the last checkpointed chunk. if prefilter_path is given, papers are first 
+    # passed through a Prefilter (calibrated, then saved to prefilter_path, if it doesn't exist yet). if 
+    # canonical_path is given, papers it maps to another (duplicate) paper are skipped; a checkpoint records 
+    # the mapping's fingerprint, and a run with another mapping refuses to resume from it
+    checkpoint_path = f"{output_path}.checkpoint.json"
+    canonical = canonical_fingerprint(canonical_path)
+    checkpoint = {'rows': 0, 'bytes': 0, 'skipped': 0, 'canonical': canonical}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('canonical') != canonical:
+            raise ValueError(f"{checkpoint_path} was written with a different canonical ID mapping than "
+                             f"{canonical_path}, so its row count doesn't apply; delete it and {output_path} to start over")
+        print(f"resuming after row {checkpoint['rows']}")
+
+    to_parquet = dataset_path.endswith('.parquet')
+    if to_parquet:
+        os.makedirs(output_path, exist_ok=True)
+    elif os.path.exists(output_path):
+        with open(output_path, 'r+b') as f:
+            f.truncate(checkpoint['bytes'])  # drop any rows appended after the last checkpoint
+
+    classifier = Classifier(backend, threads, shards, max_tokens)
+    cache = PredictionCache(cache_path) if cache_path else None
+    try:
+        prefilter = None
+        if prefilter_path and os.path.exists(prefilter_path):
+            prefilter = Prefilter.load(prefilter_path)
+        elif prefilter_path:
+            prefilter, _ = calibrate_prefilter(dataset_path, classifier, cache, prefilter_sample, prefilter_recall)
+            prefilter.save(prefilter_path)
+
+        redundant = None
+        if canonical_path:
+            from dedup import redundant_rows
+            redundant = redundant_rows(canonical_path)
+        for chunk in iter_chunks(dataset_path, chunk_size, checkpoint['rows'], redundant):
+            texts = build_texts(chunk_records(chunk))
+            metrics.inc('records', len(texts))
+            if prefilter:
+                chunk['nlp4sg_label'], chunk['nlp4sg_score'], skipped = cascade(texts, prefilter, classifier, cache)
+                checkpoint['skipped'] = checkpoint.get('skipped', 0) + skipped
+                metrics.inc('prefilter_skipped', skipped)
+            else:
+                chunk['nlp4sg_label'], chunk['nlp4sg_score'] = predict(texts, classifier, cache)
+
+            if to_parquet:
+                chunk.to_parquet(f"{output_path}/part-{checkpoint['rows']:012d}.parquet", index=False)
+            else:
+                chunk.to_csv(output_path, mode='a', header=checkpoint['rows'] == 0, index=False)
+                checkpoint['bytes'] = os.path.getsize(output_path)
+            checkpoint['rows'] += len(chunk)
+
+            with open(f"{checkpoint_path}.tmp", 'w') as f:
+                json.dump(checkpoint, f)
+            os.replace(f"{checkpoint_path}.tmp", checkpoint_path)  # atomic, so a crash can't corrupt it
+            print(f"checkpoint: {checkpoint['rows']} rows written to {output_path}" + 
+                  (f" ({checkpoint['skipped'] / checkpoint['rows']:.1%} skipped by prefilter)" if prefilter else ""))
+    finally:
+        classifier.close()
+
 if __name__ == '__main__':
-    corpus_path = '<insert>.csv'
-    preds, scores = main(corpus_path)
-    df = pd.read_csv(corpus_path)
-    df['nlp4sg_label'] = preds
-    df['nlp4sg_score'] = scores
-    df.to_csv('nlp4sg_results_task_1.csv')
\ No newline at end of file
+    args = argparse.ArgumentParser()
+    args.add_argument("--data", type=str, required=True)
+    args.add_argument("--output", type=str, default=None, 
+                      help="defaults to nlp4sg_results_task_1.csv (or, for Parquet input, nlp4sg_results_task_1.parquet/)")
+    args.add_argument("--chunk_size", type=int, default=10000, help="rows classified and written per checkpoint")
+    args.add_argument("--backend", type=str, default="torch", choices=["torch", "onnx"])
+    args.add_argument("--threads", type=int, default=None, help="intra-op threads (per shard, if --shards > 1)")
+    args.add_argument("--shards", type=int, default=1, help="number of worker processes, each classifying a contiguous shard")
+    args.add_argument("--max_tokens", type=int, default=8192)
+    args.add_argument("--cache", type=str, default="./nlp4sg_task1_cache.sqlite", 
+                      help="prediction cache, so that only new or changed papers are classified; '' to disable")
+    args.add_argument("--prefilter", type=str, default=None, 
+                      help="path to a prefilter (.npz); calibrated against SciBERT on a sample first, if it doesn't exist")
+    args.add_argument("--prefilter_recall", type=float, default=0.99, help="SciBERT NLP4SG recall the prefilter must keep")
+    args.add_argument("--prefilter_sample", type=int, default=20000, help="papers sampled to calibrate the prefilter")
+    args.add_argument("--canonical_ids", type=str, default=None, 
+                      help="canonical ID mapping (see dedup.py), whose duplicate papers are skipped")
+    args.add_argument("--check_agreement", type=int, default=0, 
+                      help="compare the onnx backend to torch on a sample of this many papers, then exit")
+    args.add_argument("--profile", type=str, default=None, 
+                      help="comma-separated profile modes (cpu, mem, rss, or all); see profiling.py")
+    args.add_argument("--profile_dir", type=str, default=None, help="where profile artifacts are written")
+    args.add_argument("--mem_budget_mb", type=float, default=None, 
+                      help="warn as RSS nears this (default: NLP4SG_MEM_BUDGET_MB, or the SLURM allocation)")
+    args = vars(args.parse_args())
+    corpus_path = args['data']
+    profiling.configure(args['profile'], args['profile_dir'], args['mem_budget_mb'])
+
+    if args['check_agreement']:
+        tokenizer = load_tokenizer()
+        texts = build_texts(load_data(corpus_path)['test'][:])
+        check_agreement(texts, tokenizer, load_backend("torch", args['threads']), load_backend("onnx", args['threads']),
+                        sample_size=args['check_agreement'], max_tokens=args['max_tokens'])
+        raise SystemExit
+
+    output_path = args['output'] or ('nlp4sg_results_task_1.parquet' if corpus_path.endswith('.parquet') 
+                                     else 'nlp4sg_results_task_1.csv')
+    run(corpus_path, output_path, args['chunk_size'], args['max_tokens'], args['backend'], args['threads'], 
+        args['shards'], args['cache'], args['prefilter'], args['prefilter_recall'], args['prefilter_sample'], 
+        args['canonical_ids'])
\ No newline at end of file
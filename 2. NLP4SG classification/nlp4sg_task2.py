@@ -2,14 +2,29 @@
 # Predict UN Sustainable Development Goals associated with NLP4SG papers
 #####################
 
-import csv, os, sys, openai, argparse, torch
+# openai, torch, transformers and datasets are imported where they're first needed, rather than here, so 
+# that --help and --merge_shards (and each backend, for the other's dependencies) don't pay for loading them
+import csv, os, sys, argparse
+import asyncio, datetime, email.utils, hashlib, io, json, random, sqlite3, time
 import pandas as pd
 import numpy as np
-from transformers import pipeline
-from datasets import load_dataset
+import pyarrow.dataset as ds
 
-device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-print('Using device:', device)
+# shared stage metrics and opt-in profiling (see metrics.py and profiling.py); metrics snapshots are only 
+# written when NLP4SG_METRICS_DIR is set to a directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1. corpus creation'))
+import metrics
+import profiling
+
+device = None  # probed by get_device(), on first use
+
+def get_device():
+    global device
+    if device is None:
+        import torch
+        device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+        print('Using device:', device)
+    return device
 
 candidate_labels = ['No Poverty',
  'No Hunger',
@@ -67,6 +82,66 @@ descs=['End poverty in all its forms everywhere',
    'Promote peaceful and inclusive societies for sustainable development, provide access to justice for all and build effective, accountable and inclusive institutions at all levels',
    'Strengthen the means of implementation and revitalize the global partnership for sustainable development']
 
+class RateLimiter:
+    # token buckets for requests and (estimated) tokens per minute; None disables a limit
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.limits = {'requests': requests_per_minute, 'tokens': tokens_per_minute}
+        self.available = {k: v for k, v in self.limits.items() if v}
+        self.updated = time.monotonic()
+
+    async def acquire(self, tokens):
+        needed = {'requests': 1, 'tokens': tokens}
+        while True:
+            now = time.monotonic()
+            for k in self.available:  # refill each bucket at its per-minute rate, up to one minute's worth
+                self.available[k] = min(self.limits[k], self.available[k] + (now - self.updated) * self.limits[k] / 60)
+            self.updated = now
+
+            # a request larger than a whole bucket waits for a full bucket, rather than forever
+            wait = max([(min(needed[k], self.limits[k]) - self.available[k]) * 60 / self.limits[k] for k in self.available] + [0])
+            if wait <= 0:
+                for k in self.available:
+                    self.available[k] -= needed[k]
+                return
+            await asyncio.sleep(wait)
+
+def retry_delay(retry_after, now=None):
+    # seconds to wait, from a Retry-After header: either a number of seconds or an HTTP date (RFC 9110); None 
+    # if it's missing or unparseable
+    if not retry_after:
+        return None
+    try:
+        seconds = float(retry_after)
+        return max(0.0, seconds) if np.isfinite(seconds) else None
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:  # per the RFC, HTTP dates are in GMT
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (date - now).total_seconds())
+
+class ResponseCache:
+    # durable cache of raw completions, keyed by a hash of (model_version, full prompt, decoding params)
+    def __init__(self, path="./nlp4sg_task2_cache.sqlite"):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key BLOB PRIMARY KEY, response TEXT)")
+
+    @staticmethod
+    def key(model_version, prompt, decoding):
+        return hashlib.sha256(json.dumps([model_version, prompt, decoding], sort_keys=True).encode("utf-8")).digest()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, response):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)", (key, response))
+
 class MLModel:
     def __init__(self):
         pass
@@ -76,6 +151,10 @@ class MLModel:
         prediction = self.perform_prediction(data)
         processed_response = self.process_response(prediction)
         return processed_response
+
+    def predict_many(self, data):
+        # predictions for a list of inputs, in order; subclasses may run these concurrently
+        return [self.predict(d) for d in data]
     
     def perform_prediction(self, processed_data):
         raise NotImplementedError
@@ -83,8 +162,17 @@ class MLModel:
         raise NotImplementedError
 
 class OpenAIModel(MLModel):
-    def __init__(self,model_version=None):
+    def __init__(self,model_version=None,base_url=None,concurrency=8,requests_per_minute=None,tokens_per_minute=None,max_retries=6,
+                 cache_path=None,offline=False):
         self.model_version = model_version
+        self.cache = ResponseCache(cache_path) if cache_path else None
+        self.offline = offline  # only use cached responses; never call the API
+        self.base_url = base_url  # any OpenAI-compatible server; None uses OPENAI_BASE_URL, or the OpenAI API
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.decoding = {'temperature': 0, 'max_tokens': 100, 'logprobs': 1}
         self.preprompt="There is an NLP paper with the title and abstract:\n"
         self.question="Which of the UN goals does this paper directly contribute to? Provide the goal number and name."
         self.OPENAI_API_KEY=os.getenv("OPENAI_API_KEY")
@@ -109,13 +197,90 @@ class OpenAIModel(MLModel):
         }
         self.response_columns=['prompt','response','sdg1','sdg2','sdg3','sdg4','sdg5','sdg6','sdg7','sdg8','sdg9', 'sdg10','sdg11','sdg12','sdg13','sdg14','sdg15','sdg16','sdg17']
     
+    def build_prompt(self, data):
+        return self.preprompt+data+"\n"+self.question
+
+    def cached_prediction(self, prompt):
+        # the cached prediction for a prompt, if any
+        if not self.cache:
+            return None
+        response = self.cache.get(ResponseCache.key(self.model_version, prompt, self.decoding))
+        metrics.inc('cache_hits' if response is not None else 'cache_misses')
+        return {'response': response, 'prompt': prompt} if response is not None else None
+
+    def cache_prediction(self, prediction):
+        if self.cache:
+            self.cache.put(ResponseCache.key(self.model_version, prediction['prompt'], self.decoding), prediction['response'])
+
     def perform_prediction(self, data):
         prediction=dict()
-        data=self.preprompt+data+"\n"+self.question
-        completion = openai.Completion.create(engine=self.model_version, prompt=data,temperature=0,max_tokens=100,logprobs=1)
+        data=self.build_prompt(data)
+        cached = self.cached_prediction(data)
+        if cached or self.offline:
+            return cached
+        import openai
+        client = openai.OpenAI(api_key=self.OPENAI_API_KEY or "EMPTY", base_url=self.base_url, max_retries=self.max_retries)
+        metrics.inc('http_requests')
+        with metrics.timer('http_latency'):
+            completion = client.completions.create(model=self.model_version, prompt=data, **self.decoding)
+        prediction['response']=completion.choices[0].text
+        prediction['prompt']=data
+        self.cache_prediction(prediction)
+        return prediction
+
+    async def aperform_prediction(self, data, client, semaphore, limiter):
+        prediction=dict()
+        data=self.build_prompt(data)
+        cached = self.cached_prediction(data)
+        if cached or self.offline:
+            return cached
+        import openai
+        estimated_tokens = len(data) // 4 + self.decoding['max_tokens']  # ~4 characters per token
+
+        async with semaphore:  # at most self.concurrency requests in flight
+            for attempt in range(self.max_retries + 1):
+                await limiter.acquire(estimated_tokens)
+                metrics.inc('http_requests')
+                try:
+                    with metrics.timer('http_latency'):
+                        completion = await client.completions.create(model=self.model_version, prompt=data, **self.decoding)
+                    break
+                except (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError) as e:
+                    if attempt == self.max_retries:
+                        raise
+                    metrics.inc('retries', error=type(e).__name__)
+                    # exponential backoff with jitter, unless the server says how long to wait
+                    retry_after = getattr(getattr(e, 'response', None), 'headers', {}).get('retry-after')
+                    delay = retry_delay(retry_after)
+                    if delay is None:
+                        delay = min(60, 2 ** attempt) * (0.5 + random.random() / 2)
+                    await asyncio.sleep(delay)
+
         prediction['response']=completion.choices[0].text
         prediction['prompt']=data
+        self.cache_prediction(prediction)
         return prediction
+
+    async def _apredict_many(self, data):
+        # retries are handled by aperform_prediction, so that they go through the rate limiter
+        import openai
+        client = openai.AsyncOpenAI(api_key=self.OPENAI_API_KEY or "EMPTY", base_url=self.base_url, max_retries=0)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+        try:
+            predictions = await asyncio.gather(*(self.aperform_prediction(d, client, semaphore, limiter) for d in data))
+        finally:
+            await client.close()
+        return predictions
+
+    def predict_many(self, data):
+        # up to self.concurrency requests in flight at once; results are returned in input order. offline, 
+        # inputs without a cached response get None
+        if self.offline:
+            predictions = [self.perform_prediction(d) for d in data]
+        else:
+            predictions = asyncio.run(self._apredict_many(data))
+        return [self.process_response(p) if p else None for p in predictions]
     
     def process_response(self, pred):
         predictions = {'sdg1': 0.0, 'sdg2': 0.0, 'sdg3': 0.0, 'sdg4': 0.0, 'sdg5': 0.0, 'sdg6': 0.0, 'sdg7': 0.0, 'sdg8': 0.0, 'sdg9': 0.0, 'sdg10': 0.0, 'sdg11': 0.0, 'sdg12': 0.0, 'sdg13': 0.0, 'sdg14': 0.0, 'sdg15': 0.0, 'sdg16': 0.0, 'sdg17': 0.0}
@@ -127,27 +292,309 @@ class OpenAIModel(MLModel):
         predictions['response']=pred['response']
         return predictions
 
+class EmbeddingModel(MLModel):
+    # local, offline SDG labelling: papers and goal descriptions are embedded with the same sentence encoder, and
+    # each paper gets every goal whose description is similar enough to it (by cosine similarity)
+    def __init__(self,model_version="sentence-transformers/all-MiniLM-L6-v2",threshold=0.3,top_k=3,batch_size=128,
+                 goal_cache_dir="./sdg_goal_embeddings"):
+        self.model_version = model_version
+        self.threshold = threshold  # minimum cosine similarity for a goal to be assigned
+        self.top_k = top_k  # maximum goals assigned per paper
+        self.batch_size = batch_size
+        from transformers import AutoTokenizer, AutoModel
+        self.tokenizer = AutoTokenizer.from_pretrained(model_version)
+        self.model = AutoModel.from_pretrained(model_version).to(get_device())
+        self.model.eval()
+        self.goal_embeddings = self.load_goal_embeddings(goal_cache_dir)
+        self.response_columns=['prompt','response']+candidate_goals
+
+    def embed(self, texts):
+        # mean-pooled, L2-normalized embeddings, batch_size texts at a time
+        import torch
+        embeddings = []
+        with torch.inference_mode():
+            for i in range(0, len(texts), self.batch_size):
+                inputs = self.tokenizer(texts[i:i+self.batch_size], return_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
+                hidden = self.model(**inputs).last_hidden_state
+                mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                embeddings.append(torch.nn.functional.normalize(pooled, dim=1).float().cpu().numpy())
+        return np.concatenate(embeddings) if embeddings else np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+
+    def load_goal_embeddings(self, goal_cache_dir):
+        # the 17 goals are embedded once per encoder, then reused from goal_cache_dir
+        path = f"{goal_cache_dir}/{self.model_version.replace('/', '__')}.npy"
+        if os.path.exists(path):
+            return np.load(path)
+        os.makedirs(goal_cache_dir, exist_ok=True)
+        goal_embeddings = self.embed([f"{label}: {desc}" for label, desc in zip(candidate_labels, descs)])
+        np.save(path, goal_embeddings)
+        return goal_embeddings
+
+    def perform_predictions(self, texts):
+        similarities = self.embed(texts) @ self.goal_embeddings.T
+        return [{'prompt': text, 'similarities': row} for text, row in zip(texts, similarities)]
+
+    def perform_prediction(self, data):
+        return self.perform_predictions([data])[0]
+
+    def predict_many(self, data):
+        return [self.process_response(p) for p in self.perform_predictions(list(data))]
+
+    def process_response(self, pred):
+        predictions = {goal: 0.0 for goal in candidate_goals}
+        ranked = np.argsort(-pred['similarities'])[:self.top_k]
+        for i in ranked:
+            if pred['similarities'][i] >= self.threshold:
+                predictions[candidate_goals[i]]=1
+        predictions['prompt']=pred['prompt']
+        # the top goals' similarities, in place of a completion
+        predictions['response']="; ".join(f"{candidate_goals[i]}:{pred['similarities'][i]:.3f}" for i in ranked)
+        return predictions
+
+# columns carried over from the task 1 results, where present (all others are never decoded); results are keyed 
+# on the first of id_columns present: corpus_id in task 1's own output, ID in older results CSVs
+task2_columns = ['corpus_id', 'openalex_id', 'ID', 'title', 'abstract', 'text', 'year', 'nlp4sg_score']
+id_columns = ['corpus_id', 'ID']
+
 def load_data(dataset_path):
-    dataset = load_dataset("csv", data_files={'test':dataset_path})['test']
+    from datasets import load_dataset, Dataset
+    if dataset_path.endswith('.parquet') or os.path.isdir(dataset_path):
+        # a Parquet file, or the directory of part-*.parquet files task 1 writes for Parquet input; only papers 
+        # classified as NLP4SG get an SDG prediction
+        dataset = ds.dataset(dataset_path, format='parquet')
+        names = dataset.schema.names
+        filter = (ds.field('nlp4sg_label') == 'NLP4SG') if 'nlp4sg_label' in names else None
+        dataset = Dataset(dataset.to_table(columns=[c for c in task2_columns if c in names], filter=filter))
+    else:
+        # a task 1 results CSV gets the same filter and projection
+        dataset = load_dataset("csv", data_files={'test':dataset_path})['test']
+        if 'nlp4sg_label' in dataset.column_names:
+            dataset = dataset.filter(lambda batch: [label == 'NLP4SG' for label in batch['nlp4sg_label']], batched=True)
+        dataset = dataset.select_columns([c for c in task2_columns if c in dataset.column_names])
     return(dataset)
 
+def output_columns(column_names):
+    # the task2_columns present in the input, with its ID column first (see merge_shards())
+    present = [c for c in task2_columns if c in column_names]
+    id_column = next((c for c in id_columns if c in present), None)
+    if id_column is None:
+        raise ValueError(f"task 2 input needs one of {id_columns} (has {list(column_names)})")
+    return id_column, [id_column] + [c for c in present if c != id_column]
+
+def input_texts(batch):
+    # the text to label: a text column where there is one (older results CSVs), else title and abstract
+    if 'text' in batch:
+        return batch['text']
+    abstracts = batch.get('abstract', [None] * len(batch['title']))
+    return ["\n".join(t for t in (title, abstract) if t) for title, abstract in zip(batch['title'], abstracts)]
+
+
+def complete_rows(path):
+    # the header, the IDs (first column) of the complete rows after it, and the size in bytes of the file up to 
+    # the end of the last complete row, for a results CSV that may end in a row cut off by a crash (with no 
+    # final newline, too few fields, or an unclosed quote); fields may contain newlines, e.g. prompts
+    header, ids, size = None, [], 0
+    with open(path, newline='', encoding='utf-8') as f:
+        consumed, last = 0, ''
+        def lines():
+            nonlocal consumed, last
+            for line in f:
+                consumed += len(line.encode('utf-8'))
+                last = line
+                yield line
+        try:
+            for row in csv.reader(lines()):
+                if not last.endswith('\n') or (header is not None and len(row) != len(header)):
+                    break
+                if header is None:
+                    header = row
+                else:
+                    ids.append(row[0])
+                size = consumed
+        except csv.Error:
+            pass
+    return header, ids, size
+
+class ResultsWriter:
+    # appends rows to a results CSV through an in-memory buffer, flushed every flush_rows rows or flush_seconds 
+    # seconds; after each flush, the file's size is checkpointed, so that a restart can drop a partially 
+    # written flush and resume. without a checkpoint, the rows already in the file are kept, and only a last 
+    # row cut off mid-write is dropped. IDs (the first column) in the file or written since are in done_ids
+    def __init__(self, path, header, flush_rows=500, flush_seconds=30):
+        self.path = path
+        self.checkpoint_path = f"{path}.checkpoint.json"
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
 
+        size = 0
+        if os.path.exists(path):
+            if os.path.exists(self.checkpoint_path):
+                with open(self.checkpoint_path) as f:
+                    checkpoint = json.load(f)['bytes']
+                if checkpoint <= os.path.getsize(path):
+                    with open(path, 'r+b') as f:
+                        f.truncate(checkpoint)  # drop anything written after the last checkpoint
+            existing_header, ids, size = complete_rows(path)
+            if existing_header is not None and existing_header != list(header):
+                raise ValueError(f"{path} has columns {existing_header}, not {list(header)}; use another --output")
+            with open(path, 'r+b') as f:
+                f.truncate(size)  # a partially written last row, if any
+            self.done_ids = set(ids)
+        else:
+            self.done_ids = set()
+
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.buffer = io.StringIO()
+        self.buffer_writer = csv.writer(self.buffer)
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+        if not size:
+            self.buffer_writer.writerow(header)
+            self.flush()
+
+    def writerow(self, row):
+        self.buffer_writer.writerow(row)
+        self.done_ids.add(str(row[0]))
+        self.buffered += 1
+        if self.buffered >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer.getvalue())
+        metrics.inc('bytes_written', self.buffer.tell())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = io.StringIO()
+        self.buffer_writer = csv.writer(self.buffer)
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+
+        with open(f"{self.checkpoint_path}.tmp", 'w') as f:
+            json.dump({'bytes': self.file.tell()}, f)
+        os.replace(f"{self.checkpoint_path}.tmp", self.checkpoint_path)  # atomic, so a crash can't corrupt it
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def shard_path(output_path, shard_index, num_shards):
+    stem, ext = os.path.splitext(output_path)
+    return f"{stem}.shard{shard_index}-of-{num_shards}{ext}"
+
+
+def merge_shards(output_path, num_shards):
+    # concatenate each shard's results, in shard order, into output_path; every shard must have the first's 
+    # columns (e.g. not one written by another --backend)
+    with open(f"{output_path}.tmp", 'w', newline='', encoding='utf-8') as out:
+        csv_writer = csv.writer(out)
+        seen = set()
+        for i in range(num_shards):
+            path = shard_path(output_path, i, num_shards)
+            with open(path, newline='', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                header = next(reader)
+                if i == 0:
+                    first_header = header
+                    csv_writer.writerow(header)
+                elif header != first_header:
+                    raise ValueError(f"{path} has columns {header}, not {first_header} (as in shard 0)")
+                for row in reader:
+                    if row[0] not in seen:  # ID
+                        seen.add(row[0])
+                        csv_writer.writerow(row)
+    os.replace(f"{output_path}.tmp", output_path)  # only once every shard is merged
+    print(f"merged {num_shards} shards ({len(seen)} rows) into {output_path}")
+
+
+@metrics.stage_metrics(name='nlp4sg_task2')
+@profiling.profiled(name='nlp4sg_task2')
 def main(args):
-    data=load_data("./nlp4sg_results_task_1.csv")
-    model=OpenAIModel(args['model'])
-    with open("results_task_2.csv", 'w', newline='') as file:
-        csv_writer = csv.writer(file)
-        cols=['ID', 'title', 'abstract', 'text', 'year', 'nlp4sg_score']
-        csv_writer.writerow(cols+model.response_columns)
-        for d in data:
-            output=model.predict(d['text'])
-            final_output=[d['ID'],d['title'],d['abstract'],d['text'],d['year'],d['nlp4sg_score']]
-            for c in model.response_columns:
-                final_output.append(output[c])
-            csv_writer.writerow(final_output)
+    if args['merge_shards']:
+        merge_shards(args['output'], args['num_shards'])
+        return
+
+    data=load_data(args['data'])
+    output_path=args['output']
+    if args['num_shards'] > 1:
+        # each shard is a contiguous range of rows, filled by its own process and merged afterwards
+        start = len(data) * args['shard_index'] // args['num_shards']
+        end = len(data) * (args['shard_index'] + 1) // args['num_shards']
+        data=data.select(range(start, end))
+        output_path=shard_path(output_path, args['shard_index'], args['num_shards'])
+
+    if args['backend'] == 'embedding':
+        model=EmbeddingModel(args['embedding_model'], args['sdg_threshold'], args['sdg_top_k'])
+    else:
+        model=OpenAIModel(args['model'], args['base_url'], args['concurrency'], args['rpm'], args['tpm'],
+                          cache_path=args['cache'], offline=args['reprocess_only'])
+    missing=0
+    id_column, cols=output_columns(data.column_names)
+    final_path=output_path
+    if args['reprocess_only']:
+        # rebuild every row from the cache into a fresh file, which replaces output_path once it's complete
+        output_path=f"{final_path}.reprocess.tmp"
+        for path in [output_path, f"{output_path}.checkpoint.json"]:
+            if os.path.exists(path):
+                os.remove(path)
+    writer=ResultsWriter(output_path, cols+model.response_columns, args['flush_rows'], args['flush_seconds'])
+    if writer.done_ids:
+        print(f"resuming: {len(writer.done_ids)} rows already in {output_path}")
+    try:
+        # predict a window of rows at a time, concurrently, then write them in input order
+        for batch in data.iter(batch_size=args['window']):
+            todo=[j for j in range(len(batch[id_column])) if str(batch[id_column][j]) not in writer.done_ids]
+            texts=input_texts(batch)
+            outputs=model.predict_many([texts[j] for j in todo])
+            for j, output in zip(todo, outputs):
+                if output is None:  # reprocessing, and no cached response
+                    missing+=1
+                    continue
+                final_output=[batch[c][j] for c in cols]
+                for c in model.response_columns:
+                    final_output.append(output[c])
+                writer.writerow(final_output)
+                metrics.inc('records')
+    finally:
+        writer.close()
+    if output_path != final_path:
+        # without a checkpoint in between, a resumed run reads whichever file is in place in full
+        if os.path.exists(f"{final_path}.checkpoint.json"):
+            os.remove(f"{final_path}.checkpoint.json")
+        os.replace(output_path, final_path)
+        os.replace(f"{output_path}.checkpoint.json", f"{final_path}.checkpoint.json")
+    if missing:
+        print(f"{missing} rows had no cached response and were not written")
 
 if __name__ == '__main__':
     args=argparse.ArgumentParser()
+    args.add_argument("--backend", type=str, default="openai", choices=["openai", "embedding"])
     args.add_argument("--model", type=str, default="text-davinci-002")
+    args.add_argument("--embedding_model", type=str, default="sentence-transformers/all-MiniLM-L6-v2", 
+                      help="sentence encoder for --backend embedding")
+    args.add_argument("--sdg_threshold", type=float, default=0.3, help="minimum cosine similarity to assign a goal (embedding)")
+    args.add_argument("--sdg_top_k", type=int, default=3, help="maximum goals assigned per paper (embedding)")
+    args.add_argument("--data", type=str, default="./nlp4sg_results_task_1.csv")
+    args.add_argument("--base_url", type=str, default=None, help="an OpenAI-compatible server, e.g. a local stand-in")
+    args.add_argument("--concurrency", type=int, default=8, help="maximum requests in flight")
+    args.add_argument("--rpm", type=int, default=None, help="maximum requests per minute")
+    args.add_argument("--tpm", type=int, default=None, help="maximum (estimated) tokens per minute")
+    args.add_argument("--cache", type=str, default="./nlp4sg_task2_cache.sqlite", help="prompt-response cache; '' to disable")
+    args.add_argument("--reprocess_only", action="store_true", 
+                      help="rebuild results from cached responses (e.g. after changing process_response), with no API calls")
+    args.add_argument("--output", type=str, default="results_task_2.csv")
+    args.add_argument("--flush_rows", type=int, default=500, help="rows buffered before results are flushed to disk")
+    args.add_argument("--flush_seconds", type=float, default=30, help="seconds between flushes, however few rows are buffered")
+    args.add_argument("--num_shards", type=int, default=1, help="split the input into this many contiguous shards")
+    args.add_argument("--shard_index", type=int, default=0, help="which shard this process fills")
+    args.add_argument("--merge_shards", action="store_true", help="merge --num_shards shard results into --output, then exit")
+    args.add_argument("--window", type=int, default=256, help="rows predicted concurrently before being written")
+    args.add_argument("--profile", type=str, default=None, 
+                      help="comma-separated profile modes (cpu, mem, rss, or all); see profiling.py")
+    args.add_argument("--profile_dir", type=str, default=None, help="where profile artifacts are written")
+    args.add_argument("--mem_budget_mb", type=float, default=None, 
+                      help="warn as RSS nears this (default: NLP4SG_MEM_BUDGET_MB, or the SLURM allocation)")
     args=vars(args.parse_args())
+    profiling.configure(args['profile'], args['profile_dir'], args['mem_budget_mb'])
     main(args)
\ No newline at end of file
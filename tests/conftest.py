@@ -0,0 +1,67 @@
+# shared fixtures: a small synthetic corpus (see synthetic.py), built once per session through the real stages
+# against the stand-in OpenAlex server, in a temporary corpora_path that every module reads at import
+from os.path import abspath, dirname
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+import sys
+
+import pytest
+
+repo = dirname(dirname(abspath(__file__)))
+sys.path[:0] = [f"{repo}/1. corpus creation", f"{repo}/2. NLP4SG classification"]
+
+# set before any stage module (and so paths.py) is imported; tests must never touch a real corpus
+corpora_path = mkdtemp(prefix="nlp4sg_tests_").replace("\\", "/")
+os.environ["NLP4SG_CORPORA_PATH"] = corpora_path
+os.environ["NLP4SG_METRICS_DIR"] = "off"
+
+
+@pytest.fixture(scope="session")
+def corpus():
+    """The synthetic corpus, extracted, matched to OpenAlex, and with authors.csv built; yields corpora_path."""
+    from synthetic import make_synthetic_corpus, serve_openalex
+    import create_subcorpora
+    import csv_builder
+
+    make_synthetic_corpus(corpora_path, n_works=300, n_files=2, seed=0)
+    server, url = serve_openalex(corpora_path)
+    create_subcorpora.openalex_endpoint = f"{url}/works"
+    try:
+        create_subcorpora.extract_from_s2orc(start=0, end=2)
+        create_subcorpora.extract_from_papers(start=0, end=2)
+        create_subcorpora.get_openalex_info(mailto="tests@example.com")
+        create_subcorpora.write_openalex_filepaths()
+        create_subcorpora.extract_authors()
+        csv_builder.make_author_csv()
+        yield corpora_path
+    finally:
+        server.shutdown()
+        rmtree(corpora_path, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def papers(corpus):
+    """papers.parquet (and concept_scores.npz) built by csv_builder() over the whole corpus; yields its path."""
+    import csv_builder
+
+    csv_builder.csv_builder(output_format="parquet")
+    return f"{csv_builder.csvs_path}/papers.parquet"
+
+
+@pytest.fixture
+def task1_cache(papers, tmp_path):
+    """A task 1 prediction cache holding a (deterministic, made-up) prediction for every NLP paper in papers, so
+    that nlp4sg_task1.run() never needs to load SciBERT; yields its path."""
+    from zlib import crc32
+    import nlp4sg_task1
+
+    path = str(tmp_path / "task1_cache.sqlite")
+    cache = nlp4sg_task1.PredictionCache(path)
+    texts = [text for chunk in nlp4sg_task1.iter_chunks(papers)
+             for text in nlp4sg_task1.build_texts(nlp4sg_task1.chunk_records(chunk))]
+    keys = [nlp4sg_task1.PredictionCache.key(nlp4sg_task1.backend_names["torch"], text) for text in texts]
+    labels = ["NLP4SG" if crc32(text.encode()) % 3 == 0 else "Not NLP4SG" for text in texts]
+    cache.put_many(keys, labels, [0.5 + crc32(text.encode()) % 50 / 100 for text in texts])
+    cache.conn.close()
+    return path
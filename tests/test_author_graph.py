@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from author_graph import aggregate, build_author_graph, load_author_graph, write_author_features
+
+
+def test_duplicated_work_counts_once(papers, tmp_path):
+    df = pd.read_parquet(papers)
+    build_author_graph(papers, str(tmp_path / "graph.npz"))
+    graph = load_author_graph(str(tmp_path / "graph.npz"))
+
+    # a non-ACL work listed again under another CorpusID, this time as ACL (e.g. from Subcorpora A and C)
+    row = df[~df["is_acl"] & df["author_ids"].map(len).gt(0)].iloc[0]
+    duplicate = {**row.to_dict(), "corpus_id": int(df["corpus_id"].max()) + 1, "is_acl": True}
+    duplicated_path = str(tmp_path / "papers.parquet")
+    pd.concat([df, pd.DataFrame([duplicate])], ignore_index=True).to_parquet(duplicated_path, index=False)
+    build_author_graph(duplicated_path, str(tmp_path / "duplicated.npz"))
+    duplicated = load_author_graph(str(tmp_path / "duplicated.npz"))
+
+    assert len(duplicated["openalex_ids"]) == len(set(df["openalex_id"])) == len(graph["openalex_ids"])
+    assert len(duplicated["columns"]) == len(graph["columns"])
+    authors = np.isin(graph["authors"], [int(a[1:]) for a in row["author_ids"]])
+    works = graph["acl_works"] + graph["non_acl_works"]
+    assert (duplicated["acl_works"] + duplicated["non_acl_works"] == works).all()  # not counted twice
+    assert (duplicated["acl_works"][authors] == graph["acl_works"][authors] + 1).all()  # now an ACL work
+    assert (duplicated["acl_works"][~authors] == graph["acl_works"][~authors]).all()
+
+    acl_contribs = aggregate(duplicated, duplicated["acl_works"], "max")
+    assert acl_contribs.index.is_unique
+    assert pd.read_parquet(duplicated_path)["openalex_id"].map(acl_contribs).notna().any()
+
+    write_author_features(str(tmp_path / "duplicated.npz"), str(tmp_path / "features.csv"))
+    assert pd.read_csv(tmp_path / "features.csv")["openalex_id"].is_unique
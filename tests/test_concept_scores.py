@@ -0,0 +1,63 @@
+from glob import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import csv_builder
+from csv_builder import csvs_path
+
+
+def nlp_scores():
+    """Scores of NLP concepts in the corpus, i.e. thresholds that land exactly on a boundary."""
+    scores = csv_builder.load_concept_scores([f"{csvs_path}/concept_scores.npz"])
+    nlp_ids = [int(c[1:]) for c in csv_builder.concepts]
+    return np.unique(scores["scores"][np.isin(scores["concepts"], nlp_ids)])
+
+
+def test_recompute_matches_build_at_boundaries(papers):
+    boundaries = nlp_scores()
+    thresholds = [0.0, float(np.median(boundaries)), float(boundaries[0]), float(boundaries[-1])]
+    try:
+        for threshold in thresholds:
+            csv_builder.csv_builder(threshold=threshold, output_format="parquet")
+            built = pd.read_parquet(papers)
+            recomputed = csv_builder.recompute_is_nlp(csv_builder.load_concept_scores(), threshold)
+
+            assert (built["openalex_id"].map(recomputed) == built["is_nlp"]).all(), threshold
+    finally:
+        csv_builder.csv_builder(output_format="parquet")  # restore the fixture's threshold
+
+
+@pytest.fixture
+def ranged_scores(papers):
+    """Overlapping job-range concept score files, written after concept_scores.npz, removed afterwards."""
+    csv_builder.csv_builder(start=0, end=5000)
+    csv_builder.csv_builder(start=4000, end=10000)
+    yield
+    for path in glob(f"{csvs_path}/papers_subcsv_*") + glob(f"{csvs_path}/concept_scores_*-*.npz"):
+        os.remove(path)
+
+
+def test_load_never_stacks_full_and_ranged_files(papers, ranged_scores):
+    full = csv_builder.load_concept_scores([f"{csvs_path}/concept_scores.npz"])
+    ranged = csv_builder.load_concept_scores()  # the ranged files are newer
+
+    low = np.load(f"{csvs_path}/concept_scores_0-5000.npz")["openalex_ids"]
+    high = np.load(f"{csvs_path}/concept_scores_4000-10000.npz")["openalex_ids"]
+    assert len(ranged["openalex_ids"]) == len(low) + len(high) < 2 * len(full["openalex_ids"])
+
+    os.utime(f"{csvs_path}/concept_scores.npz")  # now the full file is newer
+    assert len(csv_builder.load_concept_scores()["openalex_ids"]) == len(full["openalex_ids"])
+
+
+def test_recompute_index_is_unique_with_overlapping_ranges(papers, ranged_scores):
+    ranged = csv_builder.load_concept_scores(sorted(glob(f"{csvs_path}/concept_scores_*-*.npz")))
+    assert pd.Series(ranged["openalex_ids"]).duplicated().any()  # the ranges overlap
+
+    recomputed = csv_builder.recompute_is_nlp(ranged)
+    built = pd.read_parquet(papers)
+
+    assert recomputed.index.is_unique
+    assert (built["openalex_id"].map(recomputed) == built["is_nlp"]).all()
@@ -0,0 +1,31 @@
+import create_subcorpora
+from paths import datasets_path
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [line.strip() for line in f]
+
+
+def test_parts_merge_to_shared_files(corpus, tmp_path):
+    parts_dir, out_dir = str(tmp_path / "parts"), str(tmp_path / "merged")
+    (tmp_path / "merged").mkdir()
+
+    # every JSONL separately, as pipeline.py's partitions do; the papers were already extracted (into the shared
+    # files) by the corpus fixture, and their CorpusIDs must still be listed
+    for i in range(2):
+        create_subcorpora.extract_from_s2orc(start=i, end=i + 1, parts_dir=parts_dir)
+    for i in range(2):
+        create_subcorpora.extract_from_papers(start=i, end=i + 1, parts_dir=parts_dir)
+    create_subcorpora.merge_corpusids(parts_dir, out_dir)
+
+    for name in ["acl_corpusids.txt", "non_acl_corpusids.txt", "missing_from_s2orc.txt"]:
+        merged = read_lines(f"{out_dir}/{name}")
+        assert merged and len(merged) == len(set(merged))
+        assert set(merged) == set(read_lines(f"{datasets_path}/{name}")), name
+
+    # a rerun rewrites its own JSONL's files rather than appending to them
+    create_subcorpora.extract_from_s2orc(start=0, end=1, parts_dir=parts_dir)
+    create_subcorpora.merge_corpusids(parts_dir, out_dir)
+    merged = read_lines(f"{out_dir}/non_acl_corpusids.txt")
+    assert len(merged) == len(set(merged)) == len(set(read_lines(f"{datasets_path}/non_acl_corpusids.txt")))
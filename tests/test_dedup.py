@@ -0,0 +1,40 @@
+import pandas as pd
+
+from dedup import find_duplicates, redundant_rows
+
+
+def test_find_duplicates_labels(papers, tmp_path):
+    df = pd.read_parquet(papers)
+    canonical_path = str(tmp_path / "canonical_ids.csv")
+    find_duplicates(papers, canonical_path)
+    assert pd.read_csv(canonical_path).empty  # the synthetic corpus has no duplicates of its own
+
+    titled = df[df["title"].str.len().gt(0) & df["author_ids"].map(len).gt(0)]
+    acl = titled[titled["is_acl"]].iloc[0]
+    r1, r2 = titled[~titled["is_acl"]].iloc[0], titled[~titled["is_acl"]].iloc[1]
+    new_id = int(df["corpus_id"].max())
+
+    def copy(row, corpus_id, **changes):
+        return {**row.to_dict(), "corpus_id": corpus_id, "is_acl": False, **changes}
+
+    added = pd.DataFrame([
+        copy(acl, new_id + 1, openalex_id="W9000000001"),  # the ACL paper under another CorpusID
+        copy(r1, new_id + 2, title="An Unrelated Title"),  # matched to the same OpenAlex work as r1
+        copy(r2, new_id + 3, openalex_id="W9000000003"),  # r2 again, whose OpenAlex work is shared with...
+        copy(r2, new_id + 4, openalex_id="W9000000003", title="Yet Another Title"),  # ...this: a chain
+    ])
+    duplicated = str(tmp_path / "papers.parquet")
+    pd.concat([df, added], ignore_index=True).to_parquet(duplicated, index=False)
+    find_duplicates(duplicated, canonical_path)
+
+    mapping = pd.read_csv(canonical_path).set_index("corpus_id")
+    expected = {acl["corpus_id"]: acl, new_id + 1: acl, r1["corpus_id"]: r1, new_id + 2: r1,
+                r2["corpus_id"]: r2, new_id + 3: r2, new_id + 4: r2}
+    assert set(mapping.index) == set(expected)
+    for corpus_id, canonical in expected.items():
+        assert mapping.loc[corpus_id, "canonical_corpus_id"] == canonical["corpus_id"]
+        assert mapping.loc[corpus_id, "canonical_openalex_id"] == canonical["openalex_id"]
+
+    assert set(mapping.index[mapping["same_title"]]) == {acl["corpus_id"], new_id + 1, r2["corpus_id"], new_id + 3}
+    assert set(mapping.index[mapping["shared_openalex_id"]]) == {r1["corpus_id"], new_id + 2, new_id + 3, new_id + 4}
+    assert set(redundant_rows(canonical_path).get_level_values("corpus_id")) == {new_id + 1, new_id + 2, new_id + 3, new_id + 4}
@@ -0,0 +1,62 @@
+from glob import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import csv_builder
+from csv_builder import csvs_path
+
+
+@pytest.fixture
+def subcsvs(papers):
+    """Overlapping job-range subcsvs (one CSV, one Parquet), removed afterwards."""
+    csv_builder.csv_builder(start=0, end=5000)
+    csv_builder.csv_builder(start=4000, end=10000, output_format="parquet")
+    yield
+    for path in glob(f"{csvs_path}/papers_subcsv_*") + glob(f"{csvs_path}/concept_scores_*-*.npz") + \
+                glob(f"{csvs_path}/papers_merged.*"):
+        os.remove(path)
+
+
+def test_merge_drops_overlaps_and_reconciles(papers, subcsvs):
+    full = pd.read_parquet(papers)
+    low = pd.read_csv(f"{csvs_path}/papers_subcsv_0-5000.csv")
+    high = pd.read_parquet(f"{csvs_path}/papers_subcsv_4000-10000.parquet")
+    overlap = len(set(low["corpus_id"]) & set(high["corpus_id"]))
+    assert overlap > 0
+
+    result = csv_builder.merge_csvs(chunksize=25)
+    merged = pd.read_csv(f"{csvs_path}/papers_merged.csv")
+
+    assert result["ok"]
+    assert result == {"subcsv_rows": len(low) + len(high), "merged_rows": len(full), "dropped": overlap,
+                      "dupe_corpus_ids": 0, "dupe_openalex_ids": 0, "ok": True}
+    assert sorted(merged["corpus_id"]) == sorted(full["corpus_id"])
+
+
+def test_merge_drops_missing_ids(papers, subcsvs):
+    extra = pd.read_parquet(papers).head(3)
+    extra.loc[extra.index[0], "corpus_id"] = np.nan
+    extra.loc[extra.index[1], "openalex_id"] = None
+    extra["corpus_id"] = extra["corpus_id"].astype("Int64")
+    extra.iloc[1:].to_csv(f"{csvs_path}/papers_subcsv_9999-10000.csv", index=False)  # the last row is a duplicate
+    extra.iloc[:1].to_csv(f"{csvs_path}/papers_subcsv_9998-9999.csv", index=False)
+
+    result = csv_builder.merge_csvs()
+
+    assert result["ok"]
+    assert result["merged_rows"] == len(pd.read_parquet(papers))
+
+
+def test_filter_unseen_across_chunks():
+    seen = []
+    chunks = [np.array([5, 3, 5, 9]), np.array([3, 4, 10, 4]), np.array([1, 2, 11, 12, 13]), np.array([13, 0])]
+    masks = [csv_builder.filter_unseen(ids, seen) for ids in chunks]
+
+    assert [m.tolist() for m in masks] == [[True, True, False, True], [False, True, True, False], 
+                                           [True] * 5, [False, True]]
+    assert all((np.diff(run) > 0).all() for run in seen)  # each run is sorted...
+    assert sorted(np.concatenate(seen).tolist()) == list(range(6)) + [9, 10, 11, 12, 13]  # ...and they're disjoint
+    assert all(len(a) > len(b) for a, b in zip(seen, seen[1:]))
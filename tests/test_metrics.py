@@ -0,0 +1,27 @@
+import os
+
+import metrics
+
+
+def run_stage(directory):
+    @metrics.stage_metrics(str(directory), name="example")
+    def example():
+        metrics.inc("records", 3)
+    example()
+
+
+def test_snapshots_off_by_default(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "metrics_dir", None)
+    run_stage(tmp_path / "metrics")
+    assert not os.path.exists(tmp_path / "metrics")
+    assert metrics.counters[("records", ())] == 3  # still counted
+
+
+def test_snapshots_when_dir_set(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "metrics_dir", str(tmp_path / "elsewhere"))
+    run_stage(tmp_path / "metrics")
+    assert os.listdir(tmp_path / "elsewhere") == [f"example-{os.getpid()}.json"]
+
+    monkeypatch.setattr(metrics, "metrics_dir", "on")
+    run_stage(tmp_path / "metrics")
+    assert os.listdir(tmp_path / "metrics") == [f"example-{os.getpid()}.json"]
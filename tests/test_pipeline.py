@@ -0,0 +1,43 @@
+import sys
+
+import pytest
+
+import pipeline
+
+
+def checkpointed_stage(tmp_path, resume, tag="a"):
+    """A stage whose command appends a line to its output (as a checkpointed script would), failing while
+    tmp_path/fail exists."""
+    out, fail = tmp_path / "out.txt", tmp_path / "fail"
+    script = (f"import os, sys; open({str(out)!r}, 'a').write({tag!r} + '\\n'); "
+              f"sys.exit(1 if os.path.exists({str(fail)!r}) else 0)")
+    key = f"checkpointed[{tmp_path.name}]"
+    return [{"name": "checkpointed", "after": [], "partitions": lambda: [
+        pipeline.partition(key, [sys.executable, "-c", script], outputs=[str(out)], clean=[str(out)], resume=resume)]}]
+
+
+def lines(tmp_path):
+    return (tmp_path / "out.txt").read_text().split()
+
+
+def test_failed_partition_resumes(tmp_path):
+    (tmp_path / "fail").touch()
+    with pytest.raises(RuntimeError):
+        pipeline.run_pipeline(checkpointed_stage(tmp_path, resume=True), jobs=1)
+    (tmp_path / "fail").unlink()
+
+    pipeline.run_pipeline(checkpointed_stage(tmp_path, resume=True), jobs=1)
+    assert lines(tmp_path) == ["a", "a"]  # kept the failed attempt's output
+
+    pipeline.run_pipeline(checkpointed_stage(tmp_path, resume=True, tag="b"), jobs=1)
+    assert lines(tmp_path) == ["b"]  # parameters changed: cleaned
+
+
+def test_failed_partition_without_resume_is_cleaned(tmp_path):
+    (tmp_path / "fail").touch()
+    with pytest.raises(RuntimeError):
+        pipeline.run_pipeline(checkpointed_stage(tmp_path, resume=False), jobs=1)
+    (tmp_path / "fail").unlink()
+
+    pipeline.run_pipeline(checkpointed_stage(tmp_path, resume=False), jobs=1)
+    assert lines(tmp_path) == ["a"]
@@ -0,0 +1,18 @@
+import os
+import time
+
+import profiling
+
+
+def test_budget_warns_without_profile_modes(tmp_path, monkeypatch, capsys):
+    monkeypatch.setitem(profiling.profile_config, "modes", set())
+    monkeypatch.setitem(profiling.profile_config, "budget_mb", 1.0)  # any process is over it
+    monkeypatch.setitem(profiling.profile_config, "rss_interval", 0.01)
+
+    @profiling.profiled(str(tmp_path / "profiles"))
+    def stage():
+        time.sleep(0.2)
+    stage()
+
+    assert "memory budget" in capsys.readouterr().err
+    assert not os.path.exists(tmp_path / "profiles")  # nothing profiled, so no artifacts
@@ -0,0 +1,73 @@
+import os
+
+import pandas as pd
+import pytest
+
+from nlp4sg_task2 import ResultsWriter, merge_shards, shard_path
+
+header = ["corpus_id", "prompt", "response"]
+
+
+def write(path, rows, **kwargs):
+    writer = ResultsWriter(path, header, **kwargs)
+    for row in rows:
+        writer.writerow(row)
+    writer.close()
+    return writer
+
+
+def rows(start, end):
+    return [[i, f"title {i}\nabstract, \"quoted\" {i}", f"Goal {i % 17 + 1}"] for i in range(start, end)]
+
+
+def test_resume_without_checkpoint_keeps_rows(tmp_path):
+    path = str(tmp_path / "results.csv")
+    write(path, rows(0, 10), flush_rows=3)
+    os.remove(f"{path}.checkpoint.json")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('10,"title 10\nabstr')  # cut off mid-row, inside a quoted field
+
+    writer = ResultsWriter(path, header)
+    assert writer.done_ids == {str(i) for i in range(10)}
+    for row in rows(10, 12):
+        writer.writerow(row)
+    writer.close()
+
+    results = pd.read_csv(path)
+    assert results["corpus_id"].tolist() == list(range(12))
+    assert results["prompt"].tolist() == [row[1] for row in rows(0, 12)]
+
+
+def test_resume_drops_rows_after_checkpoint(tmp_path):
+    path = str(tmp_path / "results.csv")
+    write(path, rows(0, 5))
+    with open(path, "a", encoding="utf-8", newline="") as f:
+        f.write("5,unflushed,row\r\n")  # complete, but written after the last checkpoint
+
+    assert ResultsWriter(path, header).done_ids == {str(i) for i in range(5)}
+    assert pd.read_csv(path)["corpus_id"].tolist() == list(range(5))
+
+
+def test_written_ids_are_done(tmp_path):
+    writer = write(str(tmp_path / "results.csv"), rows(0, 4), flush_rows=100)
+    assert writer.done_ids == {"0", "1", "2", "3"}
+
+
+def test_other_columns_are_not_overwritten(tmp_path):
+    path = str(tmp_path / "results.csv")
+    pd.DataFrame({"ID": [1], "text": ["x"]}).to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        ResultsWriter(path, header)
+    assert pd.read_csv(path)["ID"].tolist() == [1]
+
+
+def test_merge_shards_rejects_other_columns(tmp_path):
+    output = str(tmp_path / "results.csv")
+    write(shard_path(output, 0, 2), rows(0, 3))
+    write(shard_path(output, 1, 2), rows(3, 5))
+    merge_shards(output, 2)
+    assert pd.read_csv(output)["corpus_id"].tolist() == list(range(5))
+
+    pd.DataFrame({"corpus_id": [5], "prompt": ["p"], "sdg1": [1]}).to_csv(shard_path(output, 1, 2), index=False)
+    with pytest.raises(ValueError):
+        merge_shards(output, 2)
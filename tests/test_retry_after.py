@@ -0,0 +1,21 @@
+import datetime
+
+from nlp4sg_task2 import retry_delay
+
+now = datetime.datetime(2024, 5, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_seconds():
+    assert retry_delay("7", now) == 7.0
+    assert retry_delay("1.5", now) == 1.5
+    assert retry_delay("-3", now) == 0.0
+
+
+def test_http_date():
+    assert retry_delay("Wed, 01 May 2024 12:00:30 GMT", now) == 30.0
+    assert retry_delay("Wed, 01 May 2024 11:59:00 GMT", now) == 0.0  # already past
+
+
+def test_unparseable_falls_back():
+    for retry_after in [None, "", "soon", "inf", "nan"]:
+        assert retry_delay(retry_after, now) is None
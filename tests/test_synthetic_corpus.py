@@ -0,0 +1,29 @@
+import pandas as pd
+
+from paths import datasets_path
+
+
+def test_every_found_work_gets_a_row(papers):
+    df = pd.read_parquet(papers)
+    with open(f"{datasets_path}/openalex_paths.txt") as f:
+        paths = {line.strip() for line in f}
+
+    assert len(df) == len(paths) > 0
+    assert set(df["openalex_path"]) == paths
+    assert df["corpus_id"].is_unique and df["openalex_id"].is_unique
+
+
+def test_subcorpus_matches_is_acl(papers):
+    df = pd.read_parquet(papers)
+    in_sub_a = df["openalex_path"].str.contains("/subcorpus_a/")
+
+    assert (in_sub_a == df["is_acl"]).all()
+    assert df["is_acl"].any() and not df["is_acl"].all()
+
+
+def test_worker_processes_match_one_process(papers):
+    import csv_builder
+
+    expected = pd.read_parquet(papers)
+    csv_builder.csv_builder(output_format="parquet", processes=2)  # workers get the author lookup by fork
+    pd.testing.assert_frame_equal(pd.read_parquet(papers), expected)
@@ -0,0 +1,46 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import nlp4sg_task1
+
+
+def test_resume_after_crash(papers, task1_cache, tmp_path, monkeypatch):
+    expected = str(tmp_path / "uninterrupted.parquet")
+    nlp4sg_task1.run(papers, expected, chunk_size=10, cache_path=task1_cache)
+
+    # crash while classifying the third chunk
+    output = str(tmp_path / "results.parquet")
+    predict, calls = nlp4sg_task1.predict, []
+    def crashing_predict(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 3: raise RuntimeError("killed")
+        return predict(*args, **kwargs)
+    monkeypatch.setattr(nlp4sg_task1, "predict", crashing_predict)
+    with pytest.raises(RuntimeError):
+        nlp4sg_task1.run(papers, output, chunk_size=10, cache_path=task1_cache)
+    with open(f"{output}.checkpoint.json") as f:
+        assert json.load(f)["rows"] == 20
+
+    monkeypatch.setattr(nlp4sg_task1, "predict", predict)
+    nlp4sg_task1.run(papers, output, chunk_size=10, cache_path=task1_cache)
+
+    assert sorted(os.listdir(output)) == sorted(os.listdir(expected))
+    pd.testing.assert_frame_equal(pd.read_parquet(output), pd.read_parquet(expected))
+
+
+def test_resume_refuses_another_mapping(papers, task1_cache, tmp_path):
+    df = pd.read_parquet(papers, columns=["corpus_id", "openalex_id"])
+    canonical_path = str(tmp_path / "canonical_ids.csv")
+    pd.DataFrame({"corpus_id": df["corpus_id"][:2], "openalex_id": df["openalex_id"][:2],
+                  "canonical_corpus_id": df["corpus_id"][0], "canonical_openalex_id": df["openalex_id"][0],
+                  "same_title": True, "shared_openalex_id": False}).to_csv(canonical_path, index=False)
+
+    output = str(tmp_path / "results.parquet")
+    nlp4sg_task1.run(papers, output, chunk_size=10, cache_path=task1_cache, canonical_path=canonical_path)
+    assert df["corpus_id"][1] not in set(pd.read_parquet(output)["corpus_id"])  # skipped as a duplicate
+
+    with pytest.raises(ValueError):
+        nlp4sg_task1.run(papers, output, chunk_size=10, cache_path=task1_cache)  # without the mapping
@@ -0,0 +1,88 @@
+import pandas as pd
+
+import nlp4sg_task1
+import nlp4sg_task2
+
+
+def task2_args(data, output, cache):
+    return {"merge_shards": False, "data": data, "output": output, "num_shards": 1, "shard_index": 0,
+            "backend": "openai", "model": "text-davinci-002", "base_url": None, "concurrency": 1, "rpm": None,
+            "tpm": None, "cache": cache, "reprocess_only": True, "flush_rows": 10, "flush_seconds": 30, "window": 16}
+
+
+def test_task1_parquet_output_is_task2_input(papers, task1_cache, tmp_path):
+    task1_output = str(tmp_path / "nlp4sg_results_task_1.parquet")
+    nlp4sg_task1.run(papers, task1_output, chunk_size=50, cache_path=task1_cache)
+
+    results = pd.read_parquet(task1_output)
+    nlp4sg = results[results["nlp4sg_label"] == "NLP4SG"]
+    assert 0 < len(nlp4sg) < len(results)
+
+    data = nlp4sg_task2.load_data(task1_output)  # the directory of parts, not a single file
+    assert sorted(data["corpus_id"]) == sorted(nlp4sg["corpus_id"])
+    assert "nlp4sg_label" not in data.column_names  # only task2_columns are read
+
+    id_column, columns = nlp4sg_task2.output_columns(data.column_names)
+    assert id_column == "corpus_id" and columns[0] == "corpus_id"
+    assert set(columns) == set(nlp4sg_task2.task2_columns) & set(results.columns)
+    assert {"openalex_id", "title", "nlp4sg_score"} <= set(columns)
+
+    # answer every other prompt from the cache; offline, the rest are reported missing rather than requested
+    model = nlp4sg_task2.OpenAIModel("text-davinci-002", cache_path=str(tmp_path / "task2_cache.sqlite"))
+    texts = nlp4sg_task2.input_texts(data[:])
+    for text in texts[::2]:
+        model.cache_prediction({"prompt": model.build_prompt(text), "response": "Goal 3: Good Health and Well-Being"})
+    model.cache.conn.close()
+
+    task2_output = str(tmp_path / "results_task_2.csv")
+    nlp4sg_task2.main(task2_args(task1_output, task2_output, str(tmp_path / "task2_cache.sqlite")))
+
+    written = pd.read_csv(task2_output)
+    assert list(written.columns[:len(columns)]) == columns
+    assert sorted(written["corpus_id"]) == sorted(data["corpus_id"][::2])
+    assert (written["sdg3"] == 1).all()
+
+
+def task1_results(tmp_path):
+    """A small task 1 results table, by hand: half of it NLP4SG."""
+    return pd.DataFrame({"corpus_id": range(1, 9), "openalex_id": [f"W{i}" for i in range(1, 9)],
+                         "title": [f"Title {i}" for i in range(1, 9)], "abstract": [f"Abstract {i}" for i in range(1, 9)],
+                         "nlp4sg_label": ["NLP4SG", "Not NLP4SG"] * 4, "nlp4sg_score": [0.9] * 8})
+
+
+def cache_responses(path, data, response):
+    model = nlp4sg_task2.OpenAIModel("text-davinci-002", cache_path=path)
+    for text in nlp4sg_task2.input_texts(data[:]):
+        model.cache_prediction({"prompt": model.build_prompt(text), "response": response})
+    model.cache.conn.close()
+
+
+def test_reprocess_rebuilds_existing_rows(tmp_path, monkeypatch):
+    data_path, cache, output = str(tmp_path / "task1.parquet"), str(tmp_path / "cache.sqlite"), str(tmp_path / "task2.csv")
+    task1_results(tmp_path).to_parquet(data_path, index=False)
+    cache_responses(cache, nlp4sg_task2.load_data(data_path), "Goal 3: Good Health and Well-Being")
+
+    nlp4sg_task2.main(task2_args(data_path, output, cache))
+    assert (pd.read_csv(output)["sdg3"] == 1).all()
+
+    # e.g. a fix to process_response(): every row is rebuilt, not skipped as already done
+    process_response = nlp4sg_task2.OpenAIModel.process_response
+    monkeypatch.setattr(nlp4sg_task2.OpenAIModel, "process_response",
+                        lambda self, pred: {**process_response(self, pred), "sdg3": 0.0})
+    nlp4sg_task2.main(task2_args(data_path, output, cache))
+
+    rebuilt = pd.read_csv(output)
+    assert rebuilt["corpus_id"].tolist() == [1, 3, 5, 7]
+    assert (rebuilt["sdg3"] == 0).all()
+    assert not any(name.endswith(".tmp") for name in map(str, tmp_path.iterdir()))
+
+
+def test_csv_and_parquet_results_give_the_same_input(tmp_path):
+    results = task1_results(tmp_path)
+    results.to_csv(tmp_path / "task1.csv", index=False)
+    results.to_parquet(tmp_path / "task1.parquet", index=False)
+
+    from_csv = nlp4sg_task2.load_data(str(tmp_path / "task1.csv"))
+    from_parquet = nlp4sg_task2.load_data(str(tmp_path / "task1.parquet"))
+    assert from_csv["corpus_id"] == from_parquet["corpus_id"] == [1, 3, 5, 7]  # only NLP4SG papers
+    assert from_csv.column_names == from_parquet.column_names